@@ -0,0 +1,286 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.renderers import JSONRenderer
+
+from middlewares.phases import current, phase
+from users.authentication import ClaimsJWTAuthentication
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency (seconds) and query count histogram buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Phases reported in Server-Timing, in order; ``app`` is the view time not spent in the others.
+PHASES = ('auth', 'db', 'serialize', 'render')
+SLOW_QUERY_SAMPLES = 3
+PROFILE_QUERY_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+class Collector:
+    """What one request spent its time on, see ``middlewares.phases``."""
+
+    def __init__(self) -> None:
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.duplicates = 0
+        self.seen = set()
+        self.slow = []
+
+    def add_query(self, sql: str, duration: float) -> None:
+        self.queries += 1
+        self.phases['db'] += duration
+        # The same statement with other parameters is the N+1 pattern.
+        if sql in self.seen:
+            self.duplicates += 1
+        else:
+            self.seen.add(sql)
+        if duration * 1000 >= settings.INSTRUMENTATION_SLOW_QUERY_MS:
+            self.slow.append({'sql': sql[:500], 'ms': round(duration * 1000, 2)})
+
+
+def record_query(execute, sql, params, many, context):
+    collector = current.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        collector.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(connection, **kwargs) -> None:
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_query_recorders() -> None:
+    # Connections are per thread; new ones get the recorder from ``connection_created``.
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(connection)
+
+
+class TimedJWTAuthentication(ClaimsJWTAuthentication):
+    """``ClaimsJWTAuthentication`` counted in the ``auth`` phase, the default with ``INSTRUMENTATION_ENABLED``."""
+
+    def authenticate(self, request):
+        with phase('auth'):
+            return super().authenticate(request)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` counted in the ``render`` phase, the default with ``INSTRUMENTATION_ENABLED``."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with phase('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class Histogram:
+    def __init__(self, bounds) -> None:
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def lines(self, name: str, labels: str) -> list[str]:
+        lines = [f'{name}_bucket{{{labels},le="{bound}"}} {count}' for bound, count in zip(self.bounds, self.counts)]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Metrics:
+    """Per process request histograms labelled by route name, method and status class."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, labels: tuple, collector: Collector, duration: float) -> None:
+        with self.lock:
+            if labels not in self.series:
+                self.series[labels] = {
+                    'duration': Histogram(DURATION_BUCKETS),
+                    'db': Histogram(DURATION_BUCKETS),
+                    'queries': Histogram(QUERY_BUCKETS),
+                    'duplicates': 0,
+                }
+            series = self.series[labels]
+            series['duration'].observe(duration)
+            series['db'].observe(collector.phases['db'])
+            series['queries'].observe(collector.queries)
+            series['duplicates'] += collector.duplicates
+
+    def clear(self) -> None:
+        with self.lock:
+            self.series.clear()
+
+    def render(self) -> str:
+        families = [
+            ('http_request_duration_seconds', 'histogram', 'Request latency.'),
+            ('http_request_db_seconds', 'histogram', 'Time spent in SQL queries per request.'),
+            ('http_request_db_queries', 'histogram', 'SQL queries per request.'),
+            ('http_request_db_duplicate_queries_total', 'counter', 'Queries repeating a statement of the same request.'),
+        ]
+        with self.lock:
+            series = sorted(self.series.items())
+            lines = []
+            for (name, kind, description), key in zip(families, ('duration', 'db', 'queries', 'duplicates')):
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+                for (route, method, status), values in series:
+                    labels = f'route="{route}",method="{method}",status="{status}"'
+                    if kind == 'histogram':
+                        lines += values[key].lines(name, labels)
+                    else:
+                        lines.append(f'{name}{{{labels}}} {values[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def route_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else 'unmatched'
+
+
+def profile_asked(request) -> bool:
+    """
+    Explicit ``?profile=1`` (or ``X-Profile: 1``) requests sending a token. Whether they come
+    from staff is only known once the view authenticated them, see ``is_staff``.
+    """
+    asked = request.GET.get(PROFILE_QUERY_PARAM) == '1' or request.META.get(PROFILE_HEADER) == '1'
+    return asked and 'HTTP_AUTHORIZATION' in request.META
+
+
+def profile_sampled() -> bool:
+    rate = settings.INSTRUMENTATION_PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def is_staff(request) -> bool:
+    # DRF sets the user it authenticated on the Django request too.
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and user.is_staff
+
+
+def save_profile(profiler: cProfile.Profile, request) -> str:
+    directory = settings.INSTRUMENTATION_PROFILE_DIR or tempfile.gettempdir()
+    os.makedirs(directory, exist_ok=True)
+    name = f'{route_name(request).replace(":", "-")}-{time.time_ns()}.prof'
+    profiler.dump_stats(os.path.join(directory, name))
+    return name
+
+
+class InstrumentationMiddleware:
+    """
+    Per-request timing of the auth, db, serialize and render phases, SQL query counts with
+    duplicated statements and slow query samples. Reported in a ``Server-Timing`` header, a
+    JSON log line and the histograms of ``metrics_view``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_recorder, dispatch_uid='instrumentation_query_recorder')
+        install_query_recorders()
+        self.thread_sensitive_installed = False
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        asked, sampled = profile_asked(request), profile_sampled()
+        collector = Collector()
+        token = current.set(collector)
+        started = time.perf_counter()
+        try:
+            if asked or sampled:
+                profiler = cProfile.Profile()
+                response = profiler.runcall(self.get_response, request)
+                # Explicit profiles of requests that did not authenticate as staff are dropped.
+                if sampled or is_staff(request):
+                    response['X-Profile'] = save_profile(profiler, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        self.report(request, response, collector, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile only follows the calling thread, so async requests are not profiled.
+        if not self.thread_sensitive_installed:
+            # The ORM of async views runs in the thread sensitive executor, which may have
+            # connected before this middleware was loaded.
+            await sync_to_async(install_query_recorders)()
+            self.thread_sensitive_installed = True
+        collector = Collector()
+        token = current.set(collector)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.report(request, response, collector, time.perf_counter() - started)
+        return response
+
+    def report(self, request, response, collector: Collector, duration: float) -> None:
+        route = route_name(request)
+        phases = {name: seconds * 1000 for name, seconds in collector.phases.items()}
+        # The serialize phase includes its own queries.
+        phases['app'] = max(duration * 1000 - phases['auth'] - phases['db'] - phases['serialize'] - phases['render'], 0)
+
+        timings = [f'{name};dur={ms:.2f}' for name, ms in phases.items()]
+        timings.append(f'total;dur={duration * 1000:.2f}')
+        timings.append(f'queries;desc="{collector.queries} ({collector.duplicates} duplicated)"')
+        response['Server-Timing'] = ', '.join(timings)
+
+        metrics.observe((route, request.method, f'{response.status_code // 100}xx'), collector, duration)
+        logger.info(json.dumps({
+            'route': route,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'phases_ms': {name: round(ms, 2) for name, ms in phases.items()},
+            'queries': collector.queries,
+            'duplicate_queries': collector.duplicates,
+            'slow_queries': sorted(collector.slow, key=lambda query: -query['ms'])[:SLOW_QUERY_SAMPLES],
+        }))
+
+
+def metrics_view(request):
+    """Prometheus text exposition of the request histograms, behind ``INSTRUMENTATION_METRICS_TOKEN``."""
+    token = settings.INSTRUMENTATION_METRICS_TOKEN
+    if token:
+        if request.META.get('HTTP_AUTHORIZATION') != f'Bearer {token}':
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
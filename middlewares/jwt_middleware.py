@@ -1,6 +1,15 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
 class JWTAuthCookieMiddleware:
+    # Async capable so requests to async views (the ASGI stream) stay on the event loop.
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response) -> None:
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def process_request(self, request):
         access_token = request.COOKIES.get('access_token')
@@ -8,8 +17,16 @@ class JWTAuthCookieMiddleware:
             request.META['HTTP_AUTHORIZATION'] = f'Bearer {access_token}'
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         self.process_request(request)
 
         response = self.get_response(request)
 
         return response
+
+    async def __acall__(self, request):
+        self.process_request(request)
+
+        return await self.get_response(request)
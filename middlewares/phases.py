@@ -0,0 +1,38 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# The ``middlewares.instrumentation.Collector`` of the request being instrumented, if any.
+# Lives in a context variable, so it follows the request into the threads ``sync_to_async``
+# runs the ORM in.
+current = ContextVar('request_instrumentation', default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Add the time spent in the block to the ``name`` phase of the current request. Does
+    nothing unless ``InstrumentationMiddleware`` is installed, so app code can mark its
+    phases without depending on the instrumentation.
+    """
+    collector = current.get()
+    if collector is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.phases[name] += time.perf_counter() - started
+
+
+def timed(name: str):
+    """Decorator counting the calls of a function in the ``name`` phase, see ``phase``."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
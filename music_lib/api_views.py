@@ -1,28 +1,39 @@
 import os
-import re
 
 import rest_framework.permissions
-from django.db.models import OuterRef, Exists, Prefetch, BooleanField, Value
-from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.http import Http404, HttpResponse
+from django.http.response import HttpResponseBase
+from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
 from django_filters.rest_framework import DjangoFilterBackend
-from drf_spectacular.utils import extend_schema, extend_schema_view
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ViewSet
 
+from music_lib.bulk import apply_like_operations, apply_playlist_operations, TOGGLE
+from music_lib.cache import render_songs, render_albums, render_artists, conditional_response, get_liked_song_ids, \
+    SONG_ROW_FIELDS
+from music_lib.charts import WINDOWS
 from music_lib.filters import SongFilter
-from music_lib.models import Song, Artist, Album, Playlist
+from music_lib.hls import HLS_CONTENT_TYPE, render_master_playlist, render_media_playlist
+from music_lib.models import Song, Artist, Album, Playlist, PlaylistSong, HLSPackage, ChartEntry
+from music_lib.pagination import SongPaginationClass, paginate_songs
+from music_lib.payloads import FIELDS_QUERY_PARAM, COMPACT_QUERY_PARAM, requested_fields, sparse
+from music_lib.play_events import play_event_buffer, is_playback_start
+from music_lib.processing import queue_processing
 from music_lib.serializers import SongSerializer, SongCreateSerializer, ArtistSerializer, AlbumSerializer, \
     PlaylistSerializer, PlaylistBareSerializer, PlaylistCreateSerializer, UpdatePlaylistsSerializer, \
-    SongNameFindSerializer
-
-
-class SongPaginationClass(PageNumberPagination):
-    page_size = 20
+    SongNameFindSerializer, LikedStatusQuerySerializer, BulkLikeSerializer, \
+    BulkPlaylistSongsSerializer, MovePlaylistSongSerializer, ChartQuerySerializer
+from music_lib.streaming import build_delivery_response
+from music_lib.tickets import issue_ticket
+from music_lib.transcoding import requested_bitrate, select_rendition, add_rendition_headers
 
 
 class MultiSerializersModelViewSet(ModelViewSet):
@@ -32,21 +43,81 @@ class MultiSerializersModelViewSet(ModelViewSet):
         return self.serializer_classes.get(self.action) or self.serializer_classes['default']
 
 
+SPARSE_FIELDS_PARAMETER = OpenApiParameter(
+    FIELDS_QUERY_PARAM, str, description='Comma separated song fields to return, e.g. id,name,duration.'
+)
+SONG_LIST_PARAMETERS = [
+    SPARSE_FIELDS_PARAMETER,
+    OpenApiParameter(
+        COMPACT_QUERY_PARAM, bool,
+        description='Refer to albums and artists by id and list each of them once under "included".',
+    ),
+]
+
+
+def playlist_response(text: str) -> HttpResponse:
+    response = HttpResponse(text, content_type=HLS_CONTENT_TYPE)
+    # Segment URLs carry expiring signatures, only the client may reuse the playlist briefly.
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
+
+
+class LikedSongsContextMixin:
+    """Gives song serializers the requesting user's liked-song ids to compute ``is_liked`` from."""
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['liked_song_ids'] = SimpleLazyObject(lambda: get_liked_song_ids(self.request))
+        return context
+
+
 @extend_schema(tags=['songs'])
 @extend_schema_view(
-    list=extend_schema(summary="List all songs"),
-    retrieve=extend_schema(summary="Get a song by ID"),
+    list=extend_schema(summary="List all songs", parameters=SONG_LIST_PARAMETERS),
+    retrieve=extend_schema(summary="Get a song by ID", parameters=[SPARSE_FIELDS_PARAMETER]),
     create=extend_schema(summary="Create a new song"),
     update=extend_schema(summary="Update a song"),
     partial_update=extend_schema(summary="Partial update a song"),
     destroy=extend_schema(summary="Delete a song"),
-    stream=extend_schema(summary="Stream a song"),
-    favorites=extend_schema(summary="Get all liked songs"),
+    stream=extend_schema(
+        summary="Stream a song",
+        parameters=[OpenApiParameter(
+            'bitrate', int, description='Highest bitrate in kbps; a lower-bitrate rendition is served when available.'
+        )],
+    ),
+    ticket=extend_schema(
+        summary="Get a signed, expiring URL to stream a song from",
+        parameters=[OpenApiParameter('bitrate', int, description='Highest bitrate in kbps.')],
+        request=None,
+        responses={200: {
+            'type': 'object',
+            'properties': {
+                'url': {'type': 'string'}, 'expires': {'type': 'integer'}, 'bitrate': {'type': 'integer', 'nullable': True},
+            },
+        }},
+    ),
+    hls=extend_schema(summary="Get the HLS master playlist of a song", responses={(200, HLS_CONTENT_TYPE): str}),
+    hls_variant=extend_schema(
+        summary="Get the HLS media playlist of a song or one of its renditions",
+        responses={(200, HLS_CONTENT_TYPE): str},
+    ),
+    favorites=extend_schema(summary="Get all liked songs", parameters=SONG_LIST_PARAMETERS),
+    related=extend_schema(
+        summary="Get the songs most often liked or played by the listeners of a song",
+        parameters=SONG_LIST_PARAMETERS,
+    ),
     like=extend_schema(summary="Like or unlike a song"),
+    bulk_like=extend_schema(summary="Like or unlike several songs"),
+    liked_status=extend_schema(
+        summary="Check whether several songs are liked",
+        parameters=[LikedStatusQuerySerializer],
+        responses={200: {'type': 'object', 'additionalProperties': {'type': 'boolean'}}},
+    ),
 )
-class SongAPIViewSet(MultiSerializersModelViewSet):
+class SongAPIViewSet(LikedSongsContextMixin, MultiSerializersModelViewSet):
     serializer_classes = {
         'create': SongCreateSerializer,
+        'bulk_like': BulkLikeSerializer,
         'default': SongSerializer
     }
 
@@ -55,17 +126,28 @@ class SongAPIViewSet(MultiSerializersModelViewSet):
     pagination_class = SongPaginationClass
 
     def get_queryset(self):
-        user = self.request.user
-        liked_songs = user.liked_songs.filter(pk=OuterRef('pk'))
+        if self.action in ('list', 'retrieve'):
+            # Song payloads come from the catalog cache, only the volatile counters are read here.
+            return Song.objects.only(*SONG_ROW_FIELDS).order_by('id')
 
-        queryset = Song.objects.annotate(
-            is_liked=Exists(liked_songs)
-        ).select_related('album').prefetch_related('artists').order_by('id')
+        queryset = Song.objects.select_related('album__artist').prefetch_related('artists').order_by('id')
         return queryset
 
+    def perform_create(self, serializer):
+        # The upload is probed in the background once it commits, then transcoded and packaged.
+        queue_processing(serializer.save())
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        return conditional_response(
+            request, paginate_songs(self, self.filter_queryset(self.get_queryset()), render_songs)
+        )
+
+    def retrieve(self, request: Request, *args, **kwargs) -> Response:
+        song = render_songs(request, [self.get_object()])[0]
+        return conditional_response(request, Response(sparse(song, requested_fields(request))))
 
     @action(detail=True, methods=['get'])
-    def stream(self, request: Request, pk: int) -> HttpResponse | StreamingHttpResponse:
+    def stream(self, request: Request, pk: int) -> HttpResponseBase:
         # Assuming 'pk' is the filename or part of the path
         song = get_object_or_404(Song, pk=pk)
         file_path = song.file.path
@@ -74,66 +156,109 @@ class SongAPIViewSet(MultiSerializersModelViewSet):
             raise Http404("Audio file does not exist.")
 
         if not song.is_available:
-            return HttpResponse(
+            return Response(
                 data={
                     'message': 'Not available'
                 },
                 status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
             )
 
-        range_header = request.META.get('HTTP_RANGE', None)
-        file_size = os.path.getsize(file_path)
-        if not range_header:
-            # No range header means send the entire file
-            return FileResponse(open(file_path, 'rb'), content_type='audio/mpeg')
-
-        # Extract range start and end from Range header (e.g., "bytes=0-499")
-        start, end = 0, file_size - 1
-        if range_header:
-            range_match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-            start = int(range_match.group(1))
-            end = int(range_match.group(2)) if range_match.group(2) else end
-
-        if start > file_size or end < start:
-            return HttpResponse(status=416)  # Range Not Satisfiable
-
-        resp = HttpResponse(content_type='audio/mpeg', status=206)
-        resp['Content-Range'] = f'bytes {start}-{end}/{file_size}'
-        resp['Accept-Ranges'] = 'bytes'
-        resp['Content-Length'] = str(end - start + 1)
-        with open(file_path, 'rb') as f:
-            f.seek(start)
-            resp.write(f.read(end - start + 1))
-        return resp
+        range_header = request.META.get('HTTP_RANGE')
+        if is_playback_start(range_header):
+            play_event_buffer.record(user_id=request.user.pk, song_id=song.pk)
+
+        rendition = select_rendition(song, requested_bitrate(request))
+        media = rendition.file if rendition else song.file
+        return add_rendition_headers(build_delivery_response(media.path, media.name, range_header), rendition)
+
+    @action(detail=True, methods=['post'])
+    def ticket(self, request: Request, pk: int) -> Response:
+        song = get_object_or_404(Song, pk=pk)
+        if not song.is_available:
+            return Response(data={'message': 'Not available'}, status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        # The rendition is chosen once and pinned in the ticket.
+        rendition = select_rendition(song, requested_bitrate(request))
+        media = rendition.file if rendition else song.file
+        if not os.path.exists(media.path):
+            raise Http404("Audio file does not exist.")
+
+        # Requests made with the ticket are not recorded, issuing it starts a play.
+        play_event_buffer.record(user_id=request.user.pk, song_id=song.pk)
+        token, expires = issue_ticket(request.user.pk, song.pk, media.name)
+        return Response(data={
+            'url': request.build_absolute_uri(reverse('stream-ticket', args=[token])),
+            'expires': expires,
+            'bitrate': rendition.bitrate if rendition else None,
+        })
+
+    @action(detail=True, methods=['get'])
+    def hls(self, request: Request, pk: int) -> HttpResponseBase:
+        song = get_object_or_404(Song, pk=pk)
+        if not song.is_available:
+            return Response(data={'message': 'Not available'}, status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        packages = list(song.hls_packages.filter(status=HLSPackage.READY))
+        if not packages:
+            raise Http404("Song is not packaged for HLS.")
+
+        # Fetched once per listen, unlike media playlists which players may switch between.
+        play_event_buffer.record(user_id=request.user.pk, song_id=song.pk)
+        return playlist_response(render_master_playlist(song, packages))
+
+    @action(detail=True, methods=['get'], url_path=r'hls/(?P<variant>original|\d+)')
+    def hls_variant(self, request: Request, pk: int, variant: str) -> HttpResponseBase:
+        song = get_object_or_404(Song, pk=pk)
+        if not song.is_available:
+            return Response(data={'message': 'Not available'}, status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        hls_package = get_object_or_404(
+            song.hls_packages, status=HLSPackage.READY, bitrate=None if variant == 'original' else int(variant)
+        )
+        return playlist_response(render_media_playlist(hls_package))
 
     @action(detail=False, methods=['get'])
     def favorites(self, request: Request) -> Response:
-        user = request.user
+        queryset = Song.objects.filter(liked_by=request.user.pk).only(*SONG_ROW_FIELDS)
+        return conditional_response(request, paginate_songs(self, queryset, render_songs))
 
-        queryset = user.liked_songs.annotate(
-            is_liked=Value(True, output_field=BooleanField())
-        ).select_related('album').prefetch_related('artists')
-        serializer = SongSerializer(queryset, many=True, context={'request': request})
-        return Response(data=serializer.data)
+    @action(detail=True, methods=['get'])
+    def related(self, request: Request, pk: int) -> Response:
+        # Precomputed by music_lib.recommendations; empty for songs nobody listened to yet.
+        queryset = Song.objects.filter(neighbour_of__song=pk, is_available=True).annotate(
+            related_score=F('neighbour_of__score')
+        ).only(*SONG_ROW_FIELDS)
+        return conditional_response(request, paginate_songs(self, queryset, render_songs))
 
     @action(detail=True, methods=['post'], serializer_class=None)
     def like(self, request: Request, pk: int) -> Response:
         song = get_object_or_404(Song, pk=pk)
-        user = request.user
 
-        if user.liked_songs.filter(pk=song.pk).exists():
-            user.liked_songs.remove(song)
-        else:
-            user.liked_songs.add(song)
+        apply_like_operations(request.user, {song.pk: TOGGLE})
 
         return Response(data={"message": "ok"})
 
+    @action(detail=False, methods=['post'])
+    def bulk_like(self, request: Request) -> Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        liked, unliked = apply_like_operations(request.user, serializer.validated_data['operations'])
+
+        return Response(data={"liked": liked, "unliked": unliked})
+
     @action(detail=True, methods=['get'])
     def is_liked(self, request: Request, pk: int) -> Response:
         song = get_object_or_404(Song, pk=pk)
-        user = request.user
 
-        return Response(data={"is_liked": user.liked_songs.filter(pk=song.pk).exists()})
+        return Response(data={"is_liked": song.pk in get_liked_song_ids(request)})
+
+    @action(detail=False, methods=['get'])
+    def liked_status(self, request: Request) -> Response:
+        serializer = LikedStatusQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        liked = get_liked_song_ids(request)
+
+        return Response(data={str(pk): pk in liked for pk in serializer.validated_data['ids']})
 
 
 @extend_schema(tags=['artists'])
@@ -144,29 +269,83 @@ class SongAPIViewSet(MultiSerializersModelViewSet):
 class ArtistAPIViewSet(ModelViewSet):
     http_method_names = ['get', 'list']
     serializer_class = ArtistSerializer
-    queryset = Artist.objects.all()
+    queryset = Artist.objects.only('id')
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        data, last_modified = render_artists(request, self.filter_queryset(self.get_queryset()))
+        return conditional_response(request, Response(data), last_modified)
+
+    def retrieve(self, request: Request, *args, **kwargs) -> Response:
+        data, last_modified = render_artists(request, [self.get_object()])
+        return conditional_response(request, Response(data[0]), last_modified)
+
+
+@extend_schema(tags=['charts'])
+@extend_schema_view(
+    retrieve=extend_schema(
+        summary="Get the most played songs of the last hour, day or week",
+        parameters=[
+            OpenApiParameter('id', str, OpenApiParameter.PATH, enum=list(WINDOWS), description='Chart window.'),
+            ChartQuerySerializer,
+            SPARSE_FIELDS_PARAMETER,
+        ],
+        responses={200: {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {'rank': {'type': 'integer'}, 'plays': {'type': 'integer'}, 'song': {'type': 'object'}},
+            },
+        }},
+    ),
+)
+class ChartAPIViewSet(ViewSet):
+    lookup_value_regex = '|'.join(WINDOWS)
+
+    def retrieve(self, request: Request, pk: str) -> Response:
+        # Charts are precomputed by music_lib.charts: one indexed read of the chart's rows,
+        # then the cached song payloads.
+        serializer = ChartQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        entries = list(ChartEntry.objects.filter(
+            window=pk, artist=serializer.validated_data.get('artist')
+        ).select_related('song').only(
+            'rank', 'plays', 'song', *(f'song__{field}' for field in SONG_ROW_FIELDS)
+        ).order_by('rank'))
+
+        songs = {song['id']: song for song in render_songs(request, [entry.song for entry in entries])}
+        fields = requested_fields(request)
+        return conditional_response(request, Response([
+            {'rank': entry.rank, 'plays': entry.plays, 'song': sparse(songs[entry.song_id], fields)}
+            for entry in entries if entry.song_id in songs
+        ]))
 
 
 @extend_schema(tags=['albums'])
 @extend_schema_view(
     list=extend_schema(summary="List all albums"),
     retrieve=extend_schema(summary="Get an album by ID"),
+    songs=extend_schema(summary="List the songs of an album", parameters=SONG_LIST_PARAMETERS),
 )
-class AlbumAPIViewSet(ModelViewSet):
+class AlbumAPIViewSet(LikedSongsContextMixin, ModelViewSet):
     http_method_names = ['get', 'list']
     serializer_class = AlbumSerializer
 
     def get_queryset(self):
-        user = self.request.user
-        liked_songs = user.liked_songs.filter(pk=OuterRef('pk'))
+        # Album payloads come from the catalog cache.
+        return Album.objects.only('id')
 
-        queryset = Album.objects.prefetch_related(
-            Prefetch('song_set', queryset=Song.objects.annotate(
-                is_liked=Exists(liked_songs)
-            ))
-        )
-        return queryset
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        return conditional_response(request, Response(render_albums(request, self.get_queryset())))
+
+    def retrieve(self, request: Request, *args, **kwargs) -> Response:
+        return conditional_response(request, Response(render_albums(request, [self.get_object()])[0]))
+
+    @action(detail=True, methods=['get'], serializer_class=SongSerializer)
+    def songs(self, request: Request, pk: int) -> Response:
+        album = get_object_or_404(Album.objects.only('id'), pk=pk)
 
+        queryset = Song.objects.filter(album=album).only(*SONG_ROW_FIELDS)
+        return conditional_response(request, paginate_songs(self, queryset, render_songs))
 
 
 @extend_schema(tags=['playlists'])
@@ -178,41 +357,63 @@ class AlbumAPIViewSet(ModelViewSet):
     partial_update=extend_schema(summary="Partial update a playlist"),
     destroy=extend_schema(summary="Delete a playlist"),
     update_playlists=extend_schema(summary="Update multiple playlists"),
+    bulk_update_songs=extend_schema(summary="Add songs to and remove them from several playlists"),
     add_song=extend_schema(summary="Add a song to a playlist"),
     names=extend_schema(summary="Get names of all playlists"),
+    songs=extend_schema(summary="List the songs of a playlist in order", parameters=SONG_LIST_PARAMETERS),
+    move_song=extend_schema(summary="Move a song within a playlist"),
 )
-class PlaylistAPIViewSet(MultiSerializersModelViewSet):
+class PlaylistAPIViewSet(LikedSongsContextMixin, MultiSerializersModelViewSet):
     permission_classes = [rest_framework.permissions.IsAuthenticated]
     serializer_classes = {
         'update_playlists': UpdatePlaylistsSerializer,
+        'bulk_update_songs': BulkPlaylistSongsSerializer,
+        'move_song': MovePlaylistSongSerializer,
         'create': PlaylistCreateSerializer,
         'default': PlaylistSerializer
     }
 
     def get_queryset(self):
-        user = self.request.user
-        liked_songs = user.liked_songs.filter(pk=OuterRef('pk'))
-
-        return Playlist.objects.filter(user=self.request.user).prefetch_related(
-            Prefetch('songs', queryset=Song.objects.annotate(
-                is_liked=Exists(liked_songs)
-            ))
-        )
+        return Playlist.objects.filter(user=self.request.user.pk).annotate(song_count=Count('playlistsong'))
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user_id=self.request.user.pk)
 
     @action(detail=True, methods=["post"])
     def add_song(self, request: Request, pk: int) -> Response:
         playlist = get_object_or_404(Playlist, pk=pk)
         song = get_object_or_404(Song, pk=int(request.data.get('song_id', -1)))
 
-        if playlist.songs.filter(pk=song.pk).exists():
+        try:
+            # The unique constraint on (playlist, song) rejects duplicates.
+            with transaction.atomic():
+                playlist.append_songs([song.pk])
+        except IntegrityError:
             raise Http404()
-
-        playlist.songs.add(song)
         return Response(data={"data": "ok"})
 
+    @action(detail=True, methods=['post'])
+    def move_song(self, request: Request, pk: int) -> Response:
+        playlist = get_object_or_404(Playlist, pk=pk, user=request.user.pk)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            with transaction.atomic():
+                playlist.move_song(serializer.validated_data['song'], serializer.validated_data['after'])
+        except PlaylistSong.DoesNotExist:
+            raise Http404("Song is not in the playlist.")
+        return Response(data={"message": "ok"})
+
+    @action(detail=True, methods=['get'])
+    def songs(self, request: Request, pk: int) -> Response:
+        playlist = get_object_or_404(Playlist, pk=pk, user=request.user.pk)
+
+        queryset = Song.objects.filter(playlistsong__playlist=playlist).annotate(
+            playlist_position=F('playlistsong__position')
+        ).only(*SONG_ROW_FIELDS)
+        return conditional_response(request, paginate_songs(self, queryset, render_songs))
+
     @action(detail=False)
     def names(self, request: Request) -> Response:
         serializer = PlaylistBareSerializer(self.get_queryset(), many=True)
@@ -223,17 +424,29 @@ class PlaylistAPIViewSet(MultiSerializersModelViewSet):
 
     @action(detail=False, methods=["post"])
     def update_playlists(self, request: Request) -> Response:
-        playlists = Playlist.objects.filter(id__in=request.data.get('ids', []))
         song = get_object_or_404(Song, pk=int(request.data.get('song', -1)))
+        playlist_ids = Playlist.objects.filter(
+            id__in=request.data.get('ids', []), user=request.user.pk
+        ).values_list('pk', flat=True)
 
-        for playlist in playlists:
-            if playlist.songs.filter(id=song.id):
-                playlist.songs.remove(song)
-            else:
-                playlist.songs.add(song)
+        # Toggles the song in each playlist.
+        apply_playlist_operations({(playlist_id, song.pk): TOGGLE for playlist_id in playlist_ids})
 
         return Response(
             data={
                 "message": "ok"
             }
         )
+
+    @action(detail=False, methods=["post"])
+    def bulk_update_songs(self, request: Request) -> Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added, removed = apply_playlist_operations(serializer.validated_data['operations'])
+
+        return Response(
+            data={
+                "added": [{"playlist": playlist, "song": song} for playlist, song in added],
+                "removed": [{"playlist": playlist, "song": song} for playlist, song in removed],
+            }
+        )
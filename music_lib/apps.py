@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MusicLibConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'music_lib'
+
+    def ready(self):
+        from music_lib.signals import connect_signals
+
+        connect_signals()
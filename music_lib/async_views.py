@@ -0,0 +1,75 @@
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.http.response import HttpResponseBase
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+
+from middlewares.phases import phase
+from music_lib.models import Song
+from music_lib.play_events import play_event_buffer, is_playback_start
+from music_lib.streaming import abuild_delivery_response, run_io
+from music_lib.transcoding import requested_bitrate, select_rendition, add_rendition_headers
+from users.authentication import ClaimsJWTAuthentication
+
+
+async def authenticate(request):
+    """
+    Authenticate the JWT access token of a plain Django request the way the API views do.
+
+    Token validation is CPU only (plus a denylist cache lookup). The stateless user is built
+    from the claims; otherwise it is loaded off the event loop. Returns ``None`` when no
+    token was sent and raises ``AuthenticationFailed`` for a bad one.
+    """
+    with phase('auth'):
+        authentication = ClaimsJWTAuthentication()
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            return None
+
+        token = authentication.get_validated_token(raw_token)
+        if settings.JWT_STATELESS_AUTH:
+            return authentication.get_user(token)
+        return await sync_to_async(authentication.get_user)(token)
+
+
+@require_GET
+async def stream_song(request, pk: int) -> HttpResponseBase:
+    """
+    Async twin of ``SongAPIViewSet.stream`` for ASGI deployments.
+
+    Served from the event loop, a listener holding a stream costs a coroutine instead
+    of a worker, so one process can serve thousands of concurrent range streams.
+    """
+    try:
+        user = await authenticate(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': e.detail}, status=status.HTTP_401_UNAUTHORIZED)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        song = await Song.objects.only('file', 'is_available', 'duration', 'bitrate').aget(pk=pk)
+    except Song.DoesNotExist:
+        raise Http404("No Song matches the given query.")
+    file_path = song.file.path
+
+    if not await run_io(os.path.exists, file_path):
+        raise Http404("Audio file does not exist.")
+
+    if not song.is_available:
+        return JsonResponse({'message': 'Not available'}, status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    range_header = request.META.get('HTTP_RANGE')
+    if is_playback_start(range_header):
+        # Recording may flush the buffer to the database.
+        await sync_to_async(play_event_buffer.record)(user_id=user.pk, song_id=song.pk)
+
+    rendition = await sync_to_async(select_rendition)(song, requested_bitrate(request))
+    media = rendition.file if rendition else song.file
+    return add_rendition_headers(await abuild_delivery_response(media.path, media.name, range_header), rendition)
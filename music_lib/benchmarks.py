@@ -0,0 +1,140 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from music_lib.models import Artist, Album, Song, Playlist, PlaylistSong, PlayEvent
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+SYLLABLES = [
+    'la', 'mo', 'ri', 'ven', 'sha', 'dow', 'el', 'ka', 'tor', 'mi', 'sun', 'ra', 'bel', 'no', 'vi', 'ta',
+    'gro', 'ne', 'lu', 'stra', 'pe', 'zo', 'an', 'ki', 'dre', 'fo', 'wen', 'ha', 'ly', 'cor', 'ba', 'si',
+]
+# 32**3 pseudo-words give search terms a realistic spread between rare and common.
+WORDS = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back, so benchmarks leave no data behind."""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+def random_title(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).title()
+
+
+def seed_catalog(songs: int, songs_per_album: int = 10, albums_per_artist: int = 3,
+                 batch_size: int = 5000, seed: int = 0) -> dict:
+    """Bulk insert a synthetic catalog; denormalized columns are filled in directly."""
+    rng = random.Random(seed)
+    user = get_user_model().objects.create_user(username=f'benchmark-{time.time_ns()}')
+
+    album_count = max(songs // songs_per_album, 1)
+    artist_count = max(album_count // albums_per_artist, 1)
+
+    artists = Artist.objects.bulk_create(
+        (Artist(user=user, name=random_title(rng, 2), bio='') for _ in range(artist_count)),
+        batch_size=batch_size,
+    )
+    albums = Album.objects.bulk_create(
+        (Album(artist=artists[i % artist_count], title=random_title(rng, 2), cover=f'benchmark/{i}.jpg')
+         for i in range(album_count)),
+        batch_size=batch_size,
+    )
+
+    through = Song.artists.through
+    for offset in range(0, songs, batch_size):
+        batch, song_artists = [], []
+        for i in range(offset, min(offset + batch_size, songs)):
+            album = albums[i % album_count]
+            artist = artists[(i % album_count) % artist_count]
+            name = random_title(rng, 3)
+            song_artists.append(artist)
+            batch.append(Song(
+                album=album,
+                name=name,
+                file=f'benchmark/{i}.mp3',
+                search_document=' '.join([name, artist.name, album.title]),
+            ))
+        Song.objects.bulk_create(batch)
+        through.objects.bulk_create(
+            through(song_id=song.pk, artist_id=artist.pk) for song, artist in zip(batch, song_artists)
+        )
+
+    return {'user': user, 'artists': artists, 'albums': albums}
+
+
+def seed_listeners(song_ids: list[int], users: int, likes_per_user: int = 50, playlists_per_user: int = 3,
+                   songs_per_playlist: int = 30, batch_size: int = 5000, seed: int = 0) -> dict:
+    """
+    Bulk insert listeners with likes and playlists over ``song_ids``. They all log in with
+    ``BENCHMARK_PASSWORD``; like counts are recomputed afterwards.
+    """
+    rng = random.Random(seed)
+    prefix = f'benchmark-{time.time_ns()}'
+    password = make_password(BENCHMARK_PASSWORD)
+    listeners = get_user_model().objects.bulk_create(
+        (get_user_model()(username=f'{prefix}-{i}', password=password) for i in range(users)),
+        batch_size=batch_size,
+    )
+
+    likes = Song.liked_by.through
+    likes.objects.bulk_create(
+        (likes(user_id=user.pk, song_id=song_id)
+         for user in listeners for song_id in rng.sample(song_ids, min(likes_per_user, len(song_ids)))),
+        batch_size=batch_size,
+    )
+    Song.objects.filter(pk__in=song_ids).update_like_counts()
+
+    playlists = Playlist.objects.bulk_create(
+        (Playlist(user=user, name=f'Playlist {i}') for user in listeners for i in range(playlists_per_user)),
+        batch_size=batch_size,
+    )
+    PlaylistSong.objects.bulk_create(
+        (PlaylistSong(playlist=playlist, song_id=song_id, position=(i + 1) * PlaylistSong.POSITION_GAP)
+         for playlist in playlists
+         for i, song_id in enumerate(rng.sample(song_ids, min(songs_per_playlist, len(song_ids))))),
+        batch_size=batch_size,
+    )
+    return {'users': listeners, 'playlists': playlists}
+
+
+def seed_play_events(song_ids: list[int], user_ids: list[int], events: int, days: int = 30,
+                     batch_size: int = 5000, seed: int = 0) -> None:
+    """Bulk insert plays spread over the last ``days``, with Zipf-like song popularity in ``song_ids`` order."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(song_ids) + 1)))
+    for offset in range(0, events, batch_size):
+        count = min(batch_size, events - offset)
+        PlayEvent.objects.bulk_create(
+            PlayEvent(
+                user_id=rng.choice(user_ids),
+                song_id=song_id,
+                timestamp=now - timedelta(seconds=rng.uniform(0, days * 24 * 60 * 60)),
+                duration=rng.randint(10, 300),
+            )
+            for song_id in rng.choices(song_ids, cum_weights=cum_weights, k=count)
+        )
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
@@ -0,0 +1,192 @@
+import os
+import posixpath
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from music_lib.hls import HLS_PREFIX
+from music_lib.models import Album, Artist, DerivedFile, HLSPackage, MediaBlob, Playlist, Song, SongRendition
+from music_lib.storage import BLOBS_PREFIX, TEMP_PREFIX, content_addressed_storage, content_digest, digest_directory
+from music_lib.transcoding import RENDITIONS_PREFIX
+
+# File fields stored in the content-addressed storage.
+BLOB_FIELDS = {
+    Song: ('file',),
+    Album: ('cover',),
+    Artist: ('avatar', 'thumbnail'),
+    Playlist: ('cover',),
+}
+BATCH_SIZE = 500
+
+
+def blob_names(instance, field_names=None) -> dict:
+    """``{field: blob name}`` of the files of ``instance`` stored by digest."""
+    names = {}
+    for field_name in BLOB_FIELDS[type(instance)] if field_names is None else field_names:
+        name = getattr(instance, field_name).name
+        if content_digest(name):
+            names[field_name] = name
+    return names
+
+
+def blob_size(name: str, storage=content_addressed_storage) -> int:
+    try:
+        return storage.size(name)
+    except OSError:
+        return 0
+
+
+def acquire(names) -> None:
+    """Count a reference to each of the blobs ``names`` (repeated names count once each)."""
+    counts = Counter(names)
+    if not counts:
+        return
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, size=blob_size(name)) for name in counts], ignore_conflicts=True,
+    )
+    for name, count in counts.items():
+        MediaBlob.objects.filter(name=name).update(references=F('references') + count)
+
+
+def release(names) -> None:
+    """Drop a reference to each of the blobs ``names``; the files stay until ``collect_blobs``."""
+    now = timezone.now()
+    for name, count in Counter(names).items():
+        MediaBlob.objects.filter(name=name).update(references=F('references') - count, released_at=now)
+
+
+def count_references(names) -> Counter:
+    """The references to ``names`` actually held by the file fields, counted in the tables."""
+    counts = Counter()
+    for model, fields in BLOB_FIELDS.items():
+        for field_name in fields:
+            counts.update(model.objects.filter(**{f'{field_name}__in': names}).values_list(field_name, flat=True))
+    return counts
+
+
+def is_settled(name: str, cutoff: float) -> bool:
+    """Whether the file ``name`` was not written or reused since ``cutoff`` (a timestamp)."""
+    try:
+        return os.path.getmtime(content_addressed_storage.path(name)) < cutoff
+    except FileNotFoundError:
+        return True
+
+
+def collect_unreferenced(cutoff) -> tuple[int, int]:
+    """Remove the blobs released before ``cutoff``, returning how many and their bytes."""
+    removed = freed = 0
+    candidates = list(MediaBlob.objects.filter(references__lte=0, released_at__lt=cutoff).values_list('pk', flat=True))
+    for offset in range(0, len(candidates), BATCH_SIZE):
+        with transaction.atomic():
+            blobs = list(MediaBlob.objects.select_for_update().filter(
+                pk__in=candidates[offset:offset + BATCH_SIZE], references__lte=0, released_at__lt=cutoff,
+            ))
+            # Saves that bypass the signals (bulk writes, raw SQL) leave the counts behind, trust the tables.
+            held = count_references([blob.name for blob in blobs])
+            for blob in blobs:
+                if held[blob.name]:
+                    MediaBlob.objects.filter(pk=blob.pk).update(references=held[blob.name])
+                elif is_settled(blob.name, cutoff.timestamp()):
+                    content_addressed_storage.delete(blob.name)
+                    blob.delete()
+                    derived, derived_bytes = collect_derived(content_digest(blob.name))
+                    removed, freed = removed + 1 + derived, freed + blob.size + derived_bytes
+    return removed, freed
+
+
+def derived_files(digest: str) -> list[str]:
+    """Storage names of the renditions and HLS files made from the blob ``digest``, shared by its songs."""
+    renditions = [
+        name for name in storage_files(default_storage, digest_directory(RENDITIONS_PREFIX, digest))
+        if posixpath.basename(name).startswith(f'{digest}.')
+    ]
+    return renditions + list(storage_files(default_storage, f'{digest_directory(HLS_PREFIX, digest)}/{digest}'))
+
+
+def collect_derived(digest: str) -> tuple[int, int]:
+    """
+    Remove the files made from the collected blob ``digest``, returning how many and their
+    bytes. Files a rendition or HLS package still names are kept: a song whose file was
+    replaced keeps serving them until it is transcoded again.
+    """
+    removed = freed = 0
+    names = derived_files(digest)
+    held = set(SongRendition.objects.filter(file__in=names).values_list('file', flat=True))
+    held.update(
+        posixpath.dirname(name) for name in HLSPackage.objects.filter(playlist__in=names).values_list('playlist', flat=True)
+    )
+    collected = set()
+    for name in names:
+        if name not in held and posixpath.dirname(name) not in held:
+            freed += blob_size(name, default_storage)
+            default_storage.delete(name)
+            collected.update((name, posixpath.dirname(name)))
+            removed += 1
+    # The blob may be uploaded again, its files are then made anew.
+    DerivedFile.objects.filter(name__in=collected).delete()
+    return removed, freed
+
+
+def storage_files(storage, prefix: str):
+    """Storage names of the files under the directory ``prefix`` of the file system ``storage``."""
+    for directory, _, files in os.walk(storage.path(prefix)):
+        for file_name in files:
+            yield os.path.relpath(os.path.join(directory, file_name), storage.location).replace(os.sep, '/')
+
+
+def blob_files():
+    """Storage names of the files under the blobs directory, the temporary ones included."""
+    return storage_files(content_addressed_storage, BLOBS_PREFIX)
+
+
+def collect_orphans(cutoff) -> tuple[int, int]:
+    """
+    Remove the blob files older than ``cutoff`` that have no ``MediaBlob`` row, left by
+    saves whose transaction rolled back, and abandoned temporary files. Orphans that a file
+    field still names get their ``MediaBlob`` back instead.
+    """
+    removed = freed = 0
+    orphans = []
+    for name in blob_files():
+        if not is_settled(name, cutoff.timestamp()):
+            continue
+        if name.startswith(f'{TEMP_PREFIX}/'):
+            freed += blob_size(name)
+            content_addressed_storage.delete(name)
+            removed += 1
+        elif content_digest(name):
+            orphans.append(name)
+
+    for offset in range(0, len(orphans), BATCH_SIZE):
+        batch = orphans[offset:offset + BATCH_SIZE]
+        known = set(MediaBlob.objects.filter(name__in=batch).values_list('name', flat=True))
+        unknown = [name for name in batch if name not in known]
+        held = count_references(unknown)
+        for name in unknown:
+            if held[name]:
+                acquire([name] * held[name])
+            else:
+                freed += blob_size(name)
+                content_addressed_storage.delete(name)
+                removed += 1
+    return removed, freed
+
+
+def collect_blobs(now=None) -> tuple[int, int]:
+    """
+    Remove the blobs nothing has referenced for ``MEDIA_BLOB_GRACE_PERIOD`` seconds with the
+    renditions and HLS files made from them, and the orphaned files, returning how many files
+    were removed and their bytes. The grace period covers uploads whose reference is not yet
+    committed: an upload of stored content bumps the modification time of the blob, which
+    keeps it.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.MEDIA_BLOB_GRACE_PERIOD)
+    removed, freed = collect_unreferenced(cutoff)
+    orphans, orphan_bytes = collect_orphans(cutoff)
+    return removed + orphans, freed + orphan_bytes
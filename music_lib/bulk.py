@@ -0,0 +1,77 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from music_lib.cache import invalidate_liked_songs
+from music_lib.models import Song, PlaylistSong
+
+# Value of a wanted membership that flips whatever is currently stored.
+TOGGLE = None
+
+
+def apply_membership_changes(through, source_field: str, target_field: str, wanted: dict,
+                             defaults=None) -> tuple[list, list]:
+    """
+    Bring the rows of a many-to-many ``through`` model in line with ``wanted``.
+
+    ``wanted`` maps ``(source_id, target_id)`` pairs to ``True`` (present), ``False``
+    (absent) or ``TOGGLE``. The current rows are read in one query and the difference is
+    written with one ``bulk_create`` and one delete, whatever the number of pairs. Bulk
+    writes don't send ``m2m_changed``, so callers update anything derived from the rows.
+    ``defaults(source_id, target_id)`` gives the other fields of an added row.
+
+    Returns the added and the removed pairs.
+    """
+    if not wanted:
+        return [], []
+
+    current = {
+        (source, target): pk for pk, source, target in through.objects.filter(**{
+            f'{source_field}__in': {source for source, _ in wanted},
+            f'{target_field}__in': {target for _, target in wanted},
+        }).values_list('pk', source_field, target_field)
+    }
+    added = [pair for pair, present in wanted.items() if pair not in current and present is not False]
+    removed = [pair for pair, present in wanted.items() if pair in current and present is not True]
+
+    if added:
+        # A concurrent request may have inserted the same row since it was read.
+        through.objects.bulk_create(
+            [
+                through(**{source_field: source, target_field: target}, **(defaults(source, target) if defaults else {}))
+                for source, target in added
+            ],
+            ignore_conflicts=True,
+        )
+    if removed:
+        through.objects.filter(pk__in=[current[pair] for pair in removed]).delete()
+    return added, removed
+
+
+def apply_like_operations(user, operations: dict) -> tuple[list, list]:
+    """Like or unlike songs, ``operations`` maps song ids to the wanted state. Returns the changed song ids."""
+    through = get_user_model().liked_songs.through
+    wanted = {(user.pk, song_id): liked for song_id, liked in operations.items()}
+
+    with transaction.atomic():
+        added, removed = apply_membership_changes(through, 'user_id', 'song_id', wanted)
+        changed = [song_id for _, song_id in added + removed]
+        if changed:
+            Song.objects.filter(pk__in=changed).update_like_counts()
+
+    if changed:
+        invalidate_liked_songs([user.pk])
+    return [song_id for _, song_id in added], [song_id for _, song_id in removed]
+
+
+def apply_playlist_operations(operations: dict) -> tuple[list, list]:
+    """Add songs to or remove them from playlists, ``operations`` maps ``(playlist_id, song_id)`` to the wanted state."""
+    with transaction.atomic():
+        # Added songs are appended in the order they were given.
+        positions = PlaylistSong.objects.next_positions({playlist_id for playlist_id, _ in operations})
+
+        def append(playlist_id, song_id):
+            position = positions[playlist_id]
+            positions[playlist_id] += PlaylistSong.POSITION_GAP
+            return {'position': position}
+
+        return apply_membership_changes(PlaylistSong, 'playlist_id', 'song_id', operations, append)
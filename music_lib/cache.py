@@ -0,0 +1,253 @@
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Prefetch
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from middlewares.phases import timed
+from music_lib.models import Song, Artist, Album
+from music_lib.payloads import PublicOrigin, build_song_payloads, get_public_origin
+from music_lib.serializers import AlbumSerializer, ArtistSerializer
+
+# Song fields that change without a catalog edit (likes, plays) are stored in the cached
+# payloads but always overwritten from these columns, and ``is_liked`` from the user, at
+# response time.
+SONG_ROW_FIELDS = ('id', 'like_count', 'play_count')
+
+
+def get_catalog_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')]
+
+
+def version_key(prefix: str, pk) -> str:
+    return f'{prefix}:version:{pk}'
+
+
+def get_versions(prefix: str, pks) -> dict:
+    """
+    Return the current cache version of each object, creating missing ones.
+
+    Entries are stored under keys containing the version, so an invalidation (dropping the
+    version) can never race with a reader writing back data it loaded before the change.
+    """
+    cache = get_catalog_cache()
+    keys = {version_key(prefix, pk): pk for pk in pks}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+
+    new_versions = {pk: uuid.uuid4().hex[:12] for pk in pks if pk not in versions}
+    if new_versions:
+        cache.set_many({version_key(prefix, pk): version for pk, version in new_versions.items()}, timeout=None)
+        versions.update(new_versions)
+    return versions
+
+
+def invalidate_versions(prefix: str, pks) -> None:
+    if pks:
+        get_catalog_cache().delete_many([version_key(prefix, pk) for pk in pks])
+
+
+class PayloadCache:
+    """
+    Cache of user-independent serialized payloads for one catalog model, keyed by primary key.
+
+    Entries are removed by the receivers in ``music_lib.signals`` whenever the object or
+    anything nested in its payload changes.
+    """
+
+    def __init__(self, prefix: str, build) -> None:
+        self.prefix = prefix
+        # build(origin, pks) returns the payloads of the objects that exist, with file URLs made
+        # absolute by origin.build_absolute_uri (a PublicOrigin, or None for relative URLs).
+        self.build = build
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_many(self, pks: list) -> dict:
+        """Return ``{pk: {'data': payload, 'built': timestamp}}``, serializing and storing the misses."""
+        cache = get_catalog_cache()
+        # File fields serialize to URLs on the configured origin, so payloads are cached per origin.
+        public_origin = get_public_origin()
+        origin = hashlib.md5((public_origin.origin if public_origin else '').encode()).hexdigest()[:8]
+        versions = get_versions(self.prefix, pks)
+        keys = {f'{self.prefix}:{pk}:{versions[pk]}:{origin}': pk for pk in pks}
+
+        entries = {keys[key]: entry for key, entry in cache.get_many(keys).items()}
+        missing = [pk for pk in pks if pk not in entries]
+        self.hits += len(entries)
+        self.misses += len(missing)
+
+        if missing:
+            built = time.time()
+            fresh = {item['id']: {'data': item, 'built': built} for item in self.build(public_origin, missing)}
+            cache.set_many({f'{self.prefix}:{pk}:{versions[pk]}:{origin}': entry for pk, entry in fresh.items()})
+            entries.update(fresh)
+
+        return entries
+
+    def invalidate(self, pks) -> None:
+        invalidate_versions(self.prefix, pks)
+
+
+def serialize_with(serializer_class, get_queryset):
+    """A ``PayloadCache`` build function running ``serializer_class`` over ``get_queryset()``."""
+    def build(origin: PublicOrigin | None, pks: list) -> list:
+        instances = get_queryset().filter(pk__in=pks)
+        return serializer_class(instances, many=True, context={'request': origin}).data
+    return build
+
+
+# Songs are the bulk of every list endpoint, their payloads skip DRF (see music_lib.payloads).
+song_payloads = PayloadCache('song', build_song_payloads)
+album_payloads = PayloadCache(
+    'album',
+    serialize_with(AlbumSerializer, lambda: Album.objects.select_related('artist').prefetch_related(
+        Prefetch('song_set', queryset=Song.objects.prefetch_related('artists'))
+    )),
+)
+artist_payloads = PayloadCache('artist', serialize_with(ArtistSerializer, lambda: Artist.objects.all()))
+
+
+def get_liked_song_ids(request: Request) -> frozenset:
+    """
+    Ids of the songs the requesting user likes.
+
+    Loaded once per request and cached per user under a version that the ``liked_songs``
+    receivers in ``music_lib.signals`` drop on every change.
+    """
+    http_request = getattr(request, '_request', request)
+    liked = getattr(http_request, '_liked_song_ids', None)
+    if liked is not None:
+        return liked
+
+    user = request.user
+    if not user.is_authenticated:
+        return frozenset()
+
+    cache = get_catalog_cache()
+    key = f'liked:{user.pk}:{get_versions("liked", [user.pk])[user.pk]}'
+    liked = cache.get(key)
+    if liked is None:
+        liked = frozenset(Song.liked_by.through.objects.filter(user=user.pk).values_list('song', flat=True))
+        cache.set(key, liked)
+
+    http_request._liked_song_ids = liked
+    return liked
+
+
+def invalidate_liked_songs(user_ids) -> None:
+    invalidate_versions('liked', user_ids)
+
+
+def overlay_song(payload: dict, counters: tuple, liked: set) -> dict:
+    pk, like_count, play_count = counters
+    return {**payload, 'is_liked': pk in liked, 'like_count': like_count, 'play_count': play_count}
+
+
+@timed('serialize')
+def render_songs(request: Request, songs) -> list:
+    """
+    Serialize ``songs`` (instances with at least ``id``, ``like_count`` and ``play_count``
+    loaded) from cached payloads plus the requesting user's ``is_liked``.
+    """
+    songs = list(songs)
+    pks = [song.pk for song in songs]
+    entries = song_payloads.get_many(pks)
+    liked = get_liked_song_ids(request)
+
+    return [
+        overlay_song(entries[song.pk]['data'], (song.pk, song.like_count, song.play_count), liked)
+        for song in songs if song.pk in entries
+    ]
+
+
+@timed('serialize')
+def render_albums(request: Request, albums) -> list:
+    albums = list(albums)
+    entries = album_payloads.get_many([album.pk for album in albums])
+
+    counters = {
+        pk: (pk, like_count, play_count)
+        for pk, like_count, play_count in Song.objects.filter(
+            album__in=albums
+        ).values_list('pk', 'like_count', 'play_count')
+    }
+    liked = get_liked_song_ids(request)
+
+    data = []
+    for album in albums:
+        if album.pk not in entries:
+            continue
+        payload = entries[album.pk]['data']
+        data.append({**payload, 'song_set': [
+            overlay_song(song, counters[song['id']], liked)
+            for song in payload['song_set'] if song['id'] in counters
+        ]})
+    return data
+
+
+@timed('serialize')
+def render_artists(request: Request, artists) -> tuple[list, float | None]:
+    """Artists have no per-user or volatile fields, so the payload build time is a valid Last-Modified."""
+    artists = list(artists)
+    entries = artist_payloads.get_many([artist.pk for artist in artists])
+    present = [entries[artist.pk] for artist in artists if artist.pk in entries]
+
+    last_modified = max((entry['built'] for entry in present), default=None)
+    return [entry['data'] for entry in present], last_modified
+
+
+def conditional_response(request: Request, response: Response, last_modified: float | None = None):
+    """Add ETag (and Last-Modified) to ``response`` and answer 304 when the client's copy is current."""
+    body = json.dumps(response.data, sort_keys=True, default=str).encode()
+    etag = quote_etag(hashlib.md5(body).hexdigest())
+    last_modified = int(last_modified) if last_modified is not None else None
+
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+
+
+def invalidate_songs(song_ids) -> None:
+    song_ids = set(song_ids)
+    if not song_ids:
+        return
+    song_payloads.invalidate(song_ids)
+    # Albums embed their songs.
+    album_payloads.invalidate(set(Song.objects.filter(pk__in=song_ids).values_list('album_id', flat=True)))
+
+
+def invalidate_saved_song(song_id, album_ids) -> None:
+    """
+    A saved song changes its own payload and those of the albums it is or was on. The other
+    songs of the album only embed album fields, invalidated by ``invalidate_albums``.
+    """
+    song_payloads.invalidate([song_id])
+    album_payloads.invalidate(set(album_ids))
+
+
+def invalidate_albums(album_ids) -> None:
+    album_ids = set(album_ids)
+    album_payloads.invalidate(album_ids)
+    # Songs embed their album.
+    song_payloads.invalidate(set(Song.objects.filter(album__in=album_ids).values_list('pk', flat=True)))
+
+
+def invalidate_artists(artist_ids) -> None:
+    artist_ids = set(artist_ids)
+    artist_payloads.invalidate(artist_ids)
+    # Albums embed their artist, songs embed their artists and their album's artist.
+    invalidate_albums(Album.objects.filter(artist__in=artist_ids).values_list('pk', flat=True))
+    invalidate_songs(Song.objects.filter(artists__in=artist_ids).values_list('pk', flat=True))
@@ -0,0 +1,175 @@
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from music_lib.models import PlayEvent, SongPlayRollup, WindowPlayCount, ChartEntry, ChartBuild
+from music_lib.watermarks import TooManyGaps, read_all, read_new
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = {
+    WindowPlayCount.HOUR: timedelta(hours=1),
+    WindowPlayCount.DAY: timedelta(days=1),
+    WindowPlayCount.WEEK: timedelta(weeks=1),
+}
+BATCH_SIZE = 1000
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def window_start(window: str, now):
+    """
+    Windows are made of whole hourly buckets: the hour chart at 12:20 counts the plays
+    since 11:00, the day chart those since 12:00 the day before.
+    """
+    return hour_start(now - WINDOWS[window])
+
+
+def bucketed_plays(events) -> dict:
+    """``{(song id, hour): plays}`` of the ``events`` queryset, grouped by the database."""
+    rows = events.annotate(bucket=TruncHour('timestamp')).values('song', 'bucket').annotate(plays=Count('pk'))
+    return {(row['song'], row['bucket']): row['plays'] for row in rows.order_by()}
+
+
+def add_rollups(counts: dict) -> None:
+    """Add ``{(song id, hour): plays}`` to the hourly rollups."""
+    keys = list(counts)
+    for offset in range(0, len(keys), BATCH_SIZE):
+        batch = keys[offset:offset + BATCH_SIZE]
+        existing = dict.fromkeys(batch, 0)
+        for rollup in SongPlayRollup.objects.filter(
+            song__in={song_id for song_id, _ in batch}, bucket__in={bucket for _, bucket in batch}
+        ).values_list('song', 'bucket', 'plays'):
+            if rollup[:2] in existing:
+                existing[rollup[:2]] = rollup[2]
+        SongPlayRollup.objects.bulk_create(
+            (SongPlayRollup(song_id=song_id, bucket=bucket, plays=plays + counts[song_id, bucket])
+             for (song_id, bucket), plays in existing.items()),
+            update_conflicts=True, unique_fields=['song', 'bucket'], update_fields=['plays'],
+        )
+
+
+def update_window_counts(window: str, deltas: Counter) -> None:
+    """Add ``{song id: plays}``, negative for plays that left the window, to its counts."""
+    song_ids = [song_id for song_id, delta in deltas.items() if delta]
+    for offset in range(0, len(song_ids), BATCH_SIZE):
+        batch = song_ids[offset:offset + BATCH_SIZE]
+        plays = dict.fromkeys(batch, 0)
+        plays.update(WindowPlayCount.objects.filter(window=window, song__in=batch).values_list('song', 'plays'))
+        totals = {song_id: count + deltas[song_id] for song_id, count in plays.items()}
+
+        WindowPlayCount.objects.filter(window=window, song__in=[pk for pk, total in totals.items() if total <= 0]).delete()
+        WindowPlayCount.objects.bulk_create(
+            (WindowPlayCount(window=window, song_id=song_id, plays=total) for song_id, total in totals.items() if total > 0),
+            update_conflicts=True, unique_fields=['window', 'song'], update_fields=['plays'],
+        )
+
+
+def write_chart(window: str) -> None:
+    """Rank the songs of ``window`` globally and per artist."""
+    counts = WindowPlayCount.objects.filter(window=window)
+    entries = [
+        ChartEntry(window=window, rank=rank, song_id=song_id, plays=plays)
+        for rank, (song_id, plays) in enumerate(
+            counts.order_by('-plays', 'song').values_list('song', 'plays')[:settings.CHARTS_SIZE], start=1
+        )
+    ]
+
+    artist, rank = None, 0
+    for artist_id, song_id, plays in counts.filter(song__artists__isnull=False).order_by(
+        'song__artists', '-plays', 'song'
+    ).values_list('song__artists', 'song', 'plays').iterator(chunk_size=BATCH_SIZE):
+        if artist_id != artist:
+            artist, rank = artist_id, 0
+        rank += 1
+        if rank <= settings.CHARTS_ARTIST_SIZE:
+            entries.append(ChartEntry(window=window, artist_id=artist_id, rank=rank, song_id=song_id, plays=plays))
+
+    ChartEntry.objects.filter(window=window).delete()
+    ChartEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+
+def prune_rollups(now) -> None:
+    SongPlayRollup.objects.filter(
+        bucket__lt=hour_start(now - timedelta(days=settings.CHARTS_ROLLUP_RETENTION_DAYS))
+    ).delete()
+
+
+def refresh_charts(now=None) -> ChartBuild:
+    """
+    Roll up the play events added since the last run, those committed late below its last
+    one included (see ``music_lib.watermarks``), and slide the windows to ``now``.
+
+    Window counts get the new plays of their buckets and lose those of the buckets that
+    left the window; the other rollups are not read. Only the charts of windows whose
+    counts changed are rewritten.
+    """
+    previous = ChartBuild.objects.order_by('-pk').first()
+    if previous is None:
+        return rebuild_charts(now)
+
+    now = now or timezone.now()
+    try:
+        rows, last_id, gaps = read_new(PlayEvent.objects.all(), previous.play_event_id, previous.play_event_gaps)
+    except TooManyGaps as e:
+        logger.warning('Rebuilding the charts: %s', e)
+        return rebuild_charts(now)
+    counts = bucketed_plays(PlayEvent.objects.filter(rows))
+
+    with transaction.atomic():
+        for window in WINDOWS:
+            start, previous_start = window_start(window, now), window_start(window, previous.ended_at)
+            deltas = Counter()
+            # Read before the new plays are added to the rollups, those of expired buckets were never counted.
+            if start > previous_start:
+                for song_id, plays in SongPlayRollup.objects.filter(
+                    bucket__gte=previous_start, bucket__lt=start
+                ).values('song').annotate(plays=Sum('plays')).values_list('song', 'plays').order_by():
+                    deltas[song_id] -= plays
+            for (song_id, bucket), plays in counts.items():
+                if bucket >= start:
+                    deltas[song_id] += plays
+
+            if any(deltas.values()):
+                update_window_counts(window, deltas)
+                write_chart(window)
+
+        add_rollups(counts)
+        prune_rollups(now)
+        return ChartBuild.objects.create(play_event_id=last_id, play_event_gaps=gaps, ended_at=now)
+
+
+def rebuild_charts(now=None) -> ChartBuild:
+    """Recompute the rollups, window counts and charts from the play events of the retention period."""
+    now = now or timezone.now()
+    rows, last_id, gaps = read_all(PlayEvent.objects.all())
+    since = hour_start(now - timedelta(days=settings.CHARTS_ROLLUP_RETENTION_DAYS))
+
+    with transaction.atomic():
+        SongPlayRollup.objects.all().delete()
+        WindowPlayCount.objects.all().delete()
+        counts = bucketed_plays(PlayEvent.objects.filter(rows, timestamp__gte=since))
+        SongPlayRollup.objects.bulk_create(
+            (SongPlayRollup(song_id=song_id, bucket=bucket, plays=plays) for (song_id, bucket), plays in counts.items()),
+            batch_size=BATCH_SIZE,
+        )
+
+        for window in WINDOWS:
+            WindowPlayCount.objects.bulk_create(
+                (WindowPlayCount(window=window, song_id=song_id, plays=plays)
+                 for song_id, plays in SongPlayRollup.objects.filter(bucket__gte=window_start(window, now)).values(
+                     'song'
+                 ).annotate(plays=Sum('plays')).values_list('song', 'plays').order_by()),
+                batch_size=BATCH_SIZE,
+            )
+            write_chart(window)
+
+        return ChartBuild.objects.create(play_event_id=last_id, play_event_gaps=gaps, ended_at=now)
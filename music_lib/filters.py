@@ -1,12 +1,13 @@
-from django.db import models
 from django_filters import rest_framework as filters
 
+from music_lib.models import Song
+from music_lib.search import search_songs
+
 
 class SongFilter(filters.FilterSet):
-    search = filters.CharFilter(method='filter_name_or_artist', label='Search by name or artist')
+    search = filters.CharFilter(method='filter_name_or_artist', label='Search by name, artist or album')
+    status = filters.ChoiceFilter(choices=Song.STATUS_CHOICES, label='Upload processing status')
+    is_available = filters.BooleanFilter(label='Only available (or unavailable) songs')
 
     def filter_name_or_artist(self, queryset, name, value):
-        return queryset.filter(
-            models.Q(name__icontains=value)
-            | models.Q(artists__name__icontains=value)
-        )
+        return search_songs(queryset, value)
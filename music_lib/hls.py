@@ -0,0 +1,219 @@
+import base64
+import hashlib
+import logging
+import math
+import os
+import posixpath
+import subprocess
+import tempfile
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from music_lib.cache import get_catalog_cache
+from music_lib.models import DerivedFile, Song, HLSPackage
+from music_lib.storage import content_digest, digest_directory
+from music_lib.transcoding import ENCODER_FFMPEG, ENCODER_STUB, claim, get_encoder_name, source_bitrate, transcoder
+
+logger = logging.getLogger(__name__)
+
+HLS_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+HLS_PREFIX = 'hls'
+PLAYLIST_NAME = 'index.m3u8'
+# Segment size of the stub segmenter when the song duration is unknown.
+STUB_SEGMENT_BYTES = 64 * 1024
+# Advertised bandwidth (kbps) of an original whose bitrate is unknown.
+DEFAULT_ORIGINAL_BITRATE = 320
+
+
+def get_segment_duration() -> int:
+    return getattr(settings, 'HLS_SEGMENT_DURATION', 6)
+
+
+def ffmpeg_segment(source: str, directory: str, segment_duration: int, duration: float) -> None:
+    subprocess.run(
+        [
+            getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'), '-nostdin', '-loglevel', 'error', '-y',
+            '-i', source, '-vn', '-codec:a', 'copy',
+            '-f', 'hls', '-hls_time', str(segment_duration), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(directory, '%05d.ts'),
+            os.path.join(directory, PLAYLIST_NAME),
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+def stub_segment(source: str, directory: str, segment_duration: int, duration: float) -> None:
+    """Segmenter for tests and machines without ffmpeg: cuts the file into equal byte slices."""
+    size = os.path.getsize(source)
+    count = math.ceil(duration / segment_duration) if duration else math.ceil(size / STUB_SEGMENT_BYTES)
+    count = max(count, 1)
+    segment_bytes = math.ceil(size / count)
+
+    lines = [
+        '#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{segment_duration}',
+        '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    with open(source, 'rb') as f:
+        for index in range(count):
+            name = f'{index:05d}.ts'
+            with open(os.path.join(directory, name), 'wb') as segment:
+                segment.write(f.read(segment_bytes))
+            length = min(segment_duration, duration - index * segment_duration) if duration else segment_duration
+            lines += [f'#EXTINF:{length:.3f},', name]
+    lines.append('#EXT-X-ENDLIST')
+
+    with open(os.path.join(directory, PLAYLIST_NAME), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+SEGMENTERS = {ENCODER_FFMPEG: ffmpeg_segment, ENCODER_STUB: stub_segment}
+
+
+def get_segmenter():
+    # Same tooling as the transcoder (AUDIO_TRANSCODER).
+    return SEGMENTERS[get_encoder_name()]
+
+
+def is_stored(name: str, size: int) -> bool:
+    try:
+        return default_storage.size(name) == size
+    except OSError:
+        return False
+
+
+def package(package_id: int) -> HLSPackage:
+    hls_package = HLSPackage.objects.select_related('song').get(pk=package_id)
+    song = hls_package.song
+    media = song.file
+    if hls_package.bitrate is not None:
+        media = song.renditions.get(bitrate=hls_package.bitrate).file
+
+    label = hls_package.bitrate or 'original'
+    segment_duration = get_segment_duration()
+    digest = content_digest(song.file.name)
+    waiting = HLSPackage.objects.none()
+    if digest:
+        # Songs with the same content share the packages of their blob: the directory is named after
+        # everything the segments are cut from, so its URLs keep serving the same bytes.
+        prefix = f'{digest_directory(HLS_PREFIX, digest)}/{digest}/{label}-{segment_duration}s'
+        derived, owned = claim(prefix)
+        if not owned:
+            # Otherwise the worker packaging the blob marks this package ready with it.
+            if derived.status == DerivedFile.READY:
+                mark_ready([hls_package], prefix)
+            return hls_package
+        waiting = HLSPackage.objects.filter(
+            song__file=song.file.name, bitrate=hls_package.bitrate, status=HLSPackage.PENDING,
+        ).exclude(pk=hls_package.pk)
+    else:
+        # A fresh directory per run keeps every published segment URL immutable.
+        prefix = f'{HLS_PREFIX}/{song.pk}/{label}/{uuid.uuid4().hex[:12]}'
+        derived = None
+
+    # Packages made before the claims were kept are reused as they are.
+    if not HLSPackage.objects.filter(playlist=f'{prefix}/{PLAYLIST_NAME}', status=HLSPackage.READY).exists():
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                get_segmenter()(media.path, directory, segment_duration, float(song.duration))
+                # The playlist goes last, once the segments it lists are stored.
+                for name in sorted(os.listdir(directory), key=lambda name: name == PLAYLIST_NAME):
+                    path, stored = os.path.join(directory, name), f'{prefix}/{name}'
+                    # Files of an earlier run are kept, unless it was cut short.
+                    if not is_stored(stored, os.path.getsize(path)):
+                        default_storage.delete(stored)
+                        with open(path, 'rb') as f:
+                            default_storage.save(stored, File(f))
+        except Exception:
+            logger.exception('Failed to package %s for HLS', media.name)
+            if derived is not None:
+                derived.delete()
+            for failed in [hls_package, *waiting]:
+                failed.status = HLSPackage.FAILED
+                failed.save(update_fields=['status'])
+            return hls_package
+
+    if derived is not None:
+        derived.status = DerivedFile.READY
+        derived.save(update_fields=['status'])
+    mark_ready([hls_package, *waiting], prefix)
+    return hls_package
+
+
+def mark_ready(packages: list[HLSPackage], prefix: str) -> None:
+    for hls_package in packages:
+        hls_package.playlist.name = f'{prefix}/{PLAYLIST_NAME}'
+        hls_package.status = HLSPackage.READY
+        hls_package.save(update_fields=['playlist', 'status'])
+
+
+def queue_package(song: Song, bitrate: int | None = None) -> HLSPackage | None:
+    """Package the original (``bitrate`` None) or a rendition of ``song`` on the transcoder pool."""
+    if not getattr(settings, 'HLS_PACKAGING', True):
+        return None
+
+    packages = HLSPackage.objects.filter(song=song, bitrate=bitrate)
+    if packages.exclude(status=HLSPackage.FAILED).exists():
+        return None
+    packages.delete()
+
+    hls_package = HLSPackage.objects.create(song=song, bitrate=bitrate)
+    transaction.on_commit(lambda: transcoder.submit(package, hls_package.pk))
+    return hls_package
+
+
+def sign_url(url: str) -> str:
+    """
+    Add an expiring signature to a segment URL, in the format checked by nginx's
+    ``secure_link`` module (``secure_link_md5 "$secure_link_expires$uri <secret>"``).
+    URLs are left as they are without ``HLS_SECURE_LINK_SECRET``.
+    """
+    secret = getattr(settings, 'HLS_SECURE_LINK_SECRET', '')
+    if not secret:
+        return url
+
+    expires = int(time.time()) + getattr(settings, 'HLS_SECURE_LINK_TTL', 6 * 60 * 60)
+    digest = hashlib.md5(f'{expires}{urlsplit(url).path} {secret}'.encode()).digest()
+    signature = base64.urlsafe_b64encode(digest).decode().rstrip('=')
+    return f'{url}?{urlencode({"md5": signature, "expires": expires})}'
+
+
+def read_playlist(hls_package: HLSPackage) -> str:
+    # Packaged playlists never change, cache them for as long as the cache keeps them.
+    cache = get_catalog_cache()
+    key = f'hls:{hls_package.playlist.name}'
+    text = cache.get(key)
+    if text is None:
+        with hls_package.playlist.open('rb') as f:
+            text = f.read().decode()
+        cache.set(key, text, timeout=None)
+    return text
+
+
+def render_media_playlist(hls_package: HLSPackage) -> str:
+    """The stored playlist with its segment names turned into (signed) media URLs."""
+    base = getattr(settings, 'HLS_MEDIA_URL', None) or settings.MEDIA_URL
+    directory = posixpath.dirname(hls_package.playlist.name)
+
+    lines = []
+    for line in read_playlist(hls_package).splitlines():
+        if line and not line.startswith('#'):
+            line = sign_url(f'{base.rstrip("/")}/{directory}/{line}')
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def render_master_playlist(song: Song, packages: list[HLSPackage]) -> str:
+    """One variant per ready package, pointing at the media playlist endpoint relative to this one."""
+    original = source_bitrate(song) or DEFAULT_ORIGINAL_BITRATE
+    lines = ['#EXTM3U']
+    for hls_package in sorted(packages, key=lambda p: p.bitrate or original):
+        bandwidth = int((hls_package.bitrate or original) * 1000)
+        lines += [f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}', f'{hls_package.bitrate or "original"}/']
+    return '\n'.join(lines) + '\n'
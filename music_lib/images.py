@@ -0,0 +1,174 @@
+import atexit
+import hashlib
+import io
+import logging
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import ExifTags, Image, ImageOps
+
+from music_lib.models import Artist, Album, Playlist
+from music_lib.storage import content_digest
+from music_lib.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# Image fields with variants, each stored in its ``<field>_variants`` JSON field.
+IMAGE_FIELDS = {
+    Album: ('cover',),
+    Artist: ('avatar', 'thumbnail'),
+    Playlist: ('cover',),
+}
+DEFAULT_WIDTHS = (96, 320, 640)
+DEFAULT_FORMATS = ('webp', 'jpeg')
+# Pillow format and file extension of each variant format.
+FORMATS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg')}
+VARIANTS_PREFIX = 'images'
+# EXIF orientations whose images are stored rotated by a quarter turn.
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def variants_field(field_name: str) -> str:
+    return f'{field_name}_variants'
+
+
+def get_widths() -> tuple:
+    return tuple(sorted(getattr(settings, 'IMAGE_VARIANT_WIDTHS', DEFAULT_WIDTHS), reverse=True))
+
+
+def get_formats() -> tuple:
+    return tuple(getattr(settings, 'IMAGE_VARIANT_FORMATS', DEFAULT_FORMATS))
+
+
+def get_quality() -> int:
+    return getattr(settings, 'IMAGE_VARIANT_QUALITY', 80)
+
+
+def settings_digest(widths: tuple, formats: tuple, quality: int) -> str:
+    """A short hash of the encoding settings, so that changing them never reuses the old files."""
+    return hashlib.sha256(repr((widths, formats, quality)).encode()).hexdigest()[:8]
+
+
+def is_stale(instance, field_name: str) -> bool:
+    """Whether the variants of the image were made from another file (or none were made yet)."""
+    image = getattr(instance, field_name)
+    variants = getattr(instance, variants_field(field_name))
+    return variants.get('source') != (image.name or None)
+
+
+def resize(data: bytes, widths: tuple, formats: tuple, quality: int) -> dict:
+    """
+    Encode the image ``data`` at each of ``widths`` (largest first) in each of ``formats``,
+    returning ``{(width, format): bytes}``. Images are never upscaled: widths at or above
+    the width of the upright source are left out.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        source_width, source_height = image.size
+        transposed = image.getexif().get(ExifTags.Base.Orientation) in TRANSPOSED_ORIENTATIONS
+        if transposed:
+            source_width, source_height = source_height, source_width
+        widths = [width for width in widths if width < source_width]
+        if not widths:
+            return {}
+        # JPEGs are decoded at the smallest DCT scale still larger than the widest variant,
+        # a box given in the stored orientation since the draft is taken before the transpose.
+        box = (widths[0], source_height * widths[0] // source_width)
+        image.draft('RGB', box[::-1] if transposed else box)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+        encoded = {}
+        for width in widths:
+            # Each size is reduced from the previous one, which is cheaper than from the source.
+            image = image.resize((width, max(round(image.height * width / image.width), 1)), Image.Resampling.LANCZOS)
+            for name in formats:
+                pillow_format, _ = FORMATS[name]
+                output = image.convert('RGB') if pillow_format == 'JPEG' and image.mode != 'RGB' else image
+                buffer = io.BytesIO()
+                output.save(buffer, pillow_format, quality=quality, optimize=pillow_format == 'JPEG')
+                encoded[width, name] = buffer.getvalue()
+        return encoded
+
+
+def build_variants(model, field_name: str, object_id: int):
+    instance = model.objects.filter(pk=object_id).first()
+    if instance is None:
+        return None
+    image = getattr(instance, field_name)
+    previous = getattr(instance, variants_field(field_name))
+    variants = {}
+
+    if image:
+        try:
+            with image.open('rb') as f:
+                data = f.read()
+            widths, formats, quality = get_widths(), get_formats(), get_quality()
+            encoded = resize(data, widths, formats, quality)
+        except Exception:
+            logger.exception('Failed to resize %s', image.name)
+            variants = {'source': image.name, 'failed': True}
+        else:
+            # The directory is named after the content and the encoding settings, so a variant URL
+            # always serves the same bytes.
+            directory = posixpath.join(
+                VARIANTS_PREFIX, model._meta.model_name, str(instance.pk), field_name,
+                '{}-{}'.format(
+                    (content_digest(image.name) or hashlib.sha256(data).hexdigest())[:16],
+                    settings_digest(widths, formats, quality),
+                ),
+            )
+            files = {}
+            for (width, name), content in encoded.items():
+                path = posixpath.join(directory, f'{width}.{FORMATS[name][1]}')
+                if not default_storage.exists(path):
+                    path = default_storage.save(path, ContentFile(content))
+                files.setdefault(name, {})[str(width)] = path
+            variants = {'source': image.name, 'files': files}
+
+    with transaction.atomic():
+        # The image may have been replaced while it was resized, its own job will store its variants.
+        current = model.objects.select_for_update().filter(pk=object_id).first()
+        if current is None or (getattr(current, field_name).name or None) != variants.get('source'):
+            return None
+        setattr(current, variants_field(field_name), variants)
+        current.save(update_fields=[variants_field(field_name)])
+
+    superseded = {
+        path for files in previous.get('files', {}).values() for path in files.values()
+    } - {path for files in variants.get('files', {}).values() for path in files.values()}
+    for path in superseded:
+        default_storage.delete(path)
+    return current
+
+
+def variant_job(model, field_name: str):
+    def job(object_id: int):
+        return build_variants(model, field_name, object_id)
+    job.__name__ = f'build_{model._meta.model_name}_{field_name}_variants'
+    return job
+
+
+JOBS = {(model, field_name): variant_job(model, field_name) for model, fields in IMAGE_FIELDS.items() for field_name in fields}
+
+
+class ImageVariantPool(WorkerPool):
+    """
+    Local worker pool resizing uploaded covers and avatars to the ``IMAGE_VARIANT_WIDTHS`` in
+    each of the ``IMAGE_VARIANT_FORMATS``. Jobs start once the transaction that queued them
+    commits; with ``IMAGE_VARIANT_WORKERS = 0`` they run in the committing thread.
+    """
+
+    def __init__(self) -> None:
+        super().__init__('IMAGE_VARIANT_WORKERS', 2, 'image-variants')
+
+    def enqueue(self, instance, field_name: str) -> None:
+        job = JOBS[type(instance), field_name]
+        pk = instance.pk
+        transaction.on_commit(lambda: self.submit(job, pk))
+
+
+image_variants = ImageVariantPool()
+atexit.register(image_variants.shutdown)
@@ -0,0 +1,301 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from music_lib.benchmarks import BENCHMARK_PASSWORD, percentile, rolled_back, seed_catalog, seed_listeners, \
+    seed_play_events
+from music_lib.charts import rebuild_charts
+from music_lib.hls import package
+from music_lib.models import Song, HLSPackage
+from music_lib.play_events import play_event_buffer
+from music_lib.recommendations import build_neighbours
+from music_lib.tickets import issue_ticket
+from music_lib.transcoding import ENCODER_STUB
+
+DEFAULT_BUDGETS = Path(__file__).resolve().parents[2] / 'benchmark_budgets.json'
+
+
+def endpoints(fixture: dict) -> list[dict]:
+    """
+    The requests of the benchmark, covering every route of ``music_lib.urls`` and the token views.
+
+    ``path`` and ``data`` are called with the index of the request, so that repeated requests
+    spread over the catalog instead of hitting one object.
+    """
+    songs, albums, artists = fixture['songs'], fixture['albums'], fixture['artists']
+    playlists, streamed = fixture['playlists'], fixture['streamed']
+    # Songs are moved around the whole playlist, as listeners do, rather than into one gap
+    # that is halved on every request until the playlist is renumbered.
+    entries = fixture['playlist_songs']
+
+    def pick(objects, i):
+        return objects[i * 7919 % len(objects)]
+
+    return [
+        {'name': 'api-root', 'method': 'get', 'path': lambda i: '/api/'},
+        {'name': 'songs-list', 'method': 'get', 'path': lambda i: '/api/songs/'},
+        {'name': 'songs-list-compact', 'method': 'get', 'path': lambda i: '/api/songs/?compact=true'},
+        {'name': 'songs-search', 'method': 'get', 'path': lambda i: f'/api/songs/?search={fixture["words"][i % 50]}'},
+        {'name': 'songs-detail', 'method': 'get', 'path': lambda i: f'/api/songs/{pick(songs, i)}/'},
+        {'name': 'songs-favorites', 'method': 'get', 'path': lambda i: '/api/songs/favorites/'},
+        {'name': 'songs-related', 'method': 'get', 'path': lambda i: f'/api/songs/{pick(songs, i)}/related/'},
+        {'name': 'songs-liked-status', 'method': 'get',
+         'path': lambda i: '/api/songs/liked_status/?ids=' + ','.join(str(pick(songs, i + j)) for j in range(50))},
+        {'name': 'songs-is-liked', 'method': 'get', 'path': lambda i: f'/api/songs/{pick(songs, i)}/is_liked/'},
+        {'name': 'songs-like', 'method': 'post', 'path': lambda i: f'/api/songs/{pick(songs, i)}/like/'},
+        {'name': 'songs-bulk-like', 'method': 'post', 'path': lambda i: '/api/songs/bulk_like/',
+         'data': lambda i: {'operations': [{'song': pick(songs, i + j), 'like': j % 2 == 0} for j in range(20)]}},
+        {'name': 'songs-stream', 'method': 'get', 'path': lambda i: f'/api/songs/{streamed}/stream/',
+         'headers': {'Range': 'bytes=65536-131071'}},
+        {'name': 'songs-stream-async', 'method': 'get', 'path': lambda i: f'/api/songs/{streamed}/stream/async/',
+         'headers': {'Range': 'bytes=65536-131071'}},
+        {'name': 'songs-ticket', 'method': 'post', 'path': lambda i: f'/api/songs/{streamed}/ticket/'},
+        {'name': 'stream-ticket', 'method': 'get', 'path': lambda i: fixture['ticket_path'],
+         'headers': {'Range': 'bytes=65536-131071'}, 'anonymous': True},
+        {'name': 'songs-hls', 'method': 'get', 'path': lambda i: f'/api/songs/{streamed}/hls/'},
+        {'name': 'songs-hls-variant', 'method': 'get', 'path': lambda i: f'/api/songs/{streamed}/hls/original/'},
+        {'name': 'charts-detail', 'method': 'get', 'path': lambda i: '/api/charts/day/'},
+        {'name': 'charts-artist', 'method': 'get', 'path': lambda i: f'/api/charts/week/?artist={pick(artists, i)}'},
+        {'name': 'artists-list', 'method': 'get', 'path': lambda i: '/api/artists/'},
+        {'name': 'artists-detail', 'method': 'get', 'path': lambda i: f'/api/artists/{pick(artists, i)}/'},
+        {'name': 'albums-list', 'method': 'get', 'path': lambda i: '/api/albums/'},
+        {'name': 'albums-detail', 'method': 'get', 'path': lambda i: f'/api/albums/{pick(albums, i)}/'},
+        {'name': 'albums-songs', 'method': 'get', 'path': lambda i: f'/api/albums/{pick(albums, i)}/songs/'},
+        {'name': 'playlists-list', 'method': 'get', 'path': lambda i: '/api/playlists/'},
+        {'name': 'playlists-create', 'method': 'post', 'path': lambda i: '/api/playlists/',
+         'data': lambda i: {'name': f'Benchmark {i}', 'songs': [pick(songs, i + j) for j in range(10)]}},
+        {'name': 'playlists-detail', 'method': 'get', 'path': lambda i: f'/api/playlists/{playlists[0]}/'},
+        {'name': 'playlists-rename', 'method': 'patch', 'path': lambda i: f'/api/playlists/{playlists[0]}/',
+         'data': lambda i: {'name': f'Renamed {i}'}},
+        {'name': 'playlists-names', 'method': 'get', 'path': lambda i: '/api/playlists/names/'},
+        {'name': 'playlists-songs', 'method': 'get', 'path': lambda i: f'/api/playlists/{playlists[0]}/songs/'},
+        {'name': 'playlists-add-song', 'method': 'post', 'path': lambda i: f'/api/playlists/{playlists[1]}/add_song/',
+         'data': lambda i: {'song_id': songs[-1 - i]}},
+        {'name': 'playlists-move-song', 'method': 'post', 'path': lambda i: f'/api/playlists/{playlists[0]}/move_song/',
+         'data': lambda i: {'song': pick(entries, i), 'after': pick(entries, i + len(entries) // 2)}},
+        {'name': 'playlists-update-playlists', 'method': 'post', 'path': lambda i: '/api/playlists/update_playlists/',
+         'data': lambda i: {'ids': playlists, 'song': pick(songs, i)}},
+        {'name': 'playlists-bulk-update-songs', 'method': 'post', 'path': lambda i: '/api/playlists/bulk_update_songs/',
+         'data': lambda i: {'operations': [
+             {'playlist': playlist, 'song': pick(songs, i + j), 'add': i % 2 == 0}
+             for playlist in playlists for j in range(10)
+         ]}},
+        {'name': 'token-obtain', 'method': 'post', 'path': lambda i: '/api/token/', 'anonymous': True,
+         'data': lambda i: {'username': fixture['username'], 'password': BENCHMARK_PASSWORD}},
+        {'name': 'token-refresh', 'method': 'post', 'path': lambda i: '/api/token/refresh/', 'anonymous': True,
+         'cookies': {'refresh_token': fixture['refresh']}, 'data': lambda i: {}},
+        {'name': 'token-clear', 'method': 'post', 'path': lambda i: '/api/token/clear/', 'anonymous': True},
+    ]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic catalog, request every API endpoint and record queries, p50/p99 latency and '
+        'allocations per endpoint. Fails when a budget is exceeded. All writes are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=5000)
+        parser.add_argument('--songs-per-album', type=int, default=10)
+        parser.add_argument('--albums-per-artist', type=int, default=3)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--likes-per-user', type=int, default=50)
+        parser.add_argument('--playlists-per-user', type=int, default=3)
+        parser.add_argument('--songs-per-playlist', type=int, default=30)
+        parser.add_argument('--requests', type=int, default=20, help='Measured requests per endpoint.')
+        parser.add_argument('--only', help='Comma separated endpoint names to run.')
+        parser.add_argument('--budgets', default=str(DEFAULT_BUDGETS),
+                            help='JSON file of {endpoint: {"queries": n, "p99_ms": ms, "alloc_kib": kib}}.')
+        parser.add_argument('--no-budgets', action='store_true', help='Only report, never fail.')
+        parser.add_argument('--format', choices=['text', 'json'], default='text')
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        budgets = {}
+        if not options['no_budgets']:
+            with open(options['budgets']) as f:
+                budgets = json.load(f)
+
+        media_root = tempfile.mkdtemp()
+        try:
+            # The streaming endpoints read real files; they are written to a throwaway media root.
+            # Plays are flushed by hand before the rollback instead of by the background thread.
+            # Queries are counted with stateless authentication, as deployed with a shared denylist.
+            with override_settings(MEDIA_ROOT=media_root, AUDIO_TRANSCODER=ENCODER_STUB,
+                                   PLAY_EVENTS_FLUSH_INTERVAL=0, JWT_STATELESS_AUTH=True), rolled_back():
+                fixture = self.seed(options)
+                results = self.run(fixture, options)
+                play_event_buffer.flush()
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        failures = self.check_budgets(results, budgets)
+        report = {
+            'commit': git_commit(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'scale': {key: options[key] for key in (
+                'songs', 'songs_per_album', 'albums_per_artist', 'users', 'likes_per_user',
+                'playlists_per_user', 'songs_per_playlist', 'requests',
+            )},
+            'results': results,
+            'failures': failures,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_table(results, failures)
+
+        if failures:
+            raise CommandError(f'{len(failures)} budgets exceeded.')
+
+    def seed(self, options: dict) -> dict:
+        catalog = seed_catalog(
+            options['songs'], songs_per_album=options['songs_per_album'],
+            albums_per_artist=options['albums_per_artist'],
+        )
+        songs = list(Song.objects.filter(album__in=catalog['albums']).order_by('pk').values_list('pk', flat=True))
+        listeners = seed_listeners(
+            songs, max(options['users'], 1), likes_per_user=options['likes_per_user'],
+            playlists_per_user=max(options['playlists_per_user'], 2), songs_per_playlist=options['songs_per_playlist'],
+        )
+        seed_play_events(songs, [listener.pk for listener in listeners['users']], len(songs) * 5)
+        build_neighbours()
+        rebuild_charts()
+        user = listeners['users'][0]
+        playlists = [playlist.pk for playlist in listeners['playlists'] if playlist.user_id == user.pk]
+
+        # One song gets a real file (and an HLS package) for the streaming endpoints.
+        streamed = Song.objects.get(pk=songs[0])
+        streamed.file.name = default_storage.save('benchmark/stream.mp3', ContentFile(os.urandom(1024 * 1024)))
+        streamed.duration = 60
+        streamed.save(update_fields=['file', 'duration'])
+        package(HLSPackage.objects.create(song=streamed).pk)
+        token, _ = issue_ticket(user.pk, streamed.pk, streamed.file.name)
+
+        refresh = RefreshToken.for_user(user)
+        return {
+            'songs': songs,
+            'albums': [album.pk for album in catalog['albums']],
+            'artists': [artist.pk for artist in catalog['artists']],
+            'words': [name.split()[0] for name in Song.objects.filter(pk__in=songs[:50]).values_list('name', flat=True)],
+            'playlists': playlists,
+            'playlist_songs': list(
+                Song.objects.filter(playlistsong__playlist=playlists[0]).values_list('pk', flat=True)
+            ) or songs[:2],
+            'streamed': streamed.pk,
+            'ticket_path': f'/api/stream/{token}/',
+            'username': user.username,
+            'access': str(refresh.access_token),
+            'refresh': str(refresh),
+        }
+
+    def request(self, endpoint: dict, fixture: dict, i: int):
+        if endpoint.get('anonymous'):
+            client = Client()
+        else:
+            client = Client(headers={'Authorization': f'Bearer {fixture["access"]}'})
+        for name, value in endpoint.get('cookies', {}).items():
+            client.cookies[name] = value
+
+        kwargs = {'headers': endpoint.get('headers', {})}
+        if 'data' in endpoint:
+            kwargs.update(data=json.dumps(endpoint['data'](i)), content_type='application/json')
+        response = getattr(client, endpoint['method'])(endpoint['path'](i), **kwargs)
+        if response.streaming:
+            with warnings.catch_warnings():
+                # The async stream view is consumed synchronously by the test client.
+                warnings.filterwarnings('ignore', 'StreamingHttpResponse must consume asynchronous iterators')
+                b''.join(response)
+        return response
+
+    def run(self, fixture: dict, options: dict) -> list[dict]:
+        only = set(options['only'].split(',')) if options['only'] else None
+        results = []
+        for endpoint in endpoints(fixture):
+            if only is not None and endpoint['name'] not in only:
+                continue
+
+            # The first request warms caches up, allocations are measured on their own so that
+            # tracing does not slow the timed requests down.
+            self.request(endpoint, fixture, 0)
+            tracemalloc.start()
+            self.request(endpoint, fixture, options['requests'] + 1)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            timings, queries, statuses = [], [], set()
+            for i in range(1, options['requests'] + 1):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = self.request(endpoint, fixture, i)
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries.append(len(captured))
+                statuses.add(response.status_code)
+
+            results.append({
+                'endpoint': endpoint['name'],
+                'method': endpoint['method'].upper(),
+                'path': endpoint['path'](0),
+                'statuses': sorted(statuses),
+                'queries': max(queries, default=0),
+                'p50_ms': round(percentile(timings, 50), 3) if timings else None,
+                'p99_ms': round(percentile(timings, 99), 3) if timings else None,
+                'alloc_kib': round(peak / 1024, 1),
+            })
+        return results
+
+    def check_budgets(self, results: list[dict], budgets: dict) -> list[dict]:
+        failures = []
+        for result in results:
+            errors = [status for status in result['statuses'] if status >= 400]
+            if errors:
+                failures.append({'endpoint': result['endpoint'], 'metric': 'status', 'value': errors, 'budget': '< 400'})
+            for metric, budget in budgets.get(result['endpoint'], {}).items():
+                value = result[metric]
+                if value is not None and value > budget:
+                    failures.append({'endpoint': result['endpoint'], 'metric': metric, 'value': value, 'budget': budget})
+        return failures
+
+    def write_table(self, results: list[dict], failures: list[dict]) -> None:
+        self.stdout.write(
+            f'{"endpoint":30s} {"status":>9s} {"queries":>7s} {"p50 ms":>9s} {"p99 ms":>9s} {"alloc KiB":>10s}'
+        )
+        for result in results:
+            self.stdout.write(
+                f'{result["endpoint"]:30s} {",".join(map(str, result["statuses"])):>9s} {result["queries"]:7d} '
+                f'{result["p50_ms"] or 0:9.2f} {result["p99_ms"] or 0:9.2f} {result["alloc_kib"]:10.1f}'
+            )
+        for failure in failures:
+            self.stderr.write(self.style.ERROR(
+                f'{failure["endpoint"]}: {failure["metric"]} {failure["value"]} exceeds {failure["budget"]}'
+            ))
@@ -0,0 +1,68 @@
+import shutil
+import tempfile
+import time
+
+from django.test import override_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from music_lib.benchmarks import percentile, rolled_back
+from music_lib.management.commands import benchmark_api
+from music_lib.play_events import play_event_buffer
+from music_lib.transcoding import ENCODER_STUB
+from users.authentication import ClaimsJWTAuthentication, decode_token
+
+DEFAULT_ENDPOINTS = (
+    'songs-stream', 'songs-stream-async', 'songs-ticket', 'songs-like', 'songs-is-liked', 'songs-liked-status',
+    'songs-favorites', 'playlists-list', 'playlists-songs',
+)
+
+
+class Command(benchmark_api.Command):
+    help = (
+        'Compare the queries and latency of authenticated endpoints when the user is loaded per request '
+        'and when it is built from the token claims, and the cost of validating a token with and '
+        'without the decoded token cache. All writes are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.set_defaults(only=','.join(DEFAULT_ENDPOINTS))
+        parser.add_argument('--validations', type=int, default=10_000, help='Token validations timed per variant.')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root, AUDIO_TRANSCODER=ENCODER_STUB,
+                                   PLAY_EVENTS_FLUSH_INTERVAL=0), rolled_back():
+                fixture = self.seed(options)
+                with override_settings(JWT_STATELESS_AUTH=False):
+                    loaded = self.run(fixture, options)
+                with override_settings(JWT_STATELESS_AUTH=True):
+                    stateless = self.run(fixture, options)
+                play_event_buffer.flush()
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.stdout.write(
+            f'{"endpoint":<28} {"queries":>7} {"stateless":>9} {"saved":>5} {"p50":>10} {"stateless p50":>14}'
+        )
+        for before, after in zip(loaded, stateless):
+            self.stdout.write(
+                f'{before["endpoint"]:<28} {before["queries"]:>7} {after["queries"]:>9} '
+                f'{before["queries"] - after["queries"]:>5} {before["p50_ms"]:>8.2f}ms {after["p50_ms"]:>12.2f}ms'
+            )
+
+        self.time_validations(fixture['access'].encode(), options['validations'])
+
+    def time_validations(self, raw_token: bytes, validations: int) -> None:
+        decode_token.cache_clear()
+        for label, authentication in [('signature check', JWTAuthentication()),
+                                      ('decoded token cache', ClaimsJWTAuthentication())]:
+            timings = []
+            for _ in range(validations):
+                started = time.perf_counter()
+                authentication.get_validated_token(raw_token)
+                timings.append((time.perf_counter() - started) * 1_000_000)
+            self.stdout.write(
+                f'{label:<20} p50 {percentile(timings, 50):8.1f}us  p99 {percentile(timings, 99):8.1f}us'
+            )
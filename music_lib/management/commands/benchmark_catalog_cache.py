@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from music_lib.benchmarks import percentile, rolled_back, seed_catalog
+from music_lib.cache import get_catalog_cache, song_payloads, album_payloads
+
+
+class Command(BaseCommand):
+    help = 'Measure catalog endpoint latency and cache hit ratio with a cold and a warm catalog cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=5000)
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            catalog = seed_catalog(options['songs'])
+            client = APIClient()
+            client.force_authenticate(catalog['user'])
+            album_ids = [album.pk for album in catalog['albums']]
+
+            # Walk the song list with cursors so requests cover different pages.
+            urls, url = [], '/api/songs/'
+            while url and len(urls) < options['requests'] // 2:
+                urls.append(url)
+                url = client.get(url).data['next']
+            urls += [f'/api/albums/{pk}/' for pk in album_ids[:options['requests'] - len(urls)]]
+
+            for label, clear in [('cold', True), ('warm', False)]:
+                get_catalog_cache().clear()
+                if not clear:
+                    for url in urls:
+                        client.get(url)
+                for payloads in (song_payloads, album_payloads):
+                    payloads.hits = payloads.misses = 0
+
+                timings = []
+                for url in urls:
+                    if clear:
+                        get_catalog_cache().clear()
+                    started = time.perf_counter()
+                    client.get(url)
+                    timings.append((time.perf_counter() - started) * 1000)
+
+                self.stdout.write(
+                    f'{label}: p50 {percentile(timings, 50):7.2f}ms  p99 {percentile(timings, 99):7.2f}ms  '
+                    f'song hit ratio {song_payloads.hit_ratio:.0%}  album hit ratio {album_payloads.hit_ratio:.0%}'
+                )
@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from music_lib.benchmarks import percentile, rolled_back, seed_catalog, seed_listeners, seed_play_events
+from music_lib.charts import WINDOWS, rebuild_charts, refresh_charts
+from music_lib.models import ChartEntry, PlayEvent, Song
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare reading the week chart with a GROUP BY over the play events, and time full and incremental '
+        'chart builds. All writes are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=100_000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--events', type=int, default=2_000_000, help='Play events spread over 8 days.')
+        parser.add_argument('--new-events', type=int, default=10_000, help='Play events added before the refresh.')
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            started = time.perf_counter()
+            seed_catalog(options['songs'])
+            song_ids = list(Song.objects.order_by('pk').values_list('pk', flat=True))
+            user_ids = [user.pk for user in seed_listeners(
+                song_ids, options['users'], likes_per_user=0, playlists_per_user=0,
+            )['users']]
+            seed_play_events(song_ids, user_ids, options['events'], days=8)
+            self.stdout.write(f'seeded in {time.perf_counter() - started:.1f}s')
+
+            started = time.perf_counter()
+            rebuild_charts()
+            self.stdout.write(f'full build           {time.perf_counter() - started:8.2f}s')
+
+            seed_play_events(song_ids, user_ids, options['new_events'], days=0, seed=1)
+            started = time.perf_counter()
+            refresh_charts()
+            self.stdout.write(
+                f'incremental refresh  {time.perf_counter() - started:8.2f}s  after {options["new_events"]:,} plays'
+            )
+
+            since = timezone.now() - WINDOWS['week']
+
+            def group_by():
+                return list(PlayEvent.objects.filter(timestamp__gte=since).values('song').annotate(
+                    plays=Count('pk')
+                ).order_by('-plays')[:settings.CHARTS_SIZE])
+
+            def chart():
+                return list(ChartEntry.objects.filter(window='week', artist=None).order_by('rank').values('song', 'plays'))
+
+            for label, read in [('GROUP BY events', group_by), ('chart table', chart)]:
+                timings = []
+                for _ in range(options['runs']):
+                    started = time.perf_counter()
+                    read()
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f'{label:<20} p50 {percentile(timings, 50):9.2f}ms  p99 {percentile(timings, 99):9.2f}ms'
+                )
@@ -0,0 +1,121 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from music_lib.benchmarks import percentile, rolled_back, seed_catalog, seed_listeners, seed_play_events
+from music_lib.models import Song, Playlist, PlayEvent
+
+# Indexes added for the query shapes below, as (table, index name).
+INDEXES = [
+    *((model._meta.db_table, index.name) for model in (Song, Playlist, PlayEvent) for index in model._meta.indexes),
+    ('users_user_liked_songs', 'users_liked_songs_song_user'),
+]
+
+
+def query_shapes(song_ids: list[int], user_ids: list[int]) -> list:
+    now = timezone.now()
+    likes = Song.liked_by.through
+
+    return [
+        ('available songs page', lambda rng: list(
+            Song.objects.filter(is_available=True, pk__gt=rng.choice(song_ids)).order_by('pk').values_list('pk')[:50]
+        )),
+        ('pending songs', lambda rng: list(Song.objects.filter(status=Song.PENDING).values_list('pk'))),
+        ('playlists of user', lambda rng: list(
+            Playlist.objects.filter(user=rng.choice(user_ids)).annotate(song_count=Count('playlistsong')).order_by('pk')
+        )),
+        ('recent plays of user', lambda rng: list(
+            PlayEvent.objects.filter(user=rng.choice(user_ids)).order_by('-timestamp').values_list('song')[:50]
+        )),
+        ('song plays this week', lambda rng: PlayEvent.objects.filter(
+            song=rng.choice(song_ids), timestamp__gte=now - timedelta(days=7)
+        ).count()),
+        ('plays in the last hour', lambda rng: PlayEvent.objects.filter(timestamp__gte=now - timedelta(hours=1)).count()),
+        ('listeners of song', lambda rng: list(likes.objects.filter(song=rng.choice(song_ids)).values_list('user'))),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the catalog and play event query shapes with and without the music_lib indexes, and queries '
+        'on a new versus a persistent connection. All writes are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=100_000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--events', type=int, default=500_000, help='Play events spread over 30 days.')
+        parser.add_argument('--runs', type=int, default=50, help='Runs of each query shape.')
+
+    def handle(self, *args, **options):
+        # Closing the connection would break an enclosing transaction (e.g. under tests).
+        if not connection.in_atomic_block:
+            self.compare_connections(options['runs'])
+
+        with rolled_back():
+            started = time.perf_counter()
+            self.seed(options['songs'], options['users'], options['events'])
+            self.stdout.write(f'seeded in {time.perf_counter() - started:.1f}s')
+            self.compare_indexes(options['runs'])
+
+    def seed(self, songs: int, users: int, events: int) -> None:
+        seed_catalog(songs)
+        self.song_ids = list(Song.objects.order_by('pk').values_list('pk', flat=True))
+        self.user_ids = [user.pk for user in seed_listeners(self.song_ids, users)['users']]
+        seed_play_events(self.song_ids, self.user_ids, events)
+        # One upload in a hundred is still being processed.
+        pending = random.Random(0).sample(self.song_ids, len(self.song_ids) // 100)
+        Song.objects.filter(pk__in=pending).update(status=Song.PENDING, is_available=False)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def time_shapes(self, runs: int) -> dict:
+        timings = {}
+        for label, run in query_shapes(self.song_ids, self.user_ids):
+            rng = random.Random(1)
+            timings[label] = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                run(rng)
+                timings[label].append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def compare_indexes(self, runs: int) -> None:
+        indexed = self.time_shapes(runs)
+        with connection.cursor() as cursor:
+            for table, name in INDEXES:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+        unindexed = self.time_shapes(runs)
+
+        self.stdout.write(f'{"query":<24} {"without p50":>12} {"with p50":>10} {"with p99":>10}')
+        for label, timings in indexed.items():
+            before = percentile(unindexed[label], 50)
+            after = percentile(timings, 50)
+            self.stdout.write(
+                f'{label:<24} {before:10.2f}ms {after:8.2f}ms {percentile(timings, 99):8.2f}ms  '
+                f'x{before / after if after else 0:.1f}'
+            )
+
+    def compare_connections(self, runs: int) -> None:
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        timings = {'new connection': [], 'persistent': []}
+        for _ in range(runs):
+            connection.close()
+            started = time.perf_counter()
+            query()
+            timings['new connection'].append((time.perf_counter() - started) * 1000)
+        for _ in range(runs):
+            started = time.perf_counter()
+            query()
+            timings['persistent'].append((time.perf_counter() - started) * 1000)
+
+        for label, values in timings.items():
+            self.stdout.write(f'{label:<24} p50 {percentile(values, 50):8.3f}ms  p99 {percentile(values, 99):8.3f}ms')
@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from music_lib.benchmarks import rolled_back
+from music_lib.models import Artist, Album, Song, PlayEvent
+from music_lib.play_events import PlayEventBuffer
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request play event writes with the buffered ingestion path. All writes are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10000)
+        parser.add_argument('--songs', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            self.run(options['events'], options['songs'], options['batch_size'])
+
+    def run(self, event_count: int, song_count: int, batch_size: int) -> None:
+        user = get_user_model().objects.create_user(username=f'benchmark-{time.time_ns()}')
+        artist = Artist.objects.create(user=user, name='Benchmark', bio='')
+        album = Album.objects.create(artist=artist, title='Benchmark', cover='benchmark.jpg')
+        songs = Song.objects.bulk_create(
+            Song(album=album, name=f'Song {i}', file=f'benchmark/{i}.mp3') for i in range(song_count)
+        )
+        # Popularity is skewed like real traffic: a few songs get most of the plays.
+        song_ids = random.choices([song.pk for song in songs], weights=range(song_count, 0, -1), k=event_count)
+
+        started = time.perf_counter()
+        for song_id in song_ids:
+            PlayEvent.objects.create(user=user, song_id=song_id)
+            Song.objects.filter(pk=song_id).update(play_count=F('play_count') + 1)
+        naive = time.perf_counter() - started
+
+        buffer = PlayEventBuffer(batch_size=batch_size, flush_interval=0)
+        started = time.perf_counter()
+        for song_id in song_ids:
+            buffer.record(user_id=user.pk, song_id=song_id)
+        buffer.flush()
+        buffered = time.perf_counter() - started
+
+        expected = 2 * event_count
+        actual = sum(Song.objects.filter(pk__in=[song.pk for song in songs]).values_list('play_count', flat=True))
+        if actual != expected:
+            self.stderr.write(self.style.ERROR(f'play_count mismatch: expected {expected}, got {actual}'))
+
+        self.stdout.write(f'events:   {event_count} over {song_count} songs, batch size {batch_size}')
+        self.stdout.write(f'naive:    {naive:.3f}s ({event_count / naive:,.0f} events/s)')
+        self.stdout.write(f'buffered: {buffered:.3f}s ({event_count / buffered:,.0f} events/s)')
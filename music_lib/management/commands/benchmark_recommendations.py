@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from music_lib.benchmarks import percentile, rolled_back, seed_catalog, seed_listeners, seed_play_events
+from music_lib.cache import SONG_ROW_FIELDS
+from music_lib.models import Song, SongNeighbour
+from music_lib.recommendations import build_neighbours, refresh_neighbours
+
+
+class Command(BaseCommand):
+    help = (
+        'Time a full and an incremental build of the related songs over synthetic listeners, likes and '
+        'plays, and the related songs lookup. All writes are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--likes-per-user', type=int, default=20)
+        parser.add_argument('--events', type=int, default=2_000_000, help='Play events spread over 30 days.')
+        parser.add_argument('--new-events', type=int, default=1000, help='Play events added before the refresh.')
+        parser.add_argument('--lookups', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            started = time.perf_counter()
+            seed_catalog(options['songs'])
+            song_ids = list(Song.objects.order_by('pk').values_list('pk', flat=True))
+            user_ids = [user.pk for user in seed_listeners(
+                song_ids, options['users'], likes_per_user=options['likes_per_user'], playlists_per_user=0,
+            )['users']]
+            seed_play_events(song_ids, user_ids, options['events'])
+            self.stdout.write(f'seeded in {time.perf_counter() - started:.1f}s')
+
+            started = time.perf_counter()
+            build = build_neighbours()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'full build        {elapsed:8.1f}s  {build.songs:,} songs, '
+                f'{SongNeighbour.objects.count():,} neighbours, {build.songs / elapsed:,.0f} songs/s'
+            )
+
+            seed_play_events(song_ids, user_ids, options['new_events'], days=1, seed=1)
+            started = time.perf_counter()
+            build = refresh_neighbours()
+            self.stdout.write(
+                f'incremental       {time.perf_counter() - started:8.1f}s  {build.songs:,} songs '
+                f'after {options["new_events"]:,} new plays'
+            )
+
+            self.time_lookups(song_ids, options['lookups'])
+
+    def time_lookups(self, song_ids: list[int], lookups: int) -> None:
+        # The query of SongAPIViewSet.related for a first page.
+        rng = random.Random(1)
+        timings = []
+        for _ in range(lookups):
+            started = time.perf_counter()
+            list(Song.objects.filter(neighbour_of__song=rng.choice(song_ids), is_available=True).annotate(
+                related_score=F('neighbour_of__score')
+            ).only(*SONG_ROW_FIELDS).order_by('-related_score', 'id')[:20])
+            timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(f'related lookup    p50 {percentile(timings, 50):.2f}ms  p99 {percentile(timings, 99):.2f}ms')
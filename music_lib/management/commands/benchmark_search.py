@@ -0,0 +1,45 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from music_lib.benchmarks import WORDS, percentile, rolled_back, seed_catalog
+from music_lib.models import Song
+from music_lib.search import search_songs
+
+
+def legacy_search(queryset, query):
+    return queryset.filter(models.Q(name__icontains=query) | models.Q(artists__name__icontains=query))
+
+
+class Command(BaseCommand):
+    help = 'Compare icontains search with the indexed search over a synthetic catalog. All writes are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            started = time.perf_counter()
+            seed_catalog(options['songs'])
+            self.stdout.write(f'seeded {options["songs"]:,} songs in {time.perf_counter() - started:.1f}s')
+
+            rng = random.Random(1)
+            queries = [
+                rng.choice([word, word[:3], f'{word} {rng.choice(WORDS)}'])
+                for word in rng.choices(WORDS, k=options['queries'])
+            ]
+            queryset = Song.objects.select_related('album').order_by('id')
+
+            for label, search in [('icontains', legacy_search), ('indexed', search_songs)]:
+                timings = []
+                for query in queries:
+                    started = time.perf_counter()
+                    list(search(queryset, query)[:options['page_size']])
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f'{label:<10} p50 {percentile(timings, 50):8.2f}ms  p99 {percentile(timings, 99):8.2f}ms'
+                )
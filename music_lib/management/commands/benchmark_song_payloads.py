@@ -0,0 +1,53 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from music_lib.benchmarks import percentile, rolled_back, seed_catalog
+from music_lib.models import Song
+from music_lib.payloads import PublicOrigin, build_song_payloads, compact_songs
+from music_lib.serializers import SongSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare the time to serialize 1k songs with SongSerializer and with the values() payload builder.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=1000, help='Songs serialized per run.')
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            seed_catalog(options['songs'])
+            self.run(options['songs'], options['runs'])
+
+    def run(self, song_count: int, runs: int) -> None:
+        request = Request(APIRequestFactory().get('/api/songs/'))
+        origin = PublicOrigin(request.build_absolute_uri('/'))
+        pks = list(Song.objects.order_by('-pk').values_list('pk', flat=True)[:song_count])
+
+        def serializer():
+            songs = Song.objects.filter(pk__in=pks).select_related('album__artist').prefetch_related('artists')
+            return SongSerializer(songs, many=True, context={'request': request}).data
+
+        def builder():
+            return build_song_payloads(origin, pks)
+
+        def compact():
+            return compact_songs(build_song_payloads(origin, pks))
+
+        per_thousand = 1000 / len(pks)
+        self.stdout.write(f'{len(pks)} songs, {runs} runs, per 1k songs:')
+        for label, build in [('serializer', serializer), ('values()', builder), ('compact', compact)]:
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                data = build()
+                timings.append((time.perf_counter() - started) * 1000 * per_thousand)
+            size = len(json.dumps(data, default=str)) * per_thousand
+            self.stdout.write(
+                f'{label:10s} p50 {percentile(timings, 50):8.2f}ms  p99 {percentile(timings, 99):8.2f}ms  '
+                f'{size / 1024:8.1f} KiB JSON'
+            )
@@ -0,0 +1,70 @@
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from music_lib.benchmarks import percentile, rolled_back
+from music_lib.models import Artist, Album, Song
+from music_lib.play_events import play_event_buffer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare per-chunk latency and queries of JWT authenticated range requests with stream ticket URLs. '
+        'Runs in process, all writes are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', type=int, default=1000, help='Range requests per variant.')
+        parser.add_argument('--chunk-size', type=int, default=256 * 1024)
+        parser.add_argument('--file-size', type=int, default=8 * 1024 * 1024)
+
+    def handle(self, *args, **options):
+        file_name = default_storage.save(f'benchmark/ticket-{time.time_ns()}.mp3',
+                                         ContentFile(os.urandom(options['file_size'])))
+        try:
+            with rolled_back():
+                self.run(file_name, options['chunks'], options['chunk_size'], options['file_size'])
+        finally:
+            default_storage.delete(file_name)
+
+    def run(self, file_name: str, chunks: int, chunk_size: int, file_size: int) -> None:
+        user = get_user_model().objects.create_user(username=f'benchmark-{time.time_ns()}')
+        artist = Artist.objects.create(user=user, name='Benchmark', bio='')
+        album = Album.objects.create(artist=artist, title='Benchmark', cover='benchmark.jpg')
+        song = Song.objects.create(album=album, name='Benchmark', file=file_name)
+
+        token = str(RefreshToken.for_user(user).access_token)
+        jwt_client = Client(headers={'Authorization': f'Bearer {token}'})
+        ticket_url = jwt_client.post(f'/api/songs/{song.pk}/ticket/').json()['url']
+
+        self.stdout.write(f'{chunks} range requests of {chunk_size // 1024} KiB')
+        self.measure('jwt', jwt_client, f'/api/songs/{song.pk}/stream/', chunks, chunk_size, file_size)
+        self.measure('ticket', Client(), ticket_url, chunks, chunk_size, file_size)
+        # Write the plays recorded while measuring before the song is rolled back.
+        play_event_buffer.flush()
+
+    def measure(self, label: str, client: Client, url: str, chunks: int, chunk_size: int, file_size: int) -> None:
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for index in range(chunks):
+                start = index * chunk_size % max(file_size - chunk_size, 1)
+                started = time.perf_counter()
+                response = client.get(url, HTTP_RANGE=f'bytes={start}-{start + chunk_size - 1}')
+                b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 206:
+                    self.stderr.write(self.style.ERROR(f'{label}: unexpected status {response.status_code}'))
+                    return
+
+        self.stdout.write(
+            f'{label:7s} p50 {percentile(timings, 50):7.2f}ms  p99 {percentile(timings, 99):7.2f}ms  '
+            f'{len(queries) / chunks:5.2f} queries/chunk'
+        )
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import shlex
+import socket
+import subprocess
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from music_lib.benchmarks import percentile
+from music_lib.models import Artist, Album, Song
+
+SERVERS = {
+    'wsgi': ('gunicorn music_streamer.wsgi:application --bind 127.0.0.1:{port} --workers {workers}',
+             '/api/songs/{pk}/stream/'),
+    'asgi': ('uvicorn music_streamer.asgi:application --host 127.0.0.1 --port {port} --no-access-log',
+             '/api/songs/{pk}/stream/async/'),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def listen(port: int, path: str, token: str, bitrate: int, duration: float) -> tuple[float | None, int]:
+    """
+    Play a stream like a client would: request it from the start and read it no faster
+    than ``bitrate`` bytes per second for ``duration`` seconds.
+
+    Returns the time to the first byte (``None`` if it never came) and the bytes read.
+    """
+    started = time.perf_counter()
+    deadline = started + duration
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout=duration)
+        writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer {token}\r\n'
+            f'Range: bytes=0-\r\nConnection: close\r\n\r\n'.encode()
+        )
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout=max(deadline - time.perf_counter(), 0.001))
+        if b' 206 ' not in status_line:
+            return None, 0
+        first_byte = time.perf_counter() - started
+
+        received = 0
+        while (remaining := deadline - time.perf_counter()) > 0:
+            chunk = await asyncio.wait_for(reader.read(16 * 1024), timeout=remaining)
+            if not chunk:
+                break
+            received += len(chunk)
+            await asyncio.sleep(len(chunk) / bitrate)
+        return first_byte, received
+    except (asyncio.TimeoutError, OSError):
+        return None, 0
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run_listeners(count: int, *args) -> list:
+    return await asyncio.gather(*(listen(*args) for _ in range(count)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare how many concurrent listeners the sync WSGI stream and the async ASGI stream can serve. '
+        'Starts gunicorn and uvicorn on free local ports, both must be installed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listeners', default='10,50,200', help='Comma separated concurrency levels.')
+        parser.add_argument('--workers', type=int, default=4, help='gunicorn sync workers.')
+        parser.add_argument('--duration', type=float, default=5, help='Seconds every listener plays for.')
+        parser.add_argument('--bitrate', type=int, default=40_000, help='Bytes per second a listener reads.')
+        parser.add_argument('--file-size', type=int, default=8 * 1024 * 1024)
+        parser.add_argument('--servers', default='wsgi,asgi')
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['listeners'].split(',')]
+        servers = options['servers'].split(',')
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(f'Unknown servers: {", ".join(sorted(unknown))}.')
+
+        # The servers run in other processes, so the fixtures are committed and removed afterwards.
+        user = get_user_model().objects.create_user(username=f'benchmark-{time.time_ns()}')
+        file_name = default_storage.save(f'benchmark/stream-{time.time_ns()}.mp3',
+                                         ContentFile(os.urandom(options['file_size'])))
+        try:
+            artist = Artist.objects.create(user=user, name='Benchmark', bio='')
+            album = Album.objects.create(artist=artist, title='Benchmark', cover='benchmark.jpg')
+            song = Song.objects.create(album=album, name='Benchmark', file=file_name)
+            token = str(RefreshToken.for_user(user).access_token)
+
+            for server in servers:
+                self.benchmark(server, song.pk, token, levels, options)
+        finally:
+            user.delete()
+            default_storage.delete(file_name)
+
+    def benchmark(self, server: str, song_id: int, token: str, levels: list[int], options: dict) -> None:
+        command, path = SERVERS[server]
+        port = free_port()
+        process = subprocess.Popen(
+            shlex.split(command.format(port=port, workers=options['workers'])),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            self.wait_for_port(process, port)
+            path = path.format(pk=song_id)
+            # Let every worker import the project before measuring.
+            asyncio.run(run_listeners(options['workers'], port, path, token, options['bitrate'], 1))
+
+            for level in levels:
+                results = asyncio.run(run_listeners(level, port, path, token, options['bitrate'], options['duration']))
+                first_bytes = [first_byte * 1000 for first_byte, _ in results if first_byte is not None]
+                received = sum(size for _, size in results)
+                self.stdout.write(
+                    f'{server} {level:5d} listeners: {len(first_bytes):5d} served  '
+                    f'first byte p50 {percentile(first_bytes, 50) if first_bytes else float("nan"):8.1f}ms  '
+                    f'p99 {percentile(first_bytes, 99) if first_bytes else float("nan"):8.1f}ms  '
+                    f'{received / options["duration"] / 1024:9.0f} KiB/s'
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+    def wait_for_port(self, process: subprocess.Popen, port: int, timeout: float = 20) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'Server exited with {process.returncode}: {shlex.join(process.args)}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'Server did not start listening on port {port}: {shlex.join(process.args)}')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from music_lib.images import IMAGE_FIELDS, JOBS, image_variants, is_stale, variants_field
+
+
+class Command(BaseCommand):
+    help = (
+        'Queue the resizing of every album cover, artist avatar and thumbnail and playlist cover whose '
+        'variants are missing, failed or made from a replaced file, and wait for them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Resize every image again, e.g. after changing the widths, formats or quality.')
+
+    def handle(self, *args, **options):
+        queued = 0
+        for model, fields in IMAGE_FIELDS.items():
+            for field_name in fields:
+                images = model.objects.exclude(Q(**{f'{field_name}__isnull': True}) | Q(**{field_name: ''})).only(
+                    'pk', field_name, variants_field(field_name)
+                )
+                for instance in images.order_by('pk').iterator():
+                    variants = getattr(instance, variants_field(field_name))
+                    if options['force'] or variants.get('failed') or is_stale(instance, field_name):
+                        image_variants.submit(JOBS[model, field_name], instance.pk)
+                        queued += 1
+        image_variants.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Resized {queued} images.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from music_lib.blobs import collect_blobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove the content-addressed media files no song, album, artist or playlist has referenced for '
+        'MEDIA_BLOB_GRACE_PERIOD seconds with their renditions and HLS segments, orphaned files and abandoned '
+        'temporary files. Run it periodically.'
+    )
+
+    def handle(self, *args, **options):
+        removed, freed = collect_blobs()
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} files, {freed / 1024 / 1024:.1f} MiB freed.'))
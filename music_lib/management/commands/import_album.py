@@ -0,0 +1,88 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from music_lib.models import Artist, Album, Song
+from music_lib.processing import AUDIO_EXTENSIONS, COVER_EXTENSIONS, COVER_NAMES, processing_pool, \
+    queue_processing
+from music_lib.workers import WorkerPool
+
+
+class Command(BaseCommand):
+    help = (
+        'Import the audio files of local album directories as pending songs and process them '
+        'in parallel on the upload processing pool.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directories', nargs='+', help='One album per directory, the directory name is the title.')
+        parser.add_argument('--user', required=True, help='Username owning the artist.')
+        parser.add_argument('--artist', required=True, help='Artist name, created when missing.')
+        parser.add_argument('--workers', type=int, help='Processing threads (default AUDIO_PROCESSING_WORKERS).')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'Unknown user {options["user"]!r}.')
+        for directory in options['directories']:
+            if not os.path.isdir(directory):
+                raise CommandError(f'{directory} is not a directory.')
+
+        pool = processing_pool
+        if options['workers'] is not None:
+            pool = WorkerPool('AUDIO_PROCESSING_WORKERS', 4, 'processing', workers=options['workers'])
+
+        artist, _ = Artist.objects.get_or_create(user=user, name=options['artist'], defaults={'bio': ''})
+        song_ids = []
+        for directory in options['directories']:
+            song_ids += self.import_album(artist, directory, pool)
+        pool.shutdown()
+
+        processed = Song.objects.filter(pk__in=song_ids)
+        failed = processed.filter(status=Song.FAILED).values_list('file', 'processing_error')
+        for name, error in failed:
+            self.stderr.write(self.style.ERROR(f'{name}: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {processed.filter(status=Song.READY).count()} of {len(song_ids)} songs '
+            f'from {len(options["directories"])} albums.'
+        ))
+
+    def import_album(self, artist: Artist, directory: str, pool: WorkerPool) -> list[int]:
+        names = sorted(os.listdir(directory))
+        tracks = [name for name in names if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS]
+        if not tracks:
+            self.stderr.write(self.style.WARNING(f'No audio files in {directory}, skipped.'))
+            return []
+
+        title = os.path.basename(os.path.normpath(directory))
+        song_ids = []
+        with transaction.atomic():
+            album = Album(artist=artist, title=title)
+            cover = self.find_cover(names)
+            if cover:
+                with open(os.path.join(directory, cover), 'rb') as f:
+                    album.cover.save(cover, File(f), save=False)
+            album.save()
+
+            for track in tracks:
+                with open(os.path.join(directory, track), 'rb') as f:
+                    song = Song(album=album, name=os.path.splitext(track)[0], status=Song.PENDING, is_available=False)
+                    song.file.save(track, File(f), save=False)
+                    song.save()
+                song_ids.append(song.pk)
+                queue_processing(song, pool)
+            artist.song_set.add(*song_ids)
+
+        self.stdout.write(f'{title}: queued {len(song_ids)} songs.')
+        return song_ids
+
+    def find_cover(self, names: list[str]) -> str | None:
+        for name in names:
+            stem, extension = os.path.splitext(name.lower())
+            if stem in COVER_NAMES and extension in COVER_EXTENSIONS:
+                return name
+        return None
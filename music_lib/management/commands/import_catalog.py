@@ -0,0 +1,269 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from music_lib.cache import album_payloads
+from music_lib.models import Artist, Album, Song
+from music_lib.processing import AUDIO_EXTENSIONS, COVER_EXTENSIONS, COVER_NAMES, probe
+
+UNKNOWN_ARTIST = 'Unknown Artist'
+UNKNOWN_ALBUM = 'Unknown Album'
+# Separator of several artists in a manifest's artist column.
+ARTIST_SEPARATOR = ';'
+
+
+def storage_name(path: str) -> str:
+    """
+    Where a source file is stored: in place when it already is in the media root, otherwise
+    under a name derived from its path, so that a resumed import recognizes its songs.
+    """
+    path = os.path.abspath(path)
+    root = os.path.abspath(default_storage.location)
+    if os.path.commonpath([path, root]) == root:
+        return os.path.relpath(path, root).replace(os.sep, '/')
+    digest = hashlib.sha1(path.encode()).hexdigest()
+    return f'catalog/{digest[:2]}/{digest}{os.path.splitext(path)[1].lower()}'
+
+
+def store(path: str) -> str:
+    name = storage_name(path)
+    # Kept from an interrupted run when it already exists.
+    if not default_storage.exists(name):
+        with open(path, 'rb') as f:
+            saved = default_storage.save(name, File(f))
+        if saved != name:
+            # Another worker stored the same file meanwhile, e.g. the cover of the album.
+            default_storage.delete(saved)
+    return name
+
+
+def prepare(entry: dict, loudness: bool) -> tuple[dict, dict | None, str]:
+    """
+    Probe and store one entry and its cover in a worker process: (entry, metadata or None,
+    error). The stored cover is set as ``cover_file``; a cover that cannot be stored leaves
+    it empty with a ``cover_error`` rather than failing the song.
+    """
+    try:
+        metadata = probe(entry['path'], loudness=loudness)
+        metadata['file'] = store(entry['path'])
+    except Exception as e:
+        return entry, None, str(e) or e.__class__.__name__
+
+    entry = {**entry, 'cover_file': '', 'cover_error': ''}
+    if entry['cover']:
+        try:
+            entry['cover_file'] = store(entry['cover'])
+        except OSError as e:
+            entry['cover_error'] = str(e) or e.__class__.__name__
+    return entry, metadata, ''
+
+
+def find_cover(directory: str) -> str | None:
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return None
+    for name in names:
+        stem, extension = os.path.splitext(name.lower())
+        if stem in COVER_NAMES and extension in COVER_EXTENSIONS:
+            return os.path.join(directory, name)
+    return None
+
+
+def walk_directory(root: str):
+    """Audio files under ``root``; the layout ``Artist/Album/track`` is used when tags are missing."""
+    covers = {}
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        parts = os.path.relpath(directory, root).split(os.sep)
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() not in AUDIO_EXTENSIONS:
+                continue
+            if directory not in covers:
+                covers[directory] = find_cover(directory)
+            yield {
+                'path': os.path.join(directory, name),
+                'name': None, 'artists': None, 'album': None,
+                'cover': covers[directory],
+                'default_artist': parts[-2] if len(parts) >= 2 else UNKNOWN_ARTIST,
+                'default_album': parts[-1] if parts != ['.'] else UNKNOWN_ALBUM,
+            }
+
+
+def manifest_entry(row: dict, base: str) -> dict:
+    artists = row.get('artists') or row.get('artist') or None
+    if isinstance(artists, str):
+        artists = [artist.strip() for artist in artists.split(ARTIST_SEPARATOR) if artist.strip()]
+    cover = row.get('cover') or None
+    return {
+        'path': os.path.join(base, row['path']),
+        'name': row.get('name') or row.get('title') or None,
+        'artists': artists or None,
+        'album': row.get('album') or None,
+        'cover': os.path.join(base, cover) if cover else None,
+        'default_artist': UNKNOWN_ARTIST,
+        'default_album': UNKNOWN_ALBUM,
+    }
+
+
+def read_manifest(path: str):
+    """Rows of a CSV (with a header) or JSONL manifest: path, name, artist(s), album, cover."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            yield manifest_entry(row, base)
+
+
+def batched(iterable, size: int):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Import a catalog from a directory tree or a CSV/JSONL manifest. Files are probed in a process pool '
+        'and rows are written with bulk inserts; songs imported by an earlier run are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory, or manifest ending in .csv or .jsonl.')
+        parser.add_argument('--user', required=True, help='Username owning the created artists.')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Probing processes.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Songs written per transaction.')
+        parser.add_argument('--no-loudness', action='store_true', help="Skip decoding the files for their loudness.")
+
+    def handle(self, *args, **options):
+        try:
+            self.user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'Unknown user {options["user"]!r}.')
+
+        source = options['source']
+        if os.path.isdir(source):
+            entries = walk_directory(source)
+        elif os.path.isfile(source) and source.endswith(('.csv', '.jsonl')):
+            entries = read_manifest(source)
+        else:
+            raise CommandError(f'{source} is neither a directory nor a .csv/.jsonl manifest.')
+
+        entries = list(self.skip_imported(entries, options['batch_size']))
+        self.stdout.write(f'{len(entries)} songs to import.')
+        self.artists = dict(Artist.objects.filter(user=self.user).values_list('name', 'pk'))
+        self.albums = {
+            (artist_id, title): pk
+            for pk, artist_id, title in Album.objects.filter(artist__user=self.user).values_list('pk', 'artist', 'title')
+        }
+
+        started = time.perf_counter()
+        imported = failed = 0
+        failed_covers = set()
+        loudness = not options['no_loudness']
+        with ProcessPoolExecutor(max_workers=options['processes'], initializer=django.setup) as executor:
+            results = executor.map(partial(prepare, loudness=loudness), entries, chunksize=16)
+            for batch in batched(results, options['batch_size']):
+                ready = []
+                for entry, metadata, error in batch:
+                    if metadata is None:
+                        failed += 1
+                        self.stderr.write(self.style.ERROR(f'{entry["path"]}: {error}'))
+                    else:
+                        ready.append((entry, metadata))
+                        if entry['cover_error'] and entry['cover'] not in failed_covers:
+                            failed_covers.add(entry['cover'])
+                            self.stderr.write(self.style.WARNING(
+                                f'{entry["cover"]}: {entry["cover_error"]}; its album is imported without a cover.'
+                            ))
+                imported += self.write_batch(ready)
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{imported + failed}/{len(entries)} processed, {failed} failed, '
+                    f'{imported / elapsed * 60:,.0f} songs/min'
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} songs, {failed} failed. Run transcode_songs to queue their renditions.'
+        ))
+
+    def skip_imported(self, entries, batch_size: int):
+        """The entries not imported by an earlier run, each file once (manifests may list it twice)."""
+        seen = set()
+        for batch in batched(entries, batch_size):
+            names = {storage_name(entry['path']) for entry in batch} - seen
+            seen.update(Song.objects.filter(file__in=names).values_list('file', flat=True))
+            for entry in batch:
+                name = storage_name(entry['path'])
+                if name not in seen:
+                    seen.add(name)
+                    yield entry
+
+    def write_batch(self, ready: list[tuple[dict, dict]]) -> int:
+        rows = []
+        for entry, metadata in ready:
+            tags = metadata['tags']
+            artists = entry['artists'] or [tags.get('artist') or entry['default_artist']]
+            album = entry['album'] or tags.get('album') or entry['default_album']
+            name = entry['name'] or tags.get('title') or os.path.splitext(os.path.basename(entry['path']))[0]
+            rows.append((entry, metadata, list(dict.fromkeys(artists)), album, name))
+
+        with transaction.atomic():
+            self.create_artists({artist for _, _, artists, _, _ in rows for artist in artists})
+            covers = {}
+            for entry, _, artists, album, _ in rows:
+                key = self.artists[artists[0]], album
+                covers[key] = covers.get(key) or entry['cover_file']
+            touched = self.create_albums(covers)
+
+            songs = Song.objects.bulk_create(
+                Song(
+                    album_id=self.albums[self.artists[artists[0]], album],
+                    name=name,
+                    search_document=' '.join([name, *artists, album]),
+                    **metadata,
+                )
+                for entry, metadata, artists, album, name in rows
+            )
+            through = Song.artists.through
+            through.objects.bulk_create(
+                through(song_id=song.pk, artist_id=self.artists[artist])
+                for song, (_, _, artists, _, _) in zip(songs, rows)
+                for artist in artists
+            )
+            # Albums that existed before embed a stale song list.
+            transaction.on_commit(lambda: album_payloads.invalidate(touched))
+        return len(songs)
+
+    def create_artists(self, names: set[str]) -> None:
+        missing = [name for name in names if name not in self.artists]
+        for artist in Artist.objects.bulk_create(Artist(user=self.user, name=name, bio='') for name in missing):
+            self.artists[artist.name] = artist.pk
+
+    def create_albums(self, covers: dict) -> set[int]:
+        """
+        Create the missing ``(artist id, title)`` albums with their stored ``covers``, returning
+        the ids of the existing ones.
+        """
+        missing = [key for key in covers if key not in self.albums]
+        albums = Album.objects.bulk_create(
+            Album(artist_id=artist_id, title=title, cover=covers[artist_id, title]) for artist_id, title in missing
+        )
+        for album in albums:
+            self.albums[album.artist_id, album.title] = album.pk
+        return {self.albums[key] for key in covers if key not in missing}
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from music_lib.models import Song
+from music_lib.processing import process_song, processing_pool
+from music_lib.workers import WorkerPool
+
+
+class Command(BaseCommand):
+    help = (
+        'Process the songs still pending, e.g. queued by a process that stopped before their turn, '
+        'and wait for them. Run it after deploys and restarts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true', help='Also retry the songs whose processing failed.')
+        parser.add_argument('--workers', type=int, help='Processing threads (default AUDIO_PROCESSING_WORKERS).')
+
+    def handle(self, *args, **options):
+        pool = processing_pool
+        if options['workers'] is not None:
+            pool = WorkerPool('AUDIO_PROCESSING_WORKERS', 4, 'processing', workers=options['workers'])
+
+        statuses = [Song.PENDING, Song.FAILED] if options['failed'] else [Song.PENDING]
+        song_ids = list(Song.objects.filter(status__in=statuses).order_by('pk').values_list('pk', flat=True))
+        for song_id in song_ids:
+            pool.submit(process_song, song_id)
+        pool.shutdown()
+
+        processed = Song.objects.filter(pk__in=song_ids)
+        for name, error in processed.filter(status=Song.FAILED).values_list('file', 'processing_error'):
+            self.stderr.write(self.style.ERROR(f'{name}: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed.filter(status=Song.READY).count()} of {len(song_ids)} songs.'
+        ))
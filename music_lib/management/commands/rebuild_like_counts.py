@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from music_lib.models import Song
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized Song.like_count from User.liked_songs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('song_ids', nargs='*', type=int, help='Only rebuild these songs (default: all).')
+
+    def handle(self, *args, **options):
+        queryset = Song.objects.all()
+        if options['song_ids']:
+            queryset = queryset.filter(pk__in=options['song_ids'])
+
+        updated = queryset.update_like_counts()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt like counts for {updated} songs.'))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from music_lib.recommendations import build_neighbours, refresh_neighbours
+
+
+class Command(BaseCommand):
+    help = 'Precompute the related songs of every song from likes and recent plays.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Only refresh the songs of listeners with new likes or plays since the last run.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        build = refresh_neighbours() if options['incremental'] else build_neighbours()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the related songs of {build.songs} songs in {time.perf_counter() - started:.1f}s.'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from music_lib.models import Song
+from music_lib.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recompute Song.search_document and rebuild the database search index.'
+
+    def handle(self, *args, **options):
+        updated = Song.objects.update_search_documents()
+        rebuild_search_index()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {updated} search documents and rebuilt the {connection.vendor} search index.'
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from music_lib.charts import rebuild_charts, refresh_charts
+
+
+class Command(BaseCommand):
+    help = 'Roll up the new play events and refresh the hour, day and week charts. Run it periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute the rollups from all retained play events.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        build = rebuild_charts() if options['full'] else refresh_charts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Charts refreshed up to play event {build.play_event_id} in {time.perf_counter() - started:.2f}s.'
+        ))
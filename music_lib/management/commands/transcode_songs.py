@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music_lib.hls import queue_package
+from music_lib.models import Song, SongRendition
+from music_lib.transcoding import transcoder
+
+
+class Command(BaseCommand):
+    help = 'Queue the missing or failed renditions and HLS packages of every processed song and wait for them.'
+
+    def handle(self, *args, **options):
+        renditions = packages = 0
+        songs = Song.objects.filter(status=Song.READY).only('pk', 'file', 'duration', 'bitrate')
+        for song in songs.order_by('pk').iterator():
+            with transaction.atomic():
+                renditions += len(transcoder.enqueue(song))
+                # Renditions that become ready are packaged by the SongRendition post_save receiver.
+                ready = song.renditions.filter(status=SongRendition.READY).values_list('bitrate', flat=True)
+                for bitrate in [None, *ready]:
+                    packages += queue_package(song, bitrate) is not None
+        transcoder.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Encoded {renditions} renditions and queued {packages} HLS packages.'))
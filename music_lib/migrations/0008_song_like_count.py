@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_like_counts(apps, schema_editor):
+    Song = apps.get_model('music_lib', 'Song')
+    User = apps.get_model('users', 'User')
+    likes = User.liked_songs.through.objects.filter(
+        song=OuterRef('pk')
+    ).order_by().values('song').annotate(count=Count('*')).values('count')
+    Song.objects.update(like_count=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0007_alter_song_duration'),
+        ('users', '0003_alter_user_liked_songs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_like_counts, migrations.RunPython.noop),
+    ]
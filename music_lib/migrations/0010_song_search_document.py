@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+# The index as it was created by this migration, music_lib.search may change after it.
+FTS_TABLE = 'music_lib_song_fts'
+
+CREATE_INDEX = {
+    'postgresql': [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX IF NOT EXISTS music_lib_song_search_trgm '
+        'ON music_lib_song USING gin (search_document gin_trgm_ops)',
+    ],
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"search_document, content='music_lib_song', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON music_lib_song BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+        f"CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON music_lib_song BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) "
+        f"VALUES ('delete', old.id, old.search_document); END",
+        f"CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF search_document ON music_lib_song BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) "
+        f"VALUES ('delete', old.id, old.search_document); "
+        f"INSERT INTO {FTS_TABLE}(rowid, search_document) VALUES (new.id, new.search_document); END",
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    ],
+}
+DROP_INDEX = {
+    'postgresql': [
+        'DROP INDEX IF EXISTS music_lib_song_search_trgm',
+    ],
+    'sqlite': [
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+        f'DROP TABLE IF EXISTS {FTS_TABLE}',
+    ],
+}
+
+
+def populate_search_documents(apps, schema_editor):
+    Song = apps.get_model('music_lib', 'Song')
+    songs = Song.objects.select_related('album').prefetch_related('artists').order_by('pk')
+
+    batch = []
+    for song in songs.iterator(chunk_size=1000):
+        song.search_document = ' '.join([song.name, *(a.name for a in song.artists.all()), song.album.title])
+        batch.append(song)
+        if len(batch) >= 1000:
+            Song.objects.bulk_update(batch, ['search_document'])
+            batch = []
+    Song.objects.bulk_update(batch, ['search_document'])
+
+
+def create_search_index(apps, schema_editor):
+    for statement in CREATE_INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    for statement in DROP_INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0009_alter_playevent_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+POSITION_GAP = 1 << 16
+
+
+def populate_positions(apps, schema_editor):
+    # Existing entries keep the order they were added in.
+    PlaylistSong = apps.get_model('music_lib', 'PlaylistSong')
+    entries = list(PlaylistSong.objects.order_by('playlist', 'id').only('pk', 'playlist', 'position'))
+    playlist, position = None, 0
+    for entry in entries:
+        if entry.playlist_id != playlist:
+            playlist, position = entry.playlist_id, 0
+        position += POSITION_GAP
+        entry.position = position
+    PlaylistSong.objects.bulk_update(entries, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0010_song_search_document'),
+    ]
+
+    operations = [
+        # Turn the auto-created through table of Playlist.songs into an explicit model
+        # without touching the database, then add the position column to it.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PlaylistSong',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music_lib.playlist')),
+                        ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music_lib.song')),
+                    ],
+                    options={
+                        'db_table': 'music_lib_playlist_songs',
+                        'unique_together': {('playlist', 'song')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='playlist',
+                    name='songs',
+                    field=models.ManyToManyField(blank=True, through='music_lib.PlaylistSong', to='music_lib.song'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='playlistsong',
+            name='position',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_positions, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='playlistsong',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='playlistsong',
+            constraint=models.UniqueConstraint(fields=('playlist', 'song'), name='unique_playlist_song'),
+        ),
+        migrations.AddIndex(
+            model_name='playlistsong',
+            index=models.Index(fields=['playlist', 'position'], name='music_lib_playlist_position'),
+        ),
+    ]
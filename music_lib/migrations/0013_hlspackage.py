@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0012_songrendition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HLSPackage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bitrate', models.PositiveIntegerField(blank=True, null=True)),
+                ('playlist', models.FileField(blank=True, max_length=255, upload_to='')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hls_packages', to='music_lib.song')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('song', 'bitrate'), name='unique_song_hls_package'), models.UniqueConstraint(condition=models.Q(('bitrate__isnull', True)), fields=('song',), name='unique_song_original_hls_package')],
+            },
+        ),
+    ]
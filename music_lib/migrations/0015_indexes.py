@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0014_song_processing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='playevent',
+            index=models.Index(fields=['user', '-timestamp'], name='music_lib_playevent_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='playevent',
+            index=models.Index(fields=['song', '-timestamp'], name='music_lib_playevent_song_time'),
+        ),
+        migrations.AddIndex(
+            model_name='playevent',
+            index=models.Index(fields=['timestamp'], name='music_lib_playevent_time'),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=models.Index(fields=['user', 'id'], name='music_lib_playlist_user'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['id'], name='music_lib_song_available'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['status', 'id'], name='music_lib_song_status'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0015_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NeighbourBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('like_id', models.BigIntegerField(default=0)),
+                ('play_event_id', models.BigIntegerField(default=0)),
+                ('is_full', models.BooleanField()),
+                ('songs', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SongNeighbour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('neighbour', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbour_of', to='music_lib.song')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbours', to='music_lib.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['song', '-score'], name='music_lib_song_neighbours')],
+                'constraints': [models.UniqueConstraint(fields=('song', 'neighbour'), name='unique_song_neighbour')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0016_song_neighbours'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('play_event_id', models.BigIntegerField(default=0)),
+                ('ended_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChartEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(choices=[('hour', 'Last hour'), ('day', 'Last day'), ('week', 'Last week')], max_length=8)),
+                ('rank', models.PositiveIntegerField()),
+                ('plays', models.PositiveIntegerField()),
+                ('artist', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='music_lib.artist')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music_lib.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', 'artist', 'rank'], name='music_lib_chart_rank')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SongPlayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music_lib.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='music_lib_rollup_bucket')],
+                'constraints': [models.UniqueConstraint(fields=('song', 'bucket'), name='unique_song_play_rollup')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WindowPlayCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(choices=[('hour', 'Last hour'), ('day', 'Last day'), ('week', 'Last week')], max_length=8)),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music_lib.song')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', '-plays'], name='music_lib_window_plays')],
+                'constraints': [models.UniqueConstraint(fields=('window', 'song'), name='unique_window_play_count')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:03
+
+import music_lib.models
+import music_lib.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0018_image_variants'),
+    ]
+
+    operations = [
+        # The storage is not part of the schema. Altering the fields would have SQLite rebuild the
+        # tables, and the search index triggers of music_lib_song with them.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='album',
+                    name='cover',
+                    field=models.ImageField(storage=music_lib.storage.ContentAddressedStorage(), upload_to=music_lib.models.generate_cover_image_path),
+                ),
+                migrations.AlterField(
+                    model_name='artist',
+                    name='avatar',
+                    field=models.ImageField(blank=True, null=True, storage=music_lib.storage.ContentAddressedStorage(), upload_to=music_lib.models.upload_artist_avatar_to),
+                ),
+                migrations.AlterField(
+                    model_name='artist',
+                    name='thumbnail',
+                    field=models.ImageField(blank=True, null=True, storage=music_lib.storage.ContentAddressedStorage(), upload_to=music_lib.models.upload_artist_thumbnail_to),
+                ),
+                migrations.AlterField(
+                    model_name='playlist',
+                    name='cover',
+                    field=models.ImageField(blank=True, null=True, storage=music_lib.storage.ContentAddressedStorage(), upload_to=music_lib.models.upload_playlist_cover_to),
+                ),
+                migrations.AlterField(
+                    model_name='song',
+                    name='file',
+                    field=models.FileField(storage=music_lib.storage.ContentAddressedStorage(), upload_to=music_lib.models.generate_song_file_path),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('references', models.IntegerField(default=0)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['references', 'released_at'], name='music_lib_blob_released')],
+            },
+        ),
+    ]
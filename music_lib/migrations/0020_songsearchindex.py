@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0019_media_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongSearchIndex',
+            fields=[
+                ('song', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='music_lib.song')),
+                ('search_document', models.TextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'music_lib_song_fts',
+                'managed': False,
+            },
+        ),
+    ]
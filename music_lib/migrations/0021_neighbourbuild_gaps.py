@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0020_songsearchindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='neighbourbuild',
+            name='like_gaps',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='neighbourbuild',
+            name='play_event_gaps',
+            field=models.JSONField(default=list),
+        ),
+    ]
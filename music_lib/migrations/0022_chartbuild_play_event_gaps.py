@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0021_neighbourbuild_gaps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chartbuild',
+            name='play_event_gaps',
+            field=models.JSONField(default=list),
+        ),
+    ]
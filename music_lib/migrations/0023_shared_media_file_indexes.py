@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0022_chartbuild_play_event_gaps'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hlspackage',
+            name='playlist',
+            field=models.FileField(blank=True, db_index=True, max_length=255, upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='songrendition',
+            name='file',
+            field=models.FileField(blank=True, db_index=True, max_length=255, upload_to=''),
+        ),
+    ]
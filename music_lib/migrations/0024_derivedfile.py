@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_lib', '0023_shared_media_file_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DerivedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('claimed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -1,8 +1,14 @@
 from django.conf import settings
 from django.db import models
-from django.utils.functional import cached_property
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
+from music_lib.storage import content_addressed_storage
 
+
+# Uploads are stored by content digest (music_lib.storage), the names below only lend them
+# their extension. They are kept for the migrations and files stored before.
 def generate_song_file_path(instance: 'Song', filename: str) -> str:
     return f'album/{instance.album.title}/songs/{filename}'
 
@@ -21,11 +27,35 @@ def upload_artist_avatar_to(instance: 'Artist', filename: str) -> str:
     return f'artists/{instance.name}/avatar/{filename}'
 
 
-class Artist(models.Model):
+class LoadedFilesMixin:
+    """
+    Remembers the names of the files loaded from the database in ``_loaded_files``, so that
+    ``music_lib.blobs`` can tell which ones a save replaces without reading the row again.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred fields are absent from __dict__, files are plain names until first accessed.
+        instance._loaded_files = {
+            field.attname: instance.__dict__[field.attname] for field in cls._meta.concrete_fields
+            if isinstance(field, models.FileField) and field.attname in instance.__dict__
+        }
+        return instance
+
+
+class Artist(LoadedFilesMixin, models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
-    avatar = models.ImageField(upload_to=upload_artist_avatar_to, null=True, blank=True)
-    thumbnail = models.ImageField(upload_to=upload_artist_thumbnail_to, null=True, blank=True)
+    avatar = models.ImageField(
+        upload_to=upload_artist_avatar_to, storage=content_addressed_storage, null=True, blank=True,
+    )
+    thumbnail = models.ImageField(
+        upload_to=upload_artist_thumbnail_to, storage=content_addressed_storage, null=True, blank=True,
+    )
+    # Resized copies of the images, written by music_lib.images.
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
+    thumbnail_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField()
     is_verified = models.BooleanField(default=False)
 
@@ -33,43 +63,412 @@ class Artist(models.Model):
         return self.name
 
 
-class Album(models.Model):
+class Album(LoadedFilesMixin, models.Model):
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
-    cover = models.ImageField(upload_to=generate_cover_image_path)
+    cover = models.ImageField(upload_to=generate_cover_image_path, storage=content_addressed_storage)
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self) -> str:
         return self.title
 
 
-class Song(models.Model):
+class SongQuerySet(models.QuerySet):
+    def update_like_counts(self) -> int:
+        """Recompute the denormalized ``like_count`` of every song in the queryset in one UPDATE."""
+        likes = Song.liked_by.through.objects.filter(
+            song=OuterRef('pk')
+        ).order_by().values('song').annotate(count=Count('*')).values('count')
+        return self.update(like_count=Coalesce(Subquery(likes), 0))
+
+    def update_search_documents(self, batch_size: int = 1000) -> int:
+        """Rebuild ``search_document`` from the song name, artist names and album title."""
+        songs = self.select_related('album').prefetch_related('artists').only(
+            'pk', 'name', 'search_document', 'album__title'
+        ).order_by('pk')
+
+        updated, batch = 0, []
+        for song in songs.iterator(chunk_size=batch_size):
+            document = song.build_search_document()
+            if document != song.search_document:
+                song.search_document = document
+                batch.append(song)
+            if len(batch) >= batch_size:
+                updated += Song.objects.bulk_update(batch, ['search_document'])
+                batch = []
+        if batch:
+            updated += Song.objects.bulk_update(batch, ['search_document'])
+        return updated
+
+
+class Song(LoadedFilesMixin, models.Model):
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed')]
+
     artists = models.ManyToManyField(Artist)
     album = models.ForeignKey(Album, on_delete=models.CASCADE)
 
     name = models.CharField(max_length=255)
-    file = models.FileField(upload_to=generate_song_file_path)
+    file = models.FileField(upload_to=generate_song_file_path, storage=content_addressed_storage)
     is_available = models.BooleanField(default=True)
     duration = models.DecimalField(default=0, max_digits=10, decimal_places=2)
+    # Uploads are probed in the background by music_lib.processing, which fills in the
+    # audio metadata below and makes the song available.
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=READY)
+    processing_error = models.TextField(blank=True, default='')
+    # Kilobits per second.
+    bitrate = models.PositiveIntegerField(null=True, blank=True)
+    sample_rate = models.PositiveIntegerField(null=True, blank=True)
+    channels = models.PositiveSmallIntegerField(null=True, blank=True)
+    # RMS level in dBFS.
+    loudness = models.FloatField(null=True, blank=True)
+    # Embedded (ID3) tags: title, artist, album, track, disc, genre, year.
+    tags = models.JSONField(default=dict, blank=True)
     play_count = models.PositiveIntegerField(default=0)
+    # Kept in sync with User.liked_songs by music_lib.signals.
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    # Denormalized text indexed for search (music_lib.search), kept in sync by music_lib.signals.
+    search_document = models.TextField(blank=True, default='', editable=False)
+
+    objects = SongQuerySet.as_manager()
 
-    @cached_property
-    def like_count(self) -> int:
-        return self.liked_by.count()
+    class Meta:
+        indexes = [
+            # Pages of available songs in id order.
+            models.Index(fields=['id'], condition=models.Q(is_available=True), name='music_lib_song_available'),
+            # ?status= filtered pages, e.g. the uploads still processing or failed.
+            models.Index(fields=['status', 'id'], name='music_lib_song_status'),
+        ]
+
+    def build_search_document(self) -> str:
+        return ' '.join([self.name, *(artist.name for artist in self.artists.all()), self.album.title])
 
     def __str__(self) -> str:
         return self.name
 
 
-class Playlist(models.Model):
+class FullTextMatch(models.Lookup):
+    """``column__match=query``: an SQLite FTS5 ``MATCH`` restricted to the column."""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class SongSearchIndex(models.Model):
+    """
+    The SQLite FTS5 table over ``Song.search_document`` (``music_lib.search``), mapped so that
+    searches join it instead of going through ``extra()``. Created and kept in sync by SQL.
+    """
+    song = models.OneToOneField(
+        Song, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_index',
+    )
+    search_document = models.TextField()
+    # FTS5's bm25() of the row for the query being matched, lower for better matches.
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'music_lib_song_fts'
+
+
+SongSearchIndex._meta.get_field('search_document').register_lookup(FullTextMatch)
+
+
+class SongRendition(models.Model):
+    """A lower-bitrate encoding of a song's file, produced by ``music_lib.transcoding``."""
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed')]
+
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='renditions')
+    # Kilobits per second.
+    bitrate = models.PositiveIntegerField()
+    # Shared by the songs whose file is the same blob, looked up before encoding it again.
+    file = models.FileField(max_length=255, blank=True, db_index=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'bitrate'], name='unique_song_rendition'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.song} ({self.bitrate} kbps)'
+
+
+class HLSPackage(models.Model):
+    """
+    A song, or one of its renditions, cut into fixed-duration HLS segments by ``music_lib.hls``.
+
+    Segments are stored under a directory named after the blob, rendition and segment
+    duration they are cut from (shared by the songs with the same content), or unique to
+    each packaging run for files stored before blobs, so they never change and can be
+    cached forever.
+    """
+    PENDING = SongRendition.PENDING
+    READY = SongRendition.READY
+    FAILED = SongRendition.FAILED
+
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='hls_packages')
+    # Bitrate of the packaged rendition, null for the original file.
+    bitrate = models.PositiveIntegerField(null=True, blank=True)
+    playlist = models.FileField(max_length=255, blank=True, db_index=True)
+    status = models.CharField(max_length=16, choices=SongRendition.STATUS_CHOICES, default=PENDING)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'bitrate'], name='unique_song_hls_package'),
+            models.UniqueConstraint(
+                fields=['song'], condition=models.Q(bitrate__isnull=True), name='unique_song_original_hls_package'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.song} ({self.bitrate or "original"} HLS)'
+
+
+class DerivedFile(models.Model):
+    """
+    A rendition or HLS package of a blob, claimed by the worker making it (see
+    ``music_lib.transcoding.claim``): songs with the same content wait for it instead of
+    making their own copy.
+    """
+    PENDING = SongRendition.PENDING
+    READY = SongRendition.READY
+
+    # Storage name of the rendition, or of the directory of the HLS package.
+    name = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=16, choices=SongRendition.STATUS_CHOICES, default=PENDING)
+    claimed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class Playlist(LoadedFilesMixin, models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    songs = models.ManyToManyField(Song, blank=True)
+    songs = models.ManyToManyField(Song, blank=True, through='PlaylistSong')
 
-    cover = models.ImageField(upload_to=upload_playlist_cover_to, null=True, blank=True)
+    cover = models.ImageField(
+        upload_to=upload_playlist_cover_to, storage=content_addressed_storage, null=True, blank=True,
+    )
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
     name = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='music_lib_playlist_user'),
+        ]
+
+    def append_songs(self, song_ids) -> list:
+        """Add songs after the current last one, in the given order."""
+        position = PlaylistSong.objects.next_positions([self.pk])[self.pk]
+        return PlaylistSong.objects.bulk_create(
+            PlaylistSong(playlist=self, song_id=song_id, position=position + i * PlaylistSong.POSITION_GAP)
+            for i, song_id in enumerate(song_ids)
+        )
+
+    def move_song(self, song_id: int, after_song_id: int | None = None) -> None:
+        """
+        Move a song right after another one, or to the start when ``after_song_id`` is None.
+
+        Only the moved entry is written, unless there is no free position left between
+        its new neighbours; then the playlist is renumbered first.
+        """
+        entries = PlaylistSong.objects.filter(playlist=self)
+        entry = entries.get(song_id=song_id)
+        others = entries.exclude(pk=entry.pk).order_by('position', 'id').values_list('position', flat=True)
+
+        if after_song_id is None:
+            lower, upper = None, others.first()
+        else:
+            lower = entries.get(song_id=after_song_id).position
+            upper = others.filter(position__gt=lower).first()
+
+        if lower is None:
+            position = PlaylistSong.POSITION_GAP if upper is None else upper - PlaylistSong.POSITION_GAP
+        elif upper is None:
+            position = lower + PlaylistSong.POSITION_GAP
+        elif upper - lower > 1:
+            position = (lower + upper) // 2
+        else:
+            entries.renumber()
+            return self.move_song(song_id, after_song_id)
+
+        entries.filter(pk=entry.pk).update(position=position)
+
+
+class PlaylistSongQuerySet(models.QuerySet):
+    def next_positions(self, playlist_ids) -> dict:
+        """Position after the last entry of each playlist, answered by the (playlist, position) index."""
+        last = dict(
+            self.filter(playlist__in=playlist_ids).values('playlist').annotate(
+                last=Max('position')
+            ).values_list('playlist', 'last')
+        )
+        return {pk: last.get(pk, 0) + PlaylistSong.POSITION_GAP for pk in playlist_ids}
+
+    def renumber(self) -> int:
+        """Spread the positions of the entries evenly again, keeping their order."""
+        entries = list(self.order_by('playlist', 'position', 'id').only('pk', 'playlist', 'position'))
+        playlist, position = None, 0
+        for entry in entries:
+            if entry.playlist_id != playlist:
+                playlist, position = entry.playlist_id, 0
+            position += PlaylistSong.POSITION_GAP
+            entry.position = position
+        return PlaylistSong.objects.bulk_update(entries, ['position'], batch_size=1000)
+
+
+class PlaylistSong(models.Model):
+    # Entries are spaced by this much, so a song can be inserted or moved between two others
+    # by writing a single row; ``renumber`` respaces a playlist once a gap is used up.
+    POSITION_GAP = 1 << 16
+
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    position = models.BigIntegerField(default=0)
+
+    objects = PlaylistSongQuerySet.as_manager()
+
+    class Meta:
+        # The table of the former auto-created through model.
+        db_table = 'music_lib_playlist_songs'
+        constraints = [
+            models.UniqueConstraint(fields=['playlist', 'song'], name='unique_playlist_song'),
+        ]
+        indexes = [
+            models.Index(fields=['playlist', 'position'], name='music_lib_playlist_position'),
+        ]
+
 
 class PlayEvent(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the play is recorded, not when the buffered event is flushed.
+    timestamp = models.DateTimeField(default=timezone.now)
     duration = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # A listener's history and a song's plays, newest first, and plays in a time window.
+            models.Index(fields=['user', '-timestamp'], name='music_lib_playevent_user_time'),
+            models.Index(fields=['song', '-timestamp'], name='music_lib_playevent_song_time'),
+            models.Index(fields=['timestamp'], name='music_lib_playevent_time'),
+        ]
+
+
+class SongNeighbour(models.Model):
+    """
+    One of the songs most often liked or played by the listeners of ``song``, precomputed
+    by ``music_lib.recommendations`` so that related songs are a single indexed lookup.
+    """
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbours')
+    neighbour = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbour_of')
+    # Cosine similarity of the two songs' listener sets, in (0, 1].
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'neighbour'], name='unique_song_neighbour'),
+        ]
+        indexes = [
+            models.Index(fields=['song', '-score'], name='music_lib_song_neighbours'),
+        ]
+
+
+class NeighbourBuild(models.Model):
+    """A run of ``music_lib.recommendations``; the latest is where an incremental refresh resumes."""
+    # Last like (row of the User.liked_songs table) and play event included, and the ids below
+    # them not committed yet (see music_lib.watermarks).
+    like_id = models.BigIntegerField(default=0)
+    like_gaps = models.JSONField(default=list)
+    play_event_id = models.BigIntegerField(default=0)
+    play_event_gaps = models.JSONField(default=list)
+    is_full = models.BooleanField()
+    songs = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class SongPlayRollup(models.Model):
+    """Plays of a song during one hour, aggregated from ``PlayEvent`` by ``music_lib.charts``."""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    # Start of the hour.
+    bucket = models.DateTimeField()
+    plays = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'bucket'], name='unique_song_play_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket'], name='music_lib_rollup_bucket'),
+        ]
+
+
+class WindowPlayCount(models.Model):
+    """Plays of a song over a chart window, the sum of its rollups in the window."""
+    HOUR = 'hour'
+    DAY = 'day'
+    WEEK = 'week'
+    WINDOW_CHOICES = [(HOUR, 'Last hour'), (DAY, 'Last day'), (WEEK, 'Last week')]
+
+    window = models.CharField(max_length=8, choices=WINDOW_CHOICES)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    plays = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'song'], name='unique_window_play_count'),
+        ]
+        indexes = [
+            models.Index(fields=['window', '-plays'], name='music_lib_window_plays'),
+        ]
+
+
+class ChartEntry(models.Model):
+    """A ranked song of the global (``artist`` null) or an artist's chart of a window."""
+    window = models.CharField(max_length=8, choices=WindowPlayCount.WINDOW_CHOICES)
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE, null=True, blank=True)
+    rank = models.PositiveIntegerField()
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    plays = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['window', 'artist', 'rank'], name='music_lib_chart_rank'),
+        ]
+
+
+class ChartBuild(models.Model):
+    """A run of ``music_lib.charts``; the latest is where the next one resumes."""
+    # Last play event rolled up, and the ids below it not committed yet (see music_lib.watermarks).
+    play_event_id = models.BigIntegerField(default=0)
+    play_event_gaps = models.JSONField(default=list)
+    # The windows ended at this time.
+    ended_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class MediaBlob(models.Model):
+    """
+    A file of the content-addressed storage and the number of model fields naming it, kept
+    by ``music_lib.blobs``. Unreferenced blobs are removed by the ``collect_media`` command.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    references = models.IntegerField(default=0)
+    # When the last reference went away; blobs are only removed after a grace period.
+    released_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['references', 'released_at'], name='music_lib_blob_released'),
+        ]
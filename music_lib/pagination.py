@@ -0,0 +1,59 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from music_lib.payloads import shape_songs
+
+
+class SongPaginationClass(CursorPagination):
+    """
+    Keyset pagination over song ids: every page is an indexed ``id > cursor`` range scan,
+    so deep pages cost the same as the first one. Search results are paged by relevance,
+    playlist contents by their position in the playlist, related songs by similarity.
+
+    The total is not computed unless the client asks for it with ``?count=true``.
+    """
+    page_size = 20
+    ordering = 'id'
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        if 'search_rank' in queryset.query.annotations:
+            return '-search_rank', 'id'
+        if 'playlist_position' in queryset.query.annotations:
+            return 'playlist_position', 'id'
+        if 'related_score' in queryset.query.annotations:
+            return '-related_score', 'id'
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = queryset.order_by().count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {'type': 'integer', 'example': 123}
+        return response_schema
+
+
+def paginate_songs(view, queryset, render) -> Response:
+    """
+    Paginate song-list actions.
+
+    ``render(request, page)`` turns the page of songs into response data, which is then
+    shaped by the ``?fields=`` and ``?compact=`` parameters (see ``music_lib.payloads``).
+    """
+    paginator = SongPaginationClass()
+    page = paginator.paginate_queryset(queryset, view.request, view=view)
+    songs, included = shape_songs(view.request, render(view.request, page))
+    response = paginator.get_paginated_response(songs)
+    if included is not None:
+        response.data['included'] = included
+    return response
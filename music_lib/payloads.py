@@ -0,0 +1,168 @@
+from collections import defaultdict
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+from rest_framework.request import Request
+
+from music_lib.models import Song, Artist, Album
+
+# Columns of the song payload, in ``SongSerializer`` order; ``album`` and ``artists`` are nested.
+SONG_PAYLOAD_FIELDS = (
+    'id', 'name', 'is_available', 'duration', 'play_count', 'like_count', 'status', 'processing_error',
+    'bitrate', 'sample_rate', 'channels', 'loudness', 'tags',
+)
+ARTIST_PAYLOAD_FIELDS = (
+    'id', 'name', 'avatar', 'thumbnail', 'avatar_variants', 'thumbnail_variants', 'bio', 'is_verified', 'user',
+)
+# Artists in the ``included`` side table of compact responses leave out the long and private fields.
+COMPACT_ARTIST_FIELDS = ('id', 'name', 'avatar', 'thumbnail', 'is_verified')
+# Content types of the formats of music_lib.images.
+VARIANT_CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+FIELDS_QUERY_PARAM = 'fields'
+COMPACT_QUERY_PARAM = 'compact'
+
+duration_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class PublicOrigin:
+    """
+    Stands in for the request when building cached payloads: file fields only ask it for
+    absolute URLs, which it makes on ``PUBLIC_ORIGIN`` rather than on the request's Host.
+    """
+
+    def __init__(self, origin: str) -> None:
+        self.origin = origin.rstrip('/') + '/'
+
+    def build_absolute_uri(self, location: str = '/') -> str:
+        return urljoin(self.origin, location)
+
+
+def get_public_origin() -> PublicOrigin | None:
+    origin = getattr(settings, 'PUBLIC_ORIGIN', None)
+    return PublicOrigin(origin) if origin else None
+
+
+def file_url(request: Request | PublicOrigin | None, name: str) -> str | None:
+    # Same as DRF's FileField: absolute with a request in the context.
+    if not name:
+        return None
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def variant_srcset(request: Request | PublicOrigin | None, variants: dict) -> dict:
+    """
+    ``{content type: srcset}`` of the resized copies of an image, e.g.
+    ``{'image/webp': '.../96.webp 96w, .../320.webp 320w'}``; empty until they are made.
+    """
+    return {
+        VARIANT_CONTENT_TYPES[name]: ', '.join(
+            f'{file_url(request, path)} {width}w' for width, path in sorted(files.items(), key=lambda item: int(item[0]))
+        )
+        for name, files in variants.get('files', {}).items()
+    }
+
+
+def build_song_payloads(origin: PublicOrigin | None, pks) -> list[dict]:
+    """
+    ``SongSerializer`` output for the songs ``pks``, built from ``values()`` rows in four
+    queries, with file URLs made absolute on ``origin`` (relative without one). Each album and
+    artist is turned into a dict once and shared by all its songs.
+    """
+    rows = list(Song.objects.filter(pk__in=pks).values(*SONG_PAYLOAD_FIELDS, 'album_id'))
+    song_artists = defaultdict(list)
+    for song_id, artist_id in Song.artists.through.objects.filter(song__in=pks).order_by('pk').values_list(
+        'song_id', 'artist_id'
+    ):
+        song_artists[song_id].append(artist_id)
+
+    albums = list(Album.objects.filter(pk__in={row['album_id'] for row in rows}).values(
+        'id', 'title', 'cover', 'cover_variants', 'artist'
+    ))
+    artist_ids = {artist_id for ids in song_artists.values() for artist_id in ids} | {album['artist'] for album in albums}
+
+    artists = {}
+    for artist in Artist.objects.filter(pk__in=artist_ids).values(*ARTIST_PAYLOAD_FIELDS):
+        artist['avatar'] = file_url(origin, artist['avatar'])
+        artist['thumbnail'] = file_url(origin, artist['thumbnail'])
+        artist['avatar_variants'] = variant_srcset(origin, artist['avatar_variants'])
+        artist['thumbnail_variants'] = variant_srcset(origin, artist['thumbnail_variants'])
+        artists[artist['id']] = artist
+
+    album_payloads = {
+        album['id']: {
+            **album, 'artist': artists[album['artist']], 'cover': file_url(origin, album['cover']),
+            'cover_variants': variant_srcset(origin, album['cover_variants']),
+        }
+        for album in albums
+    }
+
+    payloads = []
+    for row in rows:
+        album_id = row.pop('album_id')
+        row['duration'] = duration_field.to_representation(row['duration'])
+        row['album'] = album_payloads[album_id]
+        row['artists'] = [artists[artist_id] for artist_id in song_artists[row['id']]]
+        row['is_liked'] = False
+        payloads.append(row)
+    return payloads
+
+
+def requested_fields(request: Request) -> set | None:
+    """The song fields asked for with ``?fields=a,b``, always including ``id``; ``None`` for all."""
+    value = request.query_params.get(FIELDS_QUERY_PARAM)
+    if not value:
+        return None
+    return {field.strip() for field in value.split(',') if field.strip()} | {'id'}
+
+
+def is_compact(request: Request) -> bool:
+    return request.query_params.get(COMPACT_QUERY_PARAM, '').lower() in ('1', 'true')
+
+
+def sparse(song: dict, fields: set | None) -> dict:
+    if fields is None:
+        return song
+    return {key: value for key, value in song.items() if key in fields}
+
+
+def compact_songs(songs: list[dict]) -> tuple[list[dict], dict]:
+    """
+    Replace the nested album and artists of ``songs`` by their ids, returning the songs and
+    the ``included`` side table holding every referenced album and artist once.
+    """
+    albums, artists = {}, {}
+    compact = []
+    for song in songs:
+        song = dict(song)
+        if 'album' in song:
+            album = song['album']
+            albums.setdefault(album['id'], {**album, 'artist': album['artist']['id']})
+            artists.setdefault(album['artist']['id'], album['artist'])
+            song['album'] = album['id']
+        if 'artists' in song:
+            for artist in song['artists']:
+                artists.setdefault(artist['id'], artist)
+            song['artists'] = [artist['id'] for artist in song['artists']]
+        compact.append(song)
+
+    included = {
+        'albums': list(albums.values()),
+        'artists': [{field: artist[field] for field in COMPACT_ARTIST_FIELDS} for artist in artists.values()],
+    }
+    return compact, included
+
+
+def shape_songs(request: Request, songs: list[dict]) -> tuple[list[dict], dict | None]:
+    """
+    Apply the ``?fields=`` sparse fieldset and, with ``?compact=true``, move the albums and
+    artists to an ``included`` side table (``None`` when not asked for).
+    """
+    fields = requested_fields(request)
+    songs = [sparse(song, fields) for song in songs]
+    if not is_compact(request):
+        return songs, None
+    return compact_songs(songs)
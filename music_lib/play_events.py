@@ -0,0 +1,120 @@
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from music_lib.models import PlayEvent, Song
+
+logger = logging.getLogger(__name__)
+
+
+def is_playback_start(range_header: str | None) -> bool:
+    """
+    Players issue many range requests per listen; only the open-ended one from byte 0 counts
+    as a play. Bounded ones such as the ``bytes=0-1`` probe Safari sends first are not.
+    """
+    return not range_header or range_header.replace(' ', '') == 'bytes=0-'
+
+
+def fold_play_counts(counts: Counter) -> None:
+    """Add ``counts`` (song id -> plays) to ``Song.play_count`` with one UPDATE per distinct increment."""
+    song_ids_by_increment = defaultdict(list)
+    for song_id, count in counts.items():
+        song_ids_by_increment[count].append(song_id)
+
+    for increment, song_ids in song_ids_by_increment.items():
+        Song.objects.filter(pk__in=sorted(song_ids)).update(play_count=F('play_count') + increment)
+
+
+class PlayEventBuffer:
+    """
+    In-process buffer of play events.
+
+    Events are written with ``bulk_create`` and folded into ``Song.play_count`` in the same
+    transaction once ``PLAY_EVENTS_BATCH_SIZE`` events are pending, every
+    ``PLAY_EVENTS_FLUSH_INTERVAL`` seconds from a background thread, and on interpreter exit.
+    """
+
+    def __init__(self, batch_size: int | None = None, flush_interval: float | None = None) -> None:
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self.events = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size or getattr(settings, 'PLAY_EVENTS_BATCH_SIZE', 500)
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, 'PLAY_EVENTS_FLUSH_INTERVAL', 5)
+
+    @property
+    def max_pending(self) -> int:
+        # Upper bound while the database is unreachable so a failing flush cannot exhaust memory.
+        return self.batch_size * 100
+
+    def record(self, user_id: int, song_id: int, duration: int = 0) -> None:
+        with self.lock:
+            self.events.append(PlayEvent(user_id=user_id, song_id=song_id, duration=duration))
+            should_flush = len(self.events) >= self.batch_size
+
+        self.start()
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> int:
+        with self.flush_lock:
+            with self.lock:
+                events, self.events = self.events, []
+            if not events:
+                return 0
+
+            try:
+                with transaction.atomic():
+                    PlayEvent.objects.bulk_create(events, batch_size=self.batch_size)
+                    fold_play_counts(Counter(event.song_id for event in events))
+            except Exception:
+                logger.exception('Failed to flush %d play events, keeping them for the next flush', len(events))
+                with self.lock:
+                    self.events[:0] = events
+                    dropped = len(self.events) - self.max_pending
+                    if dropped > 0:
+                        logger.error('Play event buffer is full, dropping %d oldest events', dropped)
+                        del self.events[:dropped]
+                return 0
+
+            return len(events)
+
+    def start(self) -> None:
+        if self.thread is not None or self.flush_interval <= 0:
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='play-event-flusher', daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+            connection.close()
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+
+play_event_buffer = PlayEventBuffer()
+atexit.register(play_event_buffer.shutdown)
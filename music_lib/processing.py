@@ -0,0 +1,176 @@
+import atexit
+import logging
+import math
+import operator
+import os
+import warnings
+from array import array
+
+import audioread
+from django.db import transaction
+
+from music_lib.hls import queue_package
+from music_lib.models import Song
+from music_lib.transcoding import transcoder
+from music_lib.workers import WorkerPool
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:
+        # Removed in Python 3.13 (install audioop-lts there), see sum_of_squares.
+        audioop = None
+
+logger = logging.getLogger(__name__)
+
+# Files picked up by the album and catalog imports.
+AUDIO_EXTENSIONS = {'.mp3', '.flac', '.ogg', '.oga', '.m4a', '.aac', '.wav', '.aif', '.aiff'}
+COVER_NAMES = ('cover', 'folder', 'front')
+COVER_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Level reported for digital silence, the floor of 16-bit audio.
+SILENCE_DBFS = -96.0
+
+ID3_TEXT_FRAMES = {
+    'TIT2': 'title', 'TPE1': 'artist', 'TALB': 'album', 'TRCK': 'track', 'TPOS': 'disc',
+    'TCON': 'genre', 'TDRC': 'year', 'TYER': 'year',
+}
+ID3_ENCODINGS = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+
+
+def syncsafe(data: bytes) -> int:
+    # ID3 sizes keep the high bit of every byte clear.
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7f)
+    return value
+
+
+def read_id3v2(f) -> dict:
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3' or header[3] not in (3, 4):
+        return {}
+    version, flags = header[3], header[5]
+    data = f.read(syncsafe(header[6:10]))
+
+    position = 0
+    if flags & 0x40:
+        # Extended header; its size includes itself in v2.4 only.
+        position = syncsafe(data[:4]) if version == 4 else int.from_bytes(data[:4], 'big') + 4
+
+    tags = {}
+    while position + 10 <= len(data):
+        frame_id = data[position:position + 4]
+        if not frame_id.strip(b'\0'):
+            break  # Padding.
+        size = data[position + 4:position + 8]
+        size = syncsafe(size) if version == 4 else int.from_bytes(size, 'big')
+        body = data[position + 10:position + 10 + size]
+        position += 10 + size
+
+        name = ID3_TEXT_FRAMES.get(frame_id.decode('latin-1'))
+        if name and len(body) > 1 and name not in tags:
+            text = body[1:].decode(ID3_ENCODINGS.get(body[0], 'latin-1'), errors='replace')
+            # v2.4 separates multiple values with NULs, keep the first.
+            text = text.split('\0')[0].strip()
+            if text:
+                tags[name] = text
+    return tags
+
+
+def read_id3v1(f) -> dict:
+    f.seek(0, os.SEEK_END)
+    if f.tell() < 128:
+        return {}
+    f.seek(-128, os.SEEK_END)
+    data = f.read(128)
+    if data[:3] != b'TAG':
+        return {}
+
+    tags = {}
+    for name, start, end in (('title', 3, 33), ('artist', 33, 63), ('album', 63, 93), ('year', 93, 97)):
+        text = data[start:end].split(b'\0')[0].decode('latin-1').strip()
+        if text:
+            tags[name] = text
+    return tags
+
+
+def read_tags(path: str) -> dict:
+    """Text tags from the ID3v2 header of a file, completed by an ID3v1 trailer."""
+    with open(path, 'rb') as f:
+        tags = read_id3v2(f)
+        return {**read_id3v1(f), **tags}
+
+
+def sum_of_squares(buffer: bytes) -> int:
+    """Sum of the squared samples of a 16-bit PCM buffer."""
+    if audioop is not None:
+        # Computed in C, the rounding of the RMS is well below the precision kept.
+        return audioop.rms(buffer, 2) ** 2 * (len(buffer) // 2)
+    samples = array('h', buffer)
+    return sum(map(operator.mul, samples, samples))
+
+
+def measure_loudness(audio) -> float:
+    """RMS level in dBFS of the 16-bit PCM ``audio`` decodes to."""
+    total = count = 0
+    for buffer in audio:
+        total += sum_of_squares(buffer)
+        count += len(buffer) // 2
+    if not total:
+        return SILENCE_DBFS
+    return max(20 * math.log10(math.sqrt(total / count) / 32768), SILENCE_DBFS)
+
+
+def probe(path: str, loudness: bool = True) -> dict:
+    """
+    Audio metadata of a file, as ``Song`` field values. Measuring the loudness decodes the
+    whole file. Raises ``audioread.DecodeError`` (or ``OSError``) for files that aren't audio.
+
+    Touches neither the database nor Django, so it can run in worker processes.
+    """
+    with audioread.audio_open(path) as audio:
+        duration = audio.duration
+        metadata = {
+            'duration': round(duration, 2),
+            'sample_rate': audio.samplerate,
+            'channels': audio.channels,
+            'loudness': round(measure_loudness(audio), 2) if loudness else None,
+        }
+    metadata['bitrate'] = round(os.path.getsize(path) * 8 / duration / 1000) if duration else None
+    metadata['tags'] = read_tags(path)
+    return metadata
+
+
+def process_song(song_id: int) -> Song:
+    """Probe an uploaded song, then make it available and queue its renditions and HLS packages."""
+    song = Song.objects.get(pk=song_id)
+    try:
+        metadata = probe(song.file.path)
+    except Exception as e:
+        logger.exception('Failed to process %s', song.file.name)
+        song.status = Song.FAILED
+        song.processing_error = str(e) or e.__class__.__name__
+        song.save(update_fields=['status', 'processing_error'])
+        return song
+
+    for field, value in metadata.items():
+        setattr(song, field, value)
+    song.status = Song.READY
+    song.processing_error = ''
+    song.is_available = True
+    with transaction.atomic():
+        song.save(update_fields=[*metadata, 'status', 'processing_error', 'is_available'])
+        transcoder.enqueue(song)
+        queue_package(song)
+    return song
+
+
+processing_pool = WorkerPool('AUDIO_PROCESSING_WORKERS', 4, 'processing')
+atexit.register(processing_pool.shutdown)
+
+
+def queue_processing(song: Song, pool: WorkerPool = processing_pool) -> None:
+    """Process a pending ``song`` on ``pool`` once the current transaction commits."""
+    transaction.on_commit(lambda: pool.submit(process_song, song.pk))
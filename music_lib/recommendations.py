@@ -0,0 +1,222 @@
+import heapq
+import logging
+import math
+from array import array
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from music_lib.models import PlayEvent, SongNeighbour, NeighbourBuild
+from music_lib.watermarks import TooManyGaps, read_all, read_new
+
+logger = logging.getLogger(__name__)
+
+# Songs whose neighbours are replaced per transaction.
+WRITE_BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 10_000
+
+
+def get_likes_model():
+    return get_user_model().liked_songs.through
+
+
+class Interactions:
+    """
+    The sparse listener x song matrix, as the songs each listener liked or played and the
+    listeners of each song. Interactions are binary: a song liked and played ten times
+    counts once, which keeps a few obsessive replays from making two songs look related.
+    """
+
+    def __init__(self, user_songs: dict[int, array]) -> None:
+        self.user_songs = user_songs
+        song_users = defaultdict(lambda: array('q'))
+        for user_id, song_ids in user_songs.items():
+            for song_id in song_ids:
+                song_users[song_id].append(user_id)
+        self.song_users = dict(song_users)
+        # The norms of the similarity: the loaded listeners until count_all_listeners.
+        self.listener_counts = {song_id: len(users) for song_id, users in self.song_users.items()}
+
+    def count_all_listeners(self) -> None:
+        """
+        Count the listeners of the loaded songs in the database, those whose songs were cut
+        at ``RECOMMENDATIONS_MAX_USER_SONGS`` or not loaded included: full and incremental
+        builds then divide by the same norms and give the same scores.
+        """
+        self.listener_counts = count_listeners(self.song_users)
+
+    def neighbours(self, song_id: int, count: int, min_cooccurrence: int) -> list[tuple[float, int]]:
+        """
+        The ``count`` songs with the highest cosine similarity to ``song_id``, as
+        ``(score, song id)``: listeners shared by both songs over the geometric mean of
+        their listener counts.
+        """
+        users = self.song_users.get(song_id)
+        if not users:
+            return []
+
+        cooccurrences = Counter()
+        for user_id in users:
+            cooccurrences.update(self.user_songs[user_id])
+        del cooccurrences[song_id]
+
+        listener_counts, norm = self.listener_counts, self.listener_counts[song_id]
+        return heapq.nlargest(count, (
+            (shared / math.sqrt(norm * listener_counts[other]), other)
+            for other, shared in cooccurrences.items() if shared >= min_cooccurrence
+        ))
+
+
+def recent_plays():
+    since = timezone.now() - timedelta(days=settings.RECOMMENDATIONS_PLAY_WINDOW_DAYS)
+    return PlayEvent.objects.filter(timestamp__gte=since)
+
+
+def batches(ids) -> list:
+    ids = sorted(ids)
+    return [ids[offset:offset + READ_CHUNK_SIZE] for offset in range(0, len(ids), READ_CHUNK_SIZE)]
+
+
+def load_interactions(user_ids=None) -> Interactions:
+    """
+    Read the likes, then the plays of the last ``RECOMMENDATIONS_PLAY_WINDOW_DAYS`` newest
+    first, keeping at most ``RECOMMENDATIONS_MAX_USER_SONGS`` songs per listener. Only
+    those of ``user_ids`` when given.
+    """
+    max_user_songs = settings.RECOMMENDATIONS_MAX_USER_SONGS
+    # Dicts as insertion ordered sets.
+    user_songs = defaultdict(dict)
+
+    def add(rows):
+        for user_id, song_id in rows.iterator(chunk_size=READ_CHUNK_SIZE):
+            songs = user_songs[user_id]
+            if len(songs) < max_user_songs:
+                songs[song_id] = None
+
+    likes = get_likes_model().objects.order_by('-pk').values_list('user_id', 'song_id')
+    plays = recent_plays().order_by('-timestamp').values_list('user_id', 'song_id')
+    if user_ids is None:
+        add(likes)
+        add(plays)
+    else:
+        # A listener is in one batch only, so their likes still come before their plays.
+        for batch in batches(user_ids):
+            add(likes.filter(user__in=batch))
+            add(plays.filter(user__in=batch))
+
+    return Interactions({user_id: array('q', songs) for user_id, songs in user_songs.items()})
+
+
+def load_listeners(song_ids) -> set:
+    """Ids of the users who liked or recently played any of ``song_ids``."""
+    user_ids = set()
+    for batch in batches(song_ids):
+        user_ids.update(get_likes_model().objects.filter(song__in=batch).values_list('user_id', flat=True).distinct())
+        user_ids.update(recent_plays().filter(song__in=batch).values_list('user_id', flat=True).distinct())
+    return user_ids
+
+
+def count_listeners(song_ids) -> Counter:
+    """
+    Distinct listeners of each of ``song_ids``, counted by the database. Unlike
+    ``load_interactions`` this counts songs beyond the ``RECOMMENDATIONS_MAX_USER_SONGS`` of
+    heavy listeners, whichever listeners were loaded.
+    """
+    counts = Counter()
+    for batch in batches(song_ids):
+        pairs = get_likes_model().objects.filter(song__in=batch).values_list('song_id', 'user_id').union(
+            recent_plays().filter(song__in=batch).values_list('song_id', 'user_id')
+        )
+        counts.update(song_id for song_id, _ in pairs)
+    return counts
+
+
+def write_neighbours(interactions: Interactions, song_ids: list[int]) -> int:
+    """Replace the stored neighbours of ``song_ids``, returning the number of rows written."""
+    count = settings.RECOMMENDATIONS_NEIGHBOURS
+    min_cooccurrence = settings.RECOMMENDATIONS_MIN_COOCCURRENCE
+
+    written = 0
+    for offset in range(0, len(song_ids), WRITE_BATCH_SIZE):
+        batch = song_ids[offset:offset + WRITE_BATCH_SIZE]
+        rows = [
+            SongNeighbour(song_id=song_id, neighbour_id=neighbour_id, score=score)
+            for song_id in batch
+            for score, neighbour_id in interactions.neighbours(song_id, count, min_cooccurrence)
+        ]
+        with transaction.atomic():
+            SongNeighbour.objects.filter(song__in=batch).delete()
+            SongNeighbour.objects.bulk_create(rows, batch_size=WRITE_BATCH_SIZE)
+        written += len(rows)
+    return written
+
+
+def checkpoint(previous: NeighbourBuild | None = None) -> tuple[dict, set]:
+    """
+    The watermarks of the next build, and the ids of the users who liked or played something
+    since ``previous`` (none without it, a full build reads everything).
+
+    Read before the interactions, so that rows added meanwhile are read again next time.
+    """
+    watermarks, user_ids = {}, set()
+    for prefix, model in (('like', get_likes_model()), ('play_event', PlayEvent)):
+        if previous is None:
+            _, watermarks[f'{prefix}_id'], watermarks[f'{prefix}_gaps'] = read_all(model.objects.all())
+        else:
+            rows, watermarks[f'{prefix}_id'], watermarks[f'{prefix}_gaps'] = read_new(
+                model.objects.all(), getattr(previous, f'{prefix}_id'), getattr(previous, f'{prefix}_gaps'),
+            )
+            user_ids.update(model.objects.filter(rows).values_list('user_id', flat=True).distinct())
+    return watermarks, user_ids
+
+
+def build_neighbours() -> NeighbourBuild:
+    """Recompute the neighbours of every song, dropping those of songs nobody listens to anymore."""
+    last, _ = checkpoint()
+    interactions = load_interactions()
+    interactions.count_all_listeners()
+    song_ids = sorted(interactions.song_users)
+    write_neighbours(interactions, song_ids)
+
+    stale = sorted(set(SongNeighbour.objects.values_list('song', flat=True).distinct()) - set(song_ids))
+    for offset in range(0, len(stale), WRITE_BATCH_SIZE):
+        SongNeighbour.objects.filter(song__in=stale[offset:offset + WRITE_BATCH_SIZE]).delete()
+    logger.info('Built the neighbours of %d songs from %d listeners', len(song_ids), len(interactions.user_songs))
+
+    return NeighbourBuild.objects.create(is_full=True, songs=len(song_ids), **last)
+
+
+def refresh_neighbours() -> NeighbourBuild:
+    """
+    Recompute the neighbours of the songs of every listener who liked or played something
+    since the last build, which are the songs whose co-occurrences changed. Scores of other
+    songs towards them, and removed likes, wait for the next full build.
+
+    Only the interactions of the listeners of those songs are read: all their
+    co-occurrences are counted from them. Listener counts come from the database, as in a
+    full build. Too many ids missing below the watermarks fall back to a full build.
+    """
+    previous = NeighbourBuild.objects.order_by('-pk').first()
+    if previous is None:
+        return build_neighbours()
+
+    try:
+        last, user_ids = checkpoint(previous)
+    except TooManyGaps as e:
+        logger.warning('Rebuilding the neighbours of every song: %s', e)
+        return build_neighbours()
+    if not user_ids:
+        return NeighbourBuild.objects.create(is_full=False, **last)
+
+    new_listeners = load_interactions(user_ids)
+    song_ids = sorted({song_id for songs in new_listeners.user_songs.values() for song_id in songs})
+    interactions = load_interactions(load_listeners(song_ids))
+    interactions.count_all_listeners()
+
+    write_neighbours(interactions, song_ids)
+    logger.info('Refreshed the neighbours of %d songs from %d listeners', len(song_ids), len(user_ids))
+    return NeighbourBuild.objects.create(is_full=False, songs=len(song_ids), **last)
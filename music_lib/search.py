@@ -0,0 +1,74 @@
+import re
+
+from django.db import connection
+from django.db.models import F, FloatField, QuerySet, Value
+
+from music_lib.models import SongSearchIndex
+
+FTS_TABLE = SongSearchIndex._meta.db_table
+# The indexes are created by migrations 0010 and 0014, these statements only rebuild them.
+REBUILD_INDEX = {
+    'postgresql': ['REINDEX INDEX music_lib_song_search_trgm'],
+    'sqlite': [f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"],
+}
+
+
+def rebuild_search_index() -> None:
+    with connection.cursor() as cursor:
+        for statement in REBUILD_INDEX.get(connection.vendor, []):
+            cursor.execute(statement)
+
+
+def fts5_match_expression(query: str) -> str:
+    # Every word must match as a prefix: "bea yel" finds "Beatles - Yellow Submarine".
+    return ' '.join(f'"{token}"*' for token in re.findall(r'\w+', query))
+
+
+def postgres_search(queryset: QuerySet, query: str) -> QuerySet:
+    # Imported lazily so that SQLite setups don't need psycopg installed.
+    from django.contrib.postgres.lookups import TrigramWordSimilar
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    return queryset.filter(
+        # ``%>`` is the operator the gin_trgm_ops index can answer; its cut-off is the
+        # ``pg_trgm.word_similarity_threshold`` setting (lower it to tolerate more typos).
+        TrigramWordSimilar(F('search_document'), Value(query))
+    ).annotate(
+        search_rank=TrigramWordSimilarity(Value(query), 'search_document')
+    ).order_by('-search_rank', 'id')
+
+
+def sqlite_search(queryset: QuerySet, query: str) -> QuerySet:
+    match = fts5_match_expression(query)
+    if not match:
+        return queryset.none()
+
+    # Joining the FTS table lets SQLite drive the query from the full-text index; its rank is
+    # lower for better matches, negate it so it sorts like the Postgres one.
+    return queryset.filter(search_index__search_document__match=match).annotate(
+        search_rank=-F('search_index__rank')
+    ).order_by('-search_rank', 'id')
+
+
+def fallback_search(queryset: QuerySet, query: str) -> QuerySet:
+    return queryset.filter(search_document__icontains=query).annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    )
+
+
+def search_songs(queryset: QuerySet, query: str) -> QuerySet:
+    """
+    Filter a ``Song`` queryset by ``query`` against name, artist names and album title.
+
+    Results are unique songs ordered by relevance (``search_rank``). Postgres uses a
+    trigram index (prefix and typo tolerant), SQLite an FTS5 table (prefix matching).
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+
+    if connection.vendor == 'postgresql':
+        return postgres_search(queryset, query)
+    if connection.vendor == 'sqlite':
+        return sqlite_search(queryset, query)
+    return fallback_search(queryset, query)
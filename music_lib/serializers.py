@@ -1,12 +1,32 @@
 from pathlib import Path
 
-import audioread
 from rest_framework import serializers
 
 from music_lib.models import Song, Artist, Album, Playlist
+from music_lib.payloads import variant_srcset
+
+
+class IsLikedField(serializers.BooleanField):
+    """Whether the requesting user likes the song, looked up in ``context['liked_song_ids']``."""
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, song) -> bool:
+        return song.pk in self.context.get('liked_song_ids', ())
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """The srcset of each format of the resized copies of an image (see ``music_lib.images``)."""
+
+    def to_representation(self, value) -> dict:
+        return variant_srcset(self.context.get('request'), value)
 
 
 class ArtistSerializer(serializers.ModelSerializer):
+    avatar_variants = ImageVariantsField()
+    thumbnail_variants = ImageVariantsField()
+
     class Meta:
         model = Artist
         fields = '__all__'
@@ -14,16 +34,17 @@ class ArtistSerializer(serializers.ModelSerializer):
 
 class AlbumSongSerializer(serializers.ModelSerializer):
     artists = ArtistSerializer(many=True, read_only=True)
-    is_liked = serializers.BooleanField(read_only=True)
+    is_liked = IsLikedField()
 
     class Meta:
         model = Song
-        exclude = ['album']
+        exclude = ['album', 'search_document']
 
 
 class AlbumSerializer(serializers.ModelSerializer):
     artist = ArtistSerializer(read_only=True)
     song_set = AlbumSongSerializer(many=True, read_only=True)
+    cover_variants = ImageVariantsField()
 
     class Meta:
         model = Album
@@ -32,6 +53,7 @@ class AlbumSerializer(serializers.ModelSerializer):
 
 class SongAlbumSerializer(serializers.ModelSerializer):
     artist = ArtistSerializer(read_only=True)
+    cover_variants = ImageVariantsField()
 
     class Meta:
         model = Album
@@ -41,23 +63,25 @@ class SongAlbumSerializer(serializers.ModelSerializer):
 class SongSerializer(serializers.ModelSerializer):
     album = SongAlbumSerializer(read_only=True)
     artists = ArtistSerializer(many=True, read_only=True)
-    is_liked = serializers.BooleanField(read_only=True)
-    like_count = serializers.IntegerField(read_only=True)
+    is_liked = IsLikedField()
 
     class Meta:
         model = Song
-        exclude = ['file']
+        exclude = ['file', 'search_document']
 
 
 class SongCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Song
-        exclude = ['play_count', 'duration']
+        exclude = [
+            'play_count', 'duration', 'search_document', 'is_available', 'processing_error',
+            'bitrate', 'sample_rate', 'channels', 'loudness', 'tags',
+        ]
+        read_only_fields = ['status']
 
     def create(self, validated_data):
-        with audioread.audio_open(validated_data['file'].temporary_file_path()) as f:
-            duration = f.duration
-            validated_data['duration'] = duration
+        # The upload is probed by music_lib.processing, which makes the song available.
+        validated_data.update(status=Song.PENDING, is_available=False)
         return super().create(validated_data)
 
 
@@ -68,12 +92,19 @@ class SongNameFindSerializer(serializers.ModelSerializer):
 
 
 class PlaylistSerializer(serializers.ModelSerializer):
-    songs = SongSerializer(many=True, read_only=True)
+    # The songs themselves are paged through the playlist's ``songs`` action.
+    song_count = serializers.SerializerMethodField()
     user = serializers.PrimaryKeyRelatedField(read_only=True)
+    cover_variants = ImageVariantsField()
 
     class Meta:
         model = Playlist
-        fields = '__all__'
+        exclude = ['songs']
+
+    def get_song_count(self, obj: Playlist) -> int:
+        if hasattr(obj, 'song_count'):
+            return obj.song_count
+        return obj.songs.count()
 
 
 class PlaylistBareSerializer(serializers.ModelSerializer):
@@ -92,7 +123,7 @@ class PlaylistCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         songs = validated_data.pop('songs')
         playlist = Playlist.objects.create(**validated_data)
-        playlist.songs.add(*songs)
+        playlist.append_songs(dict.fromkeys(song.pk for song in songs))
         return playlist
 
 
@@ -111,3 +142,72 @@ class UpdatePlaylistsSerializer(serializers.ModelSerializer):
         if not all(isinstance(id, int) for id in value):
             raise serializers.ValidationError("All IDs must be integers.")
         return value
+
+
+class LikeOperationSerializer(serializers.Serializer):
+    song = serializers.IntegerField()
+    like = serializers.BooleanField()
+
+
+class BulkLikeSerializer(serializers.Serializer):
+    operations = LikeOperationSerializer(many=True, allow_empty=False, max_length=1000)
+
+    def validate_operations(self, value):
+        song_ids = {operation['song'] for operation in value}
+        missing = song_ids - set(Song.objects.filter(pk__in=song_ids).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(f"Songs do not exist: {sorted(missing)}.")
+        # The last operation on a song wins.
+        return {operation['song']: operation['like'] for operation in value}
+
+
+class PlaylistSongOperationSerializer(serializers.Serializer):
+    playlist = serializers.IntegerField()
+    song = serializers.IntegerField()
+    add = serializers.BooleanField()
+
+
+class BulkPlaylistSongsSerializer(serializers.Serializer):
+    operations = PlaylistSongOperationSerializer(many=True, allow_empty=False, max_length=1000)
+
+    def validate_operations(self, value):
+        user = self.context['request'].user
+        playlist_ids = {operation['playlist'] for operation in value}
+        song_ids = {operation['song'] for operation in value}
+
+        missing = playlist_ids - set(Playlist.objects.filter(pk__in=playlist_ids, user=user.pk).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(f"Playlists do not exist: {sorted(missing)}.")
+        missing = song_ids - set(Song.objects.filter(pk__in=song_ids).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(f"Songs do not exist: {sorted(missing)}.")
+        return {(operation['playlist'], operation['song']): operation['add'] for operation in value}
+
+
+class MovePlaylistSongSerializer(serializers.Serializer):
+    song = serializers.IntegerField()
+    after = serializers.IntegerField(
+        allow_null=True, default=None, help_text='Song to place it after, the start of the playlist when null.'
+    )
+
+    def validate(self, attrs):
+        if attrs['song'] == attrs['after']:
+            raise serializers.ValidationError("A song cannot be moved after itself.")
+        return attrs
+
+
+class ChartQuerySerializer(serializers.Serializer):
+    artist = serializers.IntegerField(required=False, help_text="An artist's chart instead of the global one.")
+
+
+class LikedStatusQuerySerializer(serializers.Serializer):
+    ids = serializers.CharField(help_text='Comma separated song ids, at most 1000.')
+
+    def validate_ids(self, value):
+        try:
+            ids = [int(pk) for pk in value.split(',') if pk.strip()]
+        except ValueError:
+            raise serializers.ValidationError("All IDs must be integers.")
+        if len(ids) > 1000:
+            raise serializers.ValidationError("At most 1000 IDs can be checked at once.")
+        return ids
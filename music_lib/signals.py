@@ -0,0 +1,317 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, pre_delete, post_delete, post_save, pre_save
+
+from music_lib.blobs import BLOB_FIELDS, acquire, blob_names, release
+from music_lib.cache import invalidate_songs, invalidate_saved_song, invalidate_albums, invalidate_artists, \
+    invalidate_liked_songs
+from music_lib.images import IMAGE_FIELDS, image_variants, is_stale
+from music_lib.models import Song, Artist, Album, Playlist, SongRendition
+from music_lib.storage import content_digest
+
+
+def update_like_counts_on_liked_songs_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The cleared rows are gone by post_clear, remember which songs they pointed at.
+        if reverse:
+            instance._cleared_liked_song_ids = {instance.pk}
+        else:
+            instance._cleared_liked_song_ids = set(instance.liked_songs.values_list('pk', flat=True))
+        return
+
+    if action == 'post_clear':
+        song_ids = getattr(instance, '_cleared_liked_song_ids', set())
+    elif action in ('post_add', 'post_remove'):
+        if not pk_set:
+            return
+        song_ids = {instance.pk} if reverse else pk_set
+    else:
+        return
+
+    if song_ids:
+        Song.objects.filter(pk__in=song_ids).update_like_counts()
+
+
+def invalidate_liked_songs_on_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_liked_songs([instance.pk])
+        return
+
+    if action == 'pre_clear':
+        instance._cleared_liked_by_ids = set(instance.liked_by.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidate_liked_songs(getattr(instance, '_cleared_liked_by_ids', set()))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_liked_songs(pk_set or set())
+
+
+def remember_liked_songs_of_deleted_user(sender, instance, **kwargs):
+    # Cascade deletes of the through table do not send m2m_changed.
+    instance._deleted_liked_song_ids = list(instance.liked_songs.values_list('pk', flat=True))
+
+
+def update_like_counts_of_deleted_user(sender, instance, **kwargs):
+    song_ids = getattr(instance, '_deleted_liked_song_ids', None)
+    if song_ids:
+        Song.objects.filter(pk__in=song_ids).update_like_counts()
+
+
+def update_search_document_on_song_saved(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and 'name' not in update_fields and 'album' not in update_fields:
+        return
+    Song.objects.filter(pk=instance.pk).update_search_documents()
+
+
+def update_search_documents_on_artists_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_song_ids = set(instance.song_set.values_list('pk', flat=True))
+        return
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        song_ids = getattr(instance, '_cleared_song_ids', set()) if action == 'post_clear' else pk_set
+    else:
+        song_ids = {instance.pk}
+
+    if song_ids:
+        Song.objects.filter(pk__in=song_ids).update_search_documents()
+
+
+def update_search_documents_on_artist_saved(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields is not None and 'name' not in update_fields):
+        return
+    Song.objects.filter(artists=instance).update_search_documents()
+
+
+def update_search_documents_on_album_saved(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields is not None and 'title' not in update_fields):
+        return
+    Song.objects.filter(album=instance).update_search_documents()
+
+
+def remember_songs_of_deleted_artist(sender, instance, **kwargs):
+    instance._deleted_song_ids = list(instance.song_set.values_list('pk', flat=True))
+
+
+def update_search_documents_of_deleted_artist(sender, instance, **kwargs):
+    song_ids = getattr(instance, '_deleted_song_ids', None)
+    if song_ids:
+        Song.objects.filter(pk__in=song_ids).update_search_documents()
+
+
+def remember_previous_album_of_song(sender, instance, raw, **kwargs):
+    if instance.pk and not raw:
+        instance._previous_album_id = Song.objects.filter(pk=instance.pk).values_list('album_id', flat=True).first()
+
+
+def invalidate_cache_on_song_changed(sender, instance, **kwargs):
+    invalidate_saved_song(instance.pk, {instance.album_id, getattr(instance, '_previous_album_id', None)} - {None})
+
+
+def invalidate_cache_on_song_deleted(sender, instance, **kwargs):
+    invalidate_saved_song(instance.pk, [instance.album_id])
+
+
+def invalidate_cache_on_artists_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_songs([instance.pk])
+    elif action == 'post_clear':
+        invalidate_songs(getattr(instance, '_cleared_song_ids', set()))
+    else:
+        invalidate_songs(pk_set or set())
+
+
+def invalidate_cache_on_album_changed(sender, instance, **kwargs):
+    invalidate_albums([instance.pk])
+
+
+def invalidate_cache_on_artist_changed(sender, instance, **kwargs):
+    invalidate_artists([instance.pk])
+
+
+def package_rendition_on_ready(sender, instance, update_fields, **kwargs):
+    if instance.status == SongRendition.READY and (update_fields is None or 'status' in update_fields):
+        # Imported here: music_lib.hls depends on the cache and transcoding modules.
+        from music_lib.hls import queue_package
+        queue_package(instance.song, instance.bitrate)
+
+
+def queue_image_variants_on_saved(sender, instance, raw, update_fields, **kwargs):
+    if raw:
+        return
+    for field_name in IMAGE_FIELDS[sender]:
+        if (update_fields is None or field_name in update_fields) and is_stale(instance, field_name):
+            image_variants.enqueue(instance, field_name)
+
+
+def remember_previous_blobs(sender, instance, raw, update_fields, **kwargs):
+    fields = BLOB_FIELDS[sender]
+    if update_fields is not None:
+        fields = tuple(field_name for field_name in fields if field_name in update_fields)
+    if raw or instance._state.adding or not fields:
+        return
+    loaded = getattr(instance, '_loaded_files', {})
+    previous = {field_name: loaded[field_name] for field_name in fields if field_name in loaded}
+    missing = [field_name for field_name in fields if field_name not in previous]
+    if missing:
+        previous.update(sender.objects.filter(pk=instance.pk).values(*missing).first() or {})
+    instance._previous_blobs = {field_name: name for field_name, name in previous.items() if content_digest(name)}
+
+
+def count_blob_references_on_saved(sender, instance, raw, created, update_fields, **kwargs):
+    if raw:
+        return
+    fields = BLOB_FIELDS[sender]
+    if update_fields is not None:
+        fields = tuple(field_name for field_name in fields if field_name in update_fields)
+    current = blob_names(instance, fields)
+    previous = {} if created else getattr(instance, '_previous_blobs', {})
+    acquire(name for field_name, name in current.items() if previous.get(field_name) != name)
+    release(name for field_name, name in previous.items() if current.get(field_name) != name)
+    # The instance now holds what was saved, the next save compares against it.
+    instance._previous_blobs = {}
+    instance._loaded_files = {**getattr(instance, '_loaded_files', {}),
+                              **{field_name: getattr(instance, field_name).name for field_name in fields}}
+
+
+def release_blobs_on_deleted(sender, instance, **kwargs):
+    release(blob_names(instance).values())
+
+
+def connect_signals() -> None:
+    User = get_user_model()
+
+    m2m_changed.connect(
+        update_like_counts_on_liked_songs_changed,
+        sender=User.liked_songs.through,
+        dispatch_uid='music_lib.like_counts.m2m_changed',
+    )
+    m2m_changed.connect(
+        invalidate_liked_songs_on_changed,
+        sender=User.liked_songs.through,
+        dispatch_uid='music_lib.cache.liked_songs_m2m_changed',
+    )
+    pre_delete.connect(
+        remember_liked_songs_of_deleted_user,
+        sender=User,
+        dispatch_uid='music_lib.like_counts.pre_delete',
+    )
+    post_delete.connect(
+        update_like_counts_of_deleted_user,
+        sender=User,
+        dispatch_uid='music_lib.like_counts.post_delete',
+    )
+
+    post_save.connect(
+        update_search_document_on_song_saved,
+        sender=Song,
+        dispatch_uid='music_lib.search.song_post_save',
+    )
+    m2m_changed.connect(
+        update_search_documents_on_artists_changed,
+        sender=Song.artists.through,
+        dispatch_uid='music_lib.search.artists_m2m_changed',
+    )
+    post_save.connect(
+        update_search_documents_on_artist_saved,
+        sender=Artist,
+        dispatch_uid='music_lib.search.artist_post_save',
+    )
+    post_save.connect(
+        update_search_documents_on_album_saved,
+        sender=Album,
+        dispatch_uid='music_lib.search.album_post_save',
+    )
+    pre_delete.connect(
+        remember_songs_of_deleted_artist,
+        sender=Artist,
+        dispatch_uid='music_lib.search.artist_pre_delete',
+    )
+    post_delete.connect(
+        update_search_documents_of_deleted_artist,
+        sender=Artist,
+        dispatch_uid='music_lib.search.artist_post_delete',
+    )
+
+    pre_save.connect(
+        remember_previous_album_of_song,
+        sender=Song,
+        dispatch_uid='music_lib.cache.song_pre_save',
+    )
+    post_save.connect(
+        invalidate_cache_on_song_changed,
+        sender=Song,
+        dispatch_uid='music_lib.cache.song_post_save',
+    )
+    post_delete.connect(
+        invalidate_cache_on_song_deleted,
+        sender=Song,
+        dispatch_uid='music_lib.cache.song_post_delete',
+    )
+    m2m_changed.connect(
+        invalidate_cache_on_artists_changed,
+        sender=Song.artists.through,
+        dispatch_uid='music_lib.cache.artists_m2m_changed',
+    )
+    post_save.connect(
+        invalidate_cache_on_album_changed,
+        sender=Album,
+        dispatch_uid='music_lib.cache.album_post_save',
+    )
+    post_delete.connect(
+        invalidate_cache_on_album_changed,
+        sender=Album,
+        dispatch_uid='music_lib.cache.album_post_delete',
+    )
+    post_save.connect(
+        invalidate_cache_on_artist_changed,
+        sender=Artist,
+        dispatch_uid='music_lib.cache.artist_post_save',
+    )
+    post_delete.connect(
+        invalidate_cache_on_artist_changed,
+        sender=Artist,
+        dispatch_uid='music_lib.cache.artist_post_delete',
+    )
+
+    post_save.connect(
+        package_rendition_on_ready,
+        sender=SongRendition,
+        dispatch_uid='music_lib.hls.rendition_post_save',
+    )
+
+    post_save.connect(
+        queue_image_variants_on_saved,
+        sender=Album,
+        dispatch_uid='music_lib.images.album_post_save',
+    )
+    post_save.connect(
+        queue_image_variants_on_saved,
+        sender=Artist,
+        dispatch_uid='music_lib.images.artist_post_save',
+    )
+    post_save.connect(
+        queue_image_variants_on_saved,
+        sender=Playlist,
+        dispatch_uid='music_lib.images.playlist_post_save',
+    )
+
+    for model, label in [(Song, 'song'), (Album, 'album'), (Artist, 'artist'), (Playlist, 'playlist')]:
+        pre_save.connect(
+            remember_previous_blobs,
+            sender=model,
+            dispatch_uid=f'music_lib.blobs.{label}_pre_save',
+        )
+        post_save.connect(
+            count_blob_references_on_saved,
+            sender=model,
+            dispatch_uid=f'music_lib.blobs.{label}_post_save',
+        )
+        post_delete.connect(
+            release_blobs_on_deleted,
+            sender=model,
+            dispatch_uid=f'music_lib.blobs.{label}_post_delete',
+        )
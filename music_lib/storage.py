@@ -0,0 +1,182 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.utils._os import safe_makedirs
+from django.utils.cache import patch_cache_control
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+BLOBS_PREFIX = 'blobs'
+# Files being written, moved to their blob name once their digest is known.
+TEMP_PREFIX = f'{BLOBS_PREFIX}/tmp'
+BLOB_NAME_RE = re.compile(rf'^{BLOBS_PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.[a-z0-9]+)?$')
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def digest_directory(prefix: str, digest: str) -> str:
+    return f'{prefix}/{digest[:2]}/{digest[2:4]}'
+
+
+def blob_name(digest: str, extension: str = '') -> str:
+    return f'{digest_directory(BLOBS_PREFIX, digest)}/{digest}{extension}'
+
+
+def content_digest(name: str | None) -> str | None:
+    """The SHA-256 of the content of the blob ``name``, None for files stored under other names."""
+    match = BLOB_NAME_RE.match(name or '')
+    return match.group(1) if match else None
+
+
+def file_digest(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+@deconstructible(path='music_lib.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage naming files after the SHA-256 of their content:
+    ``blobs/ab/cd/abcd….mp3``, keeping only the extension of the requested name. Saving
+    content that is already stored writes nothing and returns the existing name, so
+    identical uploads share a file and a URL that never serves other bytes.
+
+    Uploads are hashed as they arrive by the ``Hashing*UploadHandler``s; other content is
+    hashed while it is streamed to a temporary file next to the blobs. Files are never
+    deleted here, ``music_lib.blobs`` counts their references and the ``collect_media``
+    command removes those left unreferenced.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The name is only known once the content is hashed, see _save.
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        if not EXTENSION_RE.match(extension):
+            extension = ''
+
+        digest = getattr(content, 'content_digest', None)
+        if digest is not None and self.touch(blob_name(digest, extension)):
+            return blob_name(digest, extension)
+
+        if hasattr(content, 'temporary_file_path'):
+            # Moved rather than copied; Django removes whatever is left at the end of the request.
+            source, owned = content.temporary_file_path(), False
+            digest = digest or file_digest(source)
+        else:
+            (source, digest), owned = self.write_temporary(content), True
+        name = blob_name(digest, extension)
+        full_path = self.path(name)
+
+        if self.touch(name):
+            if owned:
+                os.remove(source)
+            return name
+
+        self.makedirs(os.path.dirname(full_path))
+        if owned:
+            os.replace(source, full_path)
+        else:
+            # A concurrent save of the same content may have won, its bytes are the same.
+            file_move_safe(source, full_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def write_temporary(self, content) -> tuple[str, str]:
+        """Stream ``content`` to a temporary file while hashing it, returning its path and digest."""
+        directory = self.path(TEMP_PREFIX)
+        self.makedirs(directory)
+        hasher = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+            try:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    hasher.update(chunk)
+                    f.write(chunk)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        return f.name, hasher.hexdigest()
+
+    def touch(self, name: str) -> bool:
+        """
+        Whether the blob ``name`` exists. Its modification time is bumped so that
+        ``collect_media``, which leaves recently modified blobs alone, does not remove it
+        before the reference being saved is counted.
+        """
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def makedirs(self, directory: str) -> None:
+        if self.directory_permissions_mode is not None:
+            safe_makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+class HashingMemoryFileUploadHandler(MemoryFileUploadHandler):
+    """``MemoryFileUploadHandler`` computing the SHA-256 of the upload as its chunks arrive."""
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated:
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_digest = self.hasher.hexdigest()
+        return file
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """``TemporaryFileUploadHandler`` computing the SHA-256 of the upload as its chunks arrive."""
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.content_digest = self.hasher.hexdigest()
+        return file
+
+
+def serve_immutable(request, path: str, document_root=None):
+    """
+    ``django.views.static.serve`` for the development server, with the headers a CDN should
+    send for files whose name changes with their content (blobs and image variants).
+    """
+    response = serve(request, path, document_root=document_root)
+    patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    digest = content_digest(path)
+    if digest:
+        response['ETag'] = f'"{digest}"'
+    return response
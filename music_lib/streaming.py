@@ -0,0 +1,371 @@
+import asyncio
+import io
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from rest_framework import status
+
+from music_lib.storage import content_digest
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+DELIVERY_STREAM = 'stream'
+DELIVERY_X_ACCEL_REDIRECT = 'x-accel-redirect'
+DELIVERY_X_SENDFILE = 'x-sendfile'
+
+# More ranges than this in a single request is treated as abuse and the header is ignored.
+MAX_RANGES = 16
+
+RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def get_chunk_size() -> int:
+    return getattr(settings, 'AUDIO_STREAM_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+_io_executor = None
+_io_executor_lock = threading.Lock()
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Threads the async streaming path reads files on, sized by ``AUDIO_STREAM_IO_THREADS``."""
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'AUDIO_STREAM_IO_THREADS', 32), thread_name_prefix='audio-io'
+            )
+    return _io_executor
+
+
+async def run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_io_executor(), func, *args)
+
+
+def coalesce_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def parse_range_header(header: str | None, file_size: int) -> list[tuple[int, int]] | None:
+    """
+    Parse a ``Range`` header into inclusive ``(start, end)`` byte ranges.
+
+    Returns ``None`` when the header is missing or malformed, in which case the whole
+    file should be served. Raises ``RangeNotSatisfiable`` when no range overlaps the file.
+    """
+    if not header:
+        return None
+
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        match = RANGE_SPEC_RE.match(spec)
+        if not match:
+            return None
+
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = int(last) if last else file_size - 1
+            if last and end < start:
+                return None
+        elif last:
+            # Suffix range: the final N bytes of the file.
+            if int(last) == 0:
+                continue
+            start, end = max(file_size - int(last), 0), file_size - 1
+        else:
+            return None
+
+        if start >= file_size:
+            continue
+        ranges.append((start, min(end, file_size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges = coalesce_ranges(ranges)
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+class FileSlice:
+    """
+    Read-only file-like view over ``length`` bytes of ``file`` starting at ``offset``.
+
+    It keeps ``fileno()`` so WSGI servers with ``wsgi.file_wrapper`` support (gunicorn)
+    can hand the slice to ``os.sendfile`` using the current offset and Content-Length.
+    """
+
+    def __init__(self, file, offset: int, length: int) -> None:
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.position = 0
+        self.file.seek(offset)
+
+    @property
+    def name(self) -> str:
+        return self.file.name
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, position: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.length
+        self.position = min(max(position, 0), self.length)
+        self.file.seek(self.offset + self.position)
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.file.read(size)
+        self.position += len(data)
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def iter_file_slice(file_slice: FileSlice, chunk_size: int):
+    while chunk := file_slice.read(chunk_size):
+        yield chunk
+
+
+def range_not_satisfiable(file_size: int) -> HttpResponse:
+    response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+    response['Content-Range'] = f'bytes */{file_size}'
+    return response
+
+
+def multipart_pieces(ranges: list[tuple[int, int]], file_size: int, content_type: str) -> tuple[str, list]:
+    """
+    Lay out a ``multipart/byteranges`` body as a list of literal ``bytes`` and inclusive
+    ``(start, end)`` file ranges. Returns the boundary and the pieces.
+    """
+    boundary = uuid.uuid4().hex
+    pieces = []
+    for index, (start, end) in enumerate(ranges):
+        pieces.append((
+            ('' if index == 0 else '\r\n')
+            + f'--{boundary}\r\n'
+            + f'Content-Type: {content_type}\r\n'
+            + f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n'
+        ).encode())
+        pieces.append((start, end))
+    pieces.append(f'\r\n--{boundary}--\r\n'.encode())
+    return boundary, pieces
+
+
+def pieces_length(pieces: list) -> int:
+    return sum(len(piece) if isinstance(piece, bytes) else piece[1] - piece[0] + 1 for piece in pieces)
+
+
+def iter_file_pieces(file_path: str, pieces: list, chunk_size: int):
+    with open(file_path, 'rb', buffering=0) as f:
+        for piece in pieces:
+            if isinstance(piece, bytes):
+                yield piece
+            else:
+                start, end = piece
+                yield from iter_file_slice(FileSlice(f, start, end - start + 1), chunk_size)
+
+
+async def aiter_file_pieces(file_path: str, pieces: list, chunk_size: int):
+    """Async twin of ``iter_file_pieces``: every blocking call runs on the I/O thread pool."""
+    f = await run_io(open, file_path, 'rb', 0)
+    try:
+        for piece in pieces:
+            if isinstance(piece, bytes):
+                yield piece
+                continue
+            start, end = piece
+            file_slice = FileSlice(f, start, end - start + 1)
+            while chunk := await run_io(file_slice.read, chunk_size):
+                yield chunk
+    finally:
+        f.close()
+
+
+def multipart_byteranges_response(file_path: str, ranges: list[tuple[int, int]], file_size: int,
+                                  content_type: str, chunk_size: int) -> StreamingHttpResponse:
+    boundary, pieces = multipart_pieces(ranges, file_size, content_type)
+    response = StreamingHttpResponse(
+        iter_file_pieces(file_path, pieces, chunk_size),
+        status=status.HTTP_206_PARTIAL_CONTENT,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = str(pieces_length(pieces))
+    return response
+
+
+def build_range_response(file_path: str, range_header: str | None,
+                         content_type: str = 'audio/mpeg') -> HttpResponseBase:
+    """
+    Serve ``file_path`` honouring an HTTP ``Range`` header.
+
+    Memory use per request is bounded by the chunk size: single ranges and full files are
+    streamed from a ``FileResponse`` (zero-copy ``sendfile`` under gunicorn), multiple
+    ranges are streamed as ``multipart/byteranges``.
+    """
+    file_size = os.path.getsize(file_path)
+    chunk_size = get_chunk_size()
+
+    try:
+        ranges = parse_range_header(range_header, file_size)
+    except RangeNotSatisfiable:
+        return range_not_satisfiable(file_size)
+
+    if ranges is None:
+        response = FileResponse(open(file_path, 'rb', buffering=0), content_type=content_type)
+        response.block_size = chunk_size
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    if len(ranges) > 1:
+        return multipart_byteranges_response(file_path, ranges, file_size, content_type, chunk_size)
+
+    start, end = ranges[0]
+    file_slice = FileSlice(open(file_path, 'rb', buffering=0), start, end - start + 1)
+    response = FileResponse(file_slice, content_type=content_type, status=status.HTTP_206_PARTIAL_CONTENT)
+    response.block_size = chunk_size
+    response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+async def abuild_range_response(file_path: str, range_header: str | None,
+                                content_type: str = 'audio/mpeg') -> HttpResponseBase:
+    """
+    Async variant of ``build_range_response`` for ASGI: the file is read in chunks on the
+    I/O thread pool, so a stream occupies no thread while it waits for a slow client.
+    """
+    file_size = await run_io(os.path.getsize, file_path)
+
+    try:
+        ranges = parse_range_header(range_header, file_size)
+    except RangeNotSatisfiable:
+        return range_not_satisfiable(file_size)
+
+    if ranges is None:
+        pieces, response_status = [(0, file_size - 1)] if file_size else [], status.HTTP_200_OK
+    elif len(ranges) > 1:
+        boundary, pieces = multipart_pieces(ranges, file_size, content_type)
+        content_type, response_status = f'multipart/byteranges; boundary={boundary}', status.HTTP_206_PARTIAL_CONTENT
+    else:
+        pieces, response_status = ranges, status.HTTP_206_PARTIAL_CONTENT
+
+    response = StreamingHttpResponse(
+        aiter_file_pieces(file_path, pieces, get_chunk_size()), status=response_status, content_type=content_type
+    )
+    response['Content-Length'] = str(pieces_length(pieces))
+    if ranges is None or len(ranges) == 1:
+        response['Accept-Ranges'] = 'bytes'
+    if ranges is not None and len(ranges) == 1:
+        response['Content-Range'] = f'bytes {ranges[0][0]}-{ranges[0][1]}/{file_size}'
+    return response
+
+
+def x_accel_redirect_response(file_path: str, name: str, content_type: str) -> HttpResponse:
+    prefix = getattr(settings, 'AUDIO_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = quote(f'{prefix.rstrip("/")}/{name.lstrip("/")}')
+    # nginx copies the remaining headers and answers Range requests itself.
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def x_sendfile_response(file_path: str, name: str, content_type: str) -> HttpResponse:
+    response = HttpResponse(content_type=content_type)
+    response['X-Sendfile'] = quote(os.path.abspath(file_path))
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def add_content_etag(response: HttpResponseBase, name: str) -> HttpResponseBase:
+    """
+    Files stored by digest (``music_lib.storage``) get it as their strong ETag, the same for
+    every song sharing the file and never reused for other bytes.
+    """
+    digest = content_digest(name)
+    if digest and response.status_code in (status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT):
+        response['ETag'] = f'"{digest}"'
+    return response
+
+
+def build_delivery_response(file_path: str, name: str, range_header: str | None,
+                            content_type: str = 'audio/mpeg') -> HttpResponseBase:
+    """
+    Deliver a media file using the backend selected by ``AUDIO_DELIVERY_BACKEND``.
+
+    ``stream`` serves the bytes from the worker; ``x-accel-redirect`` (nginx) and
+    ``x-sendfile`` (Apache/lighttpd) return an empty response telling the front proxy
+    which file to send, so the worker is released as soon as the checks are done.
+    ``name`` is the storage-relative file name used to build the internal redirect URI.
+    """
+    backend = get_delivery_backend()
+
+    if backend == DELIVERY_STREAM:
+        response = build_range_response(file_path, range_header, content_type)
+    elif backend == DELIVERY_X_ACCEL_REDIRECT:
+        response = x_accel_redirect_response(file_path, name, content_type)
+    else:
+        response = x_sendfile_response(file_path, name, content_type)
+    return add_content_etag(response, name)
+
+
+async def abuild_delivery_response(file_path: str, name: str, range_header: str | None,
+                                   content_type: str = 'audio/mpeg') -> HttpResponseBase:
+    """Async variant of ``build_delivery_response``."""
+    backend = get_delivery_backend()
+
+    if backend == DELIVERY_STREAM:
+        response = await abuild_range_response(file_path, range_header, content_type)
+    elif backend == DELIVERY_X_ACCEL_REDIRECT:
+        response = x_accel_redirect_response(file_path, name, content_type)
+    else:
+        response = x_sendfile_response(file_path, name, content_type)
+    return add_content_etag(response, name)
+
+
+def get_delivery_backend() -> str:
+    backend = getattr(settings, 'AUDIO_DELIVERY_BACKEND', DELIVERY_STREAM)
+    if backend not in (DELIVERY_STREAM, DELIVERY_X_ACCEL_REDIRECT, DELIVERY_X_SENDFILE):
+        raise ImproperlyConfigured(
+            f'Unknown AUDIO_DELIVERY_BACKEND {backend!r}; expected one of '
+            f'{DELIVERY_STREAM!r}, {DELIVERY_X_ACCEL_REDIRECT!r} or {DELIVERY_X_SENDFILE!r}.'
+        )
+    return backend
@@ -1,3 +1,2275 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import math
+import os
+import posixpath
+import pstats
+import shutil
+import tempfile
+import time
+import wave
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from PIL import Image
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from middlewares.instrumentation import metrics, TimedJSONRenderer, TimedJWTAuthentication
+from music_lib import urls as music_lib_urls
+from music_lib.blobs import collect_blobs, derived_files
+from music_lib.cache import get_catalog_cache, song_payloads
+from music_lib.charts import rebuild_charts, refresh_charts
+from music_lib.hls import HLS_CONTENT_TYPE, queue_package
+from music_lib.models import Artist, Album, Song, SongRendition, HLSPackage, Playlist, PlaylistSong, PlayEvent, \
+    SongNeighbour, SongPlayRollup, WindowPlayCount, ChartEntry, MediaBlob, DerivedFile
+from music_lib.pagination import SongPaginationClass
+from music_lib.payloads import PublicOrigin, build_song_payloads
+from music_lib.play_events import PlayEventBuffer, play_event_buffer
+from music_lib.processing import read_tags
+from music_lib.recommendations import build_neighbours, refresh_neighbours
+from music_lib.serializers import SongSerializer
+from music_lib.storage import TEMP_PREFIX, blob_name, content_addressed_storage, content_digest, file_digest, \
+    serve_immutable
+from music_lib.streaming import parse_range_header, RangeNotSatisfiable
+from music_lib.transcoding import CLAIM_TIMEOUT, ENCODERS, claim, rendition_name, stub_encode, transcode, transcoder
+from music_lib.watermarks import GAP_TIMEOUT
+from users.authentication import ClaimsUser, decode_token
+from users.checks import check_stateless_auth_denylist
+from users.models import User
+
+AUDIO_BYTES = bytes(range(256)) * 40
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        # Primary keys are reused between tests, cached payloads must not be.
+        get_catalog_cache().clear()
+
+
+class MediaTestCase(CatalogTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root, PLAY_EVENTS_FLUSH_INTERVAL=0)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        self.album = Album.objects.create(artist=self.artist, title='Album', cover='album/Album/cover.jpg')
+        self.song = Song.objects.create(
+            album=self.album,
+            name='Song',
+            file=SimpleUploadedFile('song.mp3', AUDIO_BYTES, content_type='audio/mpeg'),
+        )
+        self.song.artists.add(self.artist)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        play_event_buffer.flush()
+
+
+class ParseRangeHeaderTests(TestCase):
+    def test_missing_or_malformed_header_serves_whole_file(self):
+        self.assertIsNone(parse_range_header(None, 100))
+        self.assertIsNone(parse_range_header('items=0-10', 100))
+        self.assertIsNone(parse_range_header('bytes=abc', 100))
+        self.assertIsNone(parse_range_header('bytes=10-5', 100))
+
+    def test_open_ended_and_suffix_ranges(self):
+        self.assertEqual(parse_range_header('bytes=10-', 100), [(10, 99)])
+        self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=-500', 100), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=90-500', 100), [(90, 99)])
+
+    def test_overlapping_ranges_are_coalesced(self):
+        self.assertEqual(parse_range_header('bytes=0-9, 5-19, 50-59', 100), [(0, 19), (50, 59)])
+
+    def test_unsatisfiable_ranges(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=100-', 100)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header('bytes=-0', 100)
+
+
+class SongStreamTests(MediaTestCase):
+    def stream(self, **headers):
+        return self.client.get(f'/api/songs/{self.song.pk}/stream/', **headers)
+
+    def test_full_file(self):
+        response = self.stream()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(AUDIO_BYTES)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), AUDIO_BYTES)
+
+    def test_single_range(self):
+        response = self.stream(HTTP_RANGE='bytes=100-199')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(AUDIO_BYTES)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), AUDIO_BYTES[100:200])
+
+    def test_suffix_range(self):
+        response = self.stream(HTTP_RANGE='bytes=-16')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), AUDIO_BYTES[-16:])
+
+    @override_settings(AUDIO_STREAM_CHUNK_SIZE=7)
+    def test_range_is_streamed_in_chunks(self):
+        response = self.stream(HTTP_RANGE='bytes=0-99')
+        chunks = list(response.streaming_content)
+
+        self.assertTrue(all(len(chunk) <= 7 for chunk in chunks))
+        self.assertEqual(b''.join(chunks), AUDIO_BYTES[:100])
+
+    def test_multiple_ranges(self):
+        response = self.stream(HTTP_RANGE='bytes=0-9,20-29')
+        body = b''.join(response.streaming_content)
+        boundary = response['Content-Type'].split('boundary=')[1]
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        self.assertEqual(response['Content-Length'], str(len(body)))
+        self.assertIn(f'Content-Range: bytes 0-9/{len(AUDIO_BYTES)}\r\n\r\n'.encode() + AUDIO_BYTES[0:10], body)
+        self.assertIn(f'Content-Range: bytes 20-29/{len(AUDIO_BYTES)}\r\n\r\n'.encode() + AUDIO_BYTES[20:30], body)
+        self.assertTrue(body.endswith(f'--{boundary}--\r\n'.encode()))
+
+    def test_unsatisfiable_range(self):
+        response = self.stream(HTTP_RANGE=f'bytes={len(AUDIO_BYTES)}-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(AUDIO_BYTES)}')
+
+    def test_unavailable_song(self):
+        self.song.is_available = False
+        self.song.save()
+
+        self.assertEqual(self.stream().status_code, 416)
+
+
+class AsyncSongStreamTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    async def stream(self, token=None, **headers):
+        headers['Authorization'] = f'Bearer {token or self.token}'
+        response = await self.async_client.get(f'/api/songs/{self.song.pk}/stream/async/', headers=headers)
+        body = b''.join([chunk async for chunk in response.streaming_content]) if response.streaming else None
+        return response, body
+
+    async def test_full_file(self):
+        response, body = await self.stream()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(AUDIO_BYTES)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(body, AUDIO_BYTES)
+
+    @override_settings(AUDIO_STREAM_CHUNK_SIZE=7)
+    async def test_single_range(self):
+        response, body = await self.stream(Range='bytes=100-199')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(AUDIO_BYTES)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(body, AUDIO_BYTES[100:200])
+
+    async def test_multiple_ranges(self):
+        response, body = await self.stream(Range='bytes=0-9,20-29')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        self.assertEqual(response['Content-Length'], str(len(body)))
+        self.assertIn(f'Content-Range: bytes 20-29/{len(AUDIO_BYTES)}\r\n\r\n'.encode() + AUDIO_BYTES[20:30], body)
+
+    async def test_unsatisfiable_range(self):
+        response, _ = await self.stream(Range=f'bytes={len(AUDIO_BYTES)}-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(AUDIO_BYTES)}')
+
+    async def test_unavailable_song(self):
+        await Song.objects.filter(pk=self.song.pk).aupdate(is_available=False)
+
+        response, _ = await self.stream()
+        self.assertEqual(response.status_code, 416)
+
+    async def test_authentication_is_required(self):
+        response = await self.async_client.get(f'/api/songs/{self.song.pk}/stream/async/')
+        self.assertEqual(response.status_code, 401)
+
+        response, _ = await self.stream(token='invalid')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_missing_song(self):
+        response = await self.async_client.get(
+            '/api/songs/0/stream/async/', headers={'Authorization': f'Bearer {self.token}'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_playback_start_is_recorded(self):
+        await self.stream(Range='bytes=0-')
+        await self.stream(Range='bytes=100-')
+        await sync_to_async(play_event_buffer.flush)()
+
+        self.assertEqual(await PlayEvent.objects.filter(song=self.song).acount(), 1)
+
+    @override_settings(AUDIO_DELIVERY_BACKEND='x-accel-redirect')
+    async def test_x_accel_redirect(self):
+        response, _ = await self.stream()
+
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.song.file.name}')
+
+
+@override_settings(AUDIO_TRANSCODER='stub', AUDIO_TRANSCODE_WORKERS=0, AUDIO_RENDITION_BITRATES=[64, 128])
+class SongRenditionTests(MediaTestCase):
+    def transcode(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return transcoder.enqueue(self.song)
+
+    def stream(self, query='', **headers):
+        response = self.client.get(f'/api/songs/{self.song.pk}/stream/{query}', **headers)
+        return response, b''.join(response.streaming_content)
+
+    def test_renditions_are_named_after_the_original_digest(self):
+        self.transcode()
+
+        renditions = list(self.song.renditions.order_by('bitrate'))
+        self.assertEqual([(r.bitrate, r.status) for r in renditions], [(64, 'ready'), (128, 'ready')])
+        digest = content_digest(self.song.file.name)
+        self.assertRegex(renditions[0].file.name, rf'^renditions/{digest[:2]}/{digest[2:4]}/{digest}(_\w+)?\.64k\.mp3$')
+        with renditions[0].file.open('rb') as f:
+            self.assertEqual(f.read(), b'stub 64k\n' + AUDIO_BYTES)
+
+    def test_enqueue_skips_existing_and_retries_failed(self):
+        self.transcode()
+        self.assertEqual(self.transcode(), [])
+
+        self.song.renditions.filter(bitrate=64).update(status=SongRendition.FAILED)
+        self.assertEqual([rendition.bitrate for rendition in self.transcode()], [64])
+        self.assertEqual(self.song.renditions.filter(status=SongRendition.READY).count(), 2)
+
+    def test_no_renditions_above_source_bitrate(self):
+        # 10240 bytes over 1 second is about 82 kbps.
+        Song.objects.filter(pk=self.song.pk).update(duration=1)
+        self.song.refresh_from_db()
+
+        self.assertEqual([rendition.bitrate for rendition in self.transcode()], [64])
+
+    @override_settings(AUDIO_TRANSCODER='ffmpeg', FFMPEG_BINARY='/nonexistent/ffmpeg')
+    def test_failed_encoding(self):
+        with self.assertLogs('music_lib.transcoding', 'ERROR'):
+            self.transcode()
+
+        self.assertEqual(set(self.song.renditions.values_list('status', flat=True)), {SongRendition.FAILED})
+        response, body = self.stream('?bitrate=64')
+        self.assertEqual(response['X-Audio-Bitrate'], 'original')
+        self.assertEqual(body, AUDIO_BYTES)
+
+    def test_stream_selects_rendition(self):
+        self.transcode()
+
+        cases = [
+            ('', {}, 'original'),
+            ('?bitrate=100', {}, '64'),
+            ('?bitrate=128', {}, '128'),
+            ('?bitrate=32', {}, '64'),
+            ('?bitrate=320', {}, 'original'),
+            ('', {'HTTP_SAVE_DATA': 'on'}, '64'),
+            ('', {'HTTP_DOWNLINK': '0.2'}, '64'),
+            ('', {'HTTP_DOWNLINK': '10'}, 'original'),
+        ]
+        for query, headers, expected in cases:
+            with self.subTest(query=query, headers=headers):
+                response, body = self.stream(query, HTTP_RANGE='bytes=0-8', **headers)
+                self.assertEqual(response['X-Audio-Bitrate'], expected)
+                self.assertIn('Save-Data', response['Vary'])
+                if expected != 'original':
+                    self.assertEqual(body, f'stub {expected}k\n'.encode()[:9])
+
+    def test_original_is_served_when_it_fits(self):
+        self.transcode()
+        # 10240 bytes over 0.5 seconds is about 164 kbps.
+        Song.objects.filter(pk=self.song.pk).update(duration=0.5)
+
+        self.assertEqual(self.stream('?bitrate=150')[0]['X-Audio-Bitrate'], '128')
+        self.assertEqual(self.stream('?bitrate=170')[0]['X-Audio-Bitrate'], 'original')
+
+
+@override_settings(
+    AUDIO_TRANSCODER='stub', AUDIO_TRANSCODE_WORKERS=0, AUDIO_RENDITION_BITRATES=[32], HLS_SEGMENT_DURATION=1,
+    HLS_MEDIA_URL=None, HLS_SECURE_LINK_SECRET='',
+)
+class HLSPackagingTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        # 10240 bytes over 2 seconds: two one-second segments of about 41 kbps.
+        Song.objects.filter(pk=self.song.pk).update(duration=2)
+        self.song.refresh_from_db()
+
+    def package(self, bitrate=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            queue_package(self.song, bitrate)
+        return self.song.hls_packages.get(bitrate=bitrate)
+
+    def segment_urls(self, playlist):
+        return [line for line in playlist.splitlines() if line and not line.startswith('#')]
+
+    def test_package_original(self):
+        hls_package = self.package()
+
+        self.assertEqual(hls_package.status, HLSPackage.READY)
+        playlist = self.client.get(f'/api/songs/{self.song.pk}/hls/original/').content.decode()
+        self.assertIn('#EXT-X-ENDLIST', playlist)
+        self.assertEqual(playlist.count('#EXTINF:1.000,'), 2)
+
+        urls = self.segment_urls(playlist)
+        prefix = settings.MEDIA_URL + posixpath.dirname(hls_package.playlist.name)
+        self.assertEqual(urls, [f'{prefix}/00000.ts', f'{prefix}/00001.ts'])
+        segments = b''
+        for url in urls:
+            with default_storage.open(url.removeprefix(settings.MEDIA_URL), 'rb') as f:
+                segments += f.read()
+        self.assertEqual(segments, AUDIO_BYTES)
+
+    def test_ready_renditions_are_packaged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            transcoder.enqueue(self.song)
+
+        self.assertEqual(self.song.hls_packages.get(bitrate=32).status, HLSPackage.READY)
+
+    def test_master_playlist(self):
+        self.package()
+        with self.captureOnCommitCallbacks(execute=True):
+            transcoder.enqueue(self.song)
+        self.song.hls_packages.create(bitrate=128, status=HLSPackage.FAILED)
+
+        response = self.client.get(f'/api/songs/{self.song.pk}/hls/')
+
+        self.assertEqual(response['Content-Type'], HLS_CONTENT_TYPE)
+        self.assertEqual(response.content.decode().splitlines(), [
+            '#EXTM3U',
+            '#EXT-X-STREAM-INF:BANDWIDTH=32000', '32/',
+            '#EXT-X-STREAM-INF:BANDWIDTH=40960', 'original/',
+        ])
+        play_event_buffer.flush()
+        self.assertEqual(PlayEvent.objects.filter(song=self.song).count(), 1)
+
+    @override_settings(HLS_SECURE_LINK_SECRET='secret', HLS_MEDIA_URL='https://cdn.example.com/media/')
+    def test_segment_urls_are_signed(self):
+        self.package()
+
+        playlist = self.client.get(f'/api/songs/{self.song.pk}/hls/original/').content.decode()
+
+        for url in self.segment_urls(playlist):
+            parts = urlsplit(url)
+            query = dict(parse_qsl(parts.query))
+            self.assertEqual(parts.netloc, 'cdn.example.com')
+            self.assertGreater(int(query['expires']), time.time())
+            digest = hashlib.md5(f'{query["expires"]}{parts.path} secret'.encode()).digest()
+            self.assertEqual(query['md5'], base64.urlsafe_b64encode(digest).decode().rstrip('='))
+
+    def test_unpackaged_and_unavailable_songs(self):
+        self.assertEqual(self.client.get(f'/api/songs/{self.song.pk}/hls/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/songs/{self.song.pk}/hls/original/').status_code, 404)
+
+        self.package()
+        Song.objects.filter(pk=self.song.pk).update(is_available=False)
+        self.assertEqual(self.client.get(f'/api/songs/{self.song.pk}/hls/').status_code, 416)
+        self.assertEqual(self.client.get(f'/api/songs/{self.song.pk}/hls/original/').status_code, 416)
+
+    @override_settings(AUDIO_TRANSCODER='ffmpeg', FFMPEG_BINARY='/nonexistent/ffmpeg')
+    def test_failed_packaging_is_retried(self):
+        with self.assertLogs('music_lib.hls', 'ERROR'):
+            self.assertEqual(self.package().status, HLSPackage.FAILED)
+
+        with override_settings(AUDIO_TRANSCODER='stub'):
+            self.assertEqual(self.package().status, HLSPackage.READY)
+
+
+class StreamTicketTests(MediaTestCase):
+    def ticket(self, query=''):
+        response = self.client.post(f'/api/songs/{self.song.pk}/ticket/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ticket_streams_without_authentication_or_queries(self):
+        url = self.ticket()['url']
+        anonymous = Client()
+
+        with self.assertNumQueries(0):
+            response = anonymous.get(url, HTTP_RANGE='bytes=100-199')
+            body = b''.join(response.streaming_content)
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, AUDIO_BYTES[100:200])
+
+    def test_issuing_a_ticket_records_the_play(self):
+        url = self.ticket()['url']
+        Client().get(url, HTTP_RANGE='bytes=0-')
+        play_event_buffer.flush()
+
+        self.assertEqual(PlayEvent.objects.filter(song=self.song).count(), 1)
+
+    def test_tampered_and_expired_tickets(self):
+        data = self.ticket()
+        token = data['url'].rstrip('/').rsplit('/', 1)[1]
+
+        forged = signing.dumps({'u': self.user.pk, 's': self.song.pk, 'f': '../secret', 'e': data['expires']})
+        self.assertEqual(Client().get(f'/api/stream/{forged}/').status_code, 403)
+        self.assertEqual(Client().get(f'/api/stream/{token[:-1]}x/').status_code, 403)
+        with mock.patch('music_lib.tickets.time.time', return_value=data['expires'] + 1):
+            self.assertEqual(Client().get(data['url']).status_code, 403)
+
+    @override_settings(AUDIO_TRANSCODER='stub', AUDIO_TRANSCODE_WORKERS=0, AUDIO_RENDITION_BITRATES=[64],
+                       HLS_PACKAGING=False)
+    def test_ticket_pins_rendition(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            transcoder.enqueue(self.song)
+
+        data = self.ticket('?bitrate=64')
+
+        self.assertEqual(data['bitrate'], 64)
+        self.assertEqual(b''.join(Client().get(data['url']).streaming_content), b'stub 64k\n' + AUDIO_BYTES)
+
+    def test_unavailable_song(self):
+        Song.objects.filter(pk=self.song.pk).update(is_available=False)
+
+        self.assertEqual(self.client.post(f'/api/songs/{self.song.pk}/ticket/').status_code, 416)
+
+
+def wav_bytes(seconds=1, rate=8000, amplitude=0.5) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(array('h', (
+            int(amplitude * 32767 * math.sin(2 * math.pi * 440 * i / rate)) for i in range(seconds * rate)
+        )).tobytes())
+    return buffer.getvalue()
+
+
+def id3v2_tag(**frames) -> bytes:
+    body = b''.join(
+        name.encode() + (len(text.encode()) + 1).to_bytes(4, 'big') + b'\0\0' + b'\3' + text.encode()
+        for name, text in frames.items()
+    )
+    size = len(body)
+    return b'ID3\3\0\0' + bytes((size >> shift) & 0x7f for shift in (21, 14, 7, 0)) + body
+
+
+def id3v1_tag(title='', artist='', album='', year='') -> bytes:
+    fields = ((title, 30), (artist, 30), (album, 30), (year, 4))
+    return b'TAG' + b''.join(text.encode().ljust(size, b'\0') for text, size in fields) + bytes(31)
+
+
+@override_settings(AUDIO_PROCESSING_WORKERS=0, AUDIO_TRANSCODER='stub', AUDIO_TRANSCODE_WORKERS=0,
+                   AUDIO_RENDITION_BITRATES=[64], HLS_PACKAGING=False)
+class SongProcessingTests(MediaTestCase):
+    def upload(self, content, name='upload.wav'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/songs/', {
+                'album': self.album.pk, 'artists': [self.artist.pk], 'name': 'Upload',
+                'file': SimpleUploadedFile(name, content),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], Song.PENDING)
+        return Song.objects.get(pk=response.data['id'])
+
+    def test_upload_is_probed_in_the_background(self):
+        song = self.upload(wav_bytes())
+
+        self.assertEqual(song.status, Song.READY)
+        self.assertTrue(song.is_available)
+        self.assertEqual(float(song.duration), 1.0)
+        self.assertEqual((song.sample_rate, song.channels, song.bitrate), (8000, 1, 128))
+        # A sine at half of full scale has an RMS level of about -9 dBFS.
+        self.assertAlmostEqual(song.loudness, -9.03, delta=0.1)
+        self.assertEqual(song.renditions.get().bitrate, 64)
+
+    def test_upload_stays_pending_until_processed(self):
+        response = self.client.post('/api/songs/', {
+            'album': self.album.pk, 'artists': [self.artist.pk], 'name': 'Upload',
+            'file': SimpleUploadedFile('upload.wav', wav_bytes()),
+        }, format='multipart')
+
+        song = Song.objects.get(pk=response.data['id'])
+        self.assertEqual(song.status, Song.PENDING)
+        self.assertFalse(song.is_available)
+        self.assertEqual(self.client.get(f'/api/songs/{song.pk}/stream/').status_code, 416)
+        self.assertEqual(
+            [item['id'] for item in self.client.get('/api/songs/?status=pending').data['results']], [song.pk]
+        )
+        self.assertEqual(
+            [item['id'] for item in self.client.get('/api/songs/?is_available=false').data['results']], [song.pk]
+        )
+
+    def test_pending_songs_are_processed_by_the_command(self):
+        # Queued by a process that stopped before running the job.
+        self.client.post('/api/songs/', {
+            'album': self.album.pk, 'artists': [self.artist.pk], 'name': 'Upload',
+            'file': SimpleUploadedFile('upload.wav', wav_bytes()),
+        }, format='multipart')
+
+        call_command('process_pending_songs', stdout=io.StringIO())
+
+        song = Song.objects.get(name='Upload')
+        self.assertEqual(song.status, Song.READY)
+        self.assertTrue(song.is_available)
+
+    def test_undecodable_upload_fails(self):
+        song = self.upload(b'not audio', name='upload.mp3')
+
+        self.assertEqual(song.status, Song.FAILED)
+        self.assertFalse(song.is_available)
+        self.assertTrue(song.processing_error)
+        self.assertEqual(self.client.get(f'/api/songs/{song.pk}/').data['status'], Song.FAILED)
+
+    def test_read_tags(self):
+        path = os.path.join(self.media_root, 'tagged.mp3')
+        with open(path, 'wb') as f:
+            f.write(id3v2_tag(TIT2='Title', TPE1='Artist', TRCK='3/10') + AUDIO_BYTES
+                    + id3v1_tag('Old Title', 'Old Artist', 'Album', '1999'))
+
+        self.assertEqual(read_tags(path), {
+            'title': 'Title', 'artist': 'Artist', 'track': '3/10', 'album': 'Album', 'year': '1999',
+        })
+
+    def test_import_album(self):
+        directory = os.path.join(tempfile.mkdtemp(dir=self.media_root), 'Imported')
+        os.mkdir(directory)
+        for name, content in (('01 One.wav', wav_bytes()), ('02 Two.wav', wav_bytes(2)), ('notes.txt', b'')):
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_album', directory, user=self.user.username, artist='Artist', stdout=io.StringIO())
+
+        album = Album.objects.get(title='Imported')
+        songs = list(album.song_set.order_by('name'))
+        self.assertEqual(album.artist, self.artist)
+        self.assertEqual([(song.name, song.status, float(song.duration)) for song in songs],
+                         [('01 One', Song.READY, 1.0), ('02 Two', Song.READY, 2.0)])
+        self.assertEqual([list(song.artists.all()) for song in songs], [[self.artist], [self.artist]])
+
+
+class ImportCatalogTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source, ignore_errors=True)
+
+    def write(self, path, content):
+        path = os.path.join(self.source, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def import_catalog(self, source, **options):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_catalog', source, user=self.user.username, processes=2, batch_size=2,
+                     stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_directory_tree(self):
+        self.write('Artist/First/01 One.wav', wav_bytes())
+        self.write('Artist/First/cover.jpg', b'cover')
+        self.write('Artist/First/02 Two.wav', wav_bytes() + id3v1_tag(title='Tagged'))
+        self.write('Other/Second/01 Three.wav', wav_bytes(2))
+        self.write('Other/Second/broken.mp3', b'not audio')
+
+        stdout, stderr = self.import_catalog(self.source)
+
+        self.assertIn('Imported 3 songs, 1 failed', stdout)
+        self.assertIn('broken.mp3', stderr)
+        # The existing artist is reused.
+        self.assertEqual(Artist.objects.filter(name='Artist').count(), 1)
+        first = Album.objects.get(title='First')
+        self.assertEqual(first.artist, self.artist)
+        self.assertEqual(first.cover.read(), b'cover')
+        self.assertEqual(list(first.song_set.order_by('name').values_list('name', flat=True)), ['01 One', 'Tagged'])
+
+        song = Song.objects.get(name='01 Three')
+        self.assertEqual((song.status, song.is_available, float(song.duration)), (Song.READY, True, 2.0))
+        self.assertEqual(song.album.artist.name, 'Other')
+        self.assertEqual(list(song.artists.values_list('name', flat=True)), ['Other'])
+        self.assertEqual(song.file.read(), wav_bytes(2))
+        self.assertEqual(
+            [item['id'] for item in self.client.get('/api/songs/', {'search': 'three other'}).data['results']],
+            [song.pk],
+        )
+
+    def test_resume_skips_imported_songs(self):
+        self.write('Artist/First/01 One.wav', wav_bytes())
+        self.import_catalog(self.source)
+        self.write('Artist/First/02 Two.wav', wav_bytes())
+
+        stdout, _ = self.import_catalog(self.source)
+
+        self.assertIn('1 songs to import', stdout)
+        self.assertEqual(Song.objects.filter(album__title='First').count(), 2)
+
+    def test_manifests(self):
+        self.write('files/a.wav', wav_bytes())
+        self.write('files/b.wav', wav_bytes())
+        with open(os.path.join(self.source, 'catalog.csv'), 'w') as f:
+            f.write('path,name,artist,album\nfiles/a.wav,A,One;Two,Duets\n')
+        with open(os.path.join(self.source, 'catalog.jsonl'), 'w') as f:
+            f.write('{"path": "files/b.wav", "name": "B", "artists": ["Two"], "album": "Solo"}\n')
+
+        self.import_catalog(os.path.join(self.source, 'catalog.csv'), no_loudness=True)
+        self.import_catalog(os.path.join(self.source, 'catalog.jsonl'))
+
+        a, b = Song.objects.get(name='A'), Song.objects.get(name='B')
+        self.assertEqual(sorted(a.artists.values_list('name', flat=True)), ['One', 'Two'])
+        self.assertEqual((a.album.title, a.album.artist.name, a.loudness), ('Duets', 'One', None))
+        self.assertEqual((b.album.title, list(b.artists.values_list('name', flat=True))), ('Solo', ['Two']))
+        self.assertEqual(Artist.objects.filter(name='Two').count(), 1)
+
+    def test_unreadable_cover_keeps_the_songs(self):
+        self.write('files/a.wav', wav_bytes())
+        self.write('files/b.wav', wav_bytes(2))
+        with open(os.path.join(self.source, 'catalog.csv'), 'w') as f:
+            f.write('path,name,artist,album,cover\n'
+                    'files/a.wav,A,One,Covered,files/missing.jpg\nfiles/b.wav,B,One,Covered,files/missing.jpg\n')
+
+        stdout, stderr = self.import_catalog(os.path.join(self.source, 'catalog.csv'))
+
+        self.assertIn('Imported 2 songs, 0 failed', stdout)
+        self.assertEqual(len(stderr.splitlines()), 1)
+        self.assertIn('missing.jpg', stderr)
+        self.assertEqual(Album.objects.get(title='Covered').cover.name, '')
+
+    def test_files_listed_twice_are_imported_once(self):
+        self.write('files/a.wav', wav_bytes())
+        with open(os.path.join(self.source, 'catalog.csv'), 'w') as f:
+            f.write('path,name\nfiles/a.wav,A\nfiles/a.wav,Again\n')
+
+        stdout, _ = self.import_catalog(os.path.join(self.source, 'catalog.csv'))
+
+        self.assertIn('1 songs to import', stdout)
+        self.assertEqual(list(Song.objects.filter(name__in=['A', 'Again']).values_list('name', flat=True)), ['A'])
+
+
+class SongDeliveryBackendTests(MediaTestCase):
+    def stream(self, **headers):
+        return self.client.get(f'/api/songs/{self.song.pk}/stream/', **headers)
+
+    @override_settings(AUDIO_DELIVERY_BACKEND='x-accel-redirect', AUDIO_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_x_accel_redirect(self):
+        response = self.stream(HTTP_RANGE='bytes=0-9')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.song.file.name}')
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(AUDIO_DELIVERY_BACKEND='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.stream()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], self.song.file.path)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(AUDIO_DELIVERY_BACKEND='stream')
+    def test_stream_fallback(self):
+        response = self.stream(HTTP_RANGE='bytes=0-9')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(b''.join(response.streaming_content), AUDIO_BYTES[:10])
+
+    @override_settings(AUDIO_DELIVERY_BACKEND='x-accel-redirect')
+    def test_checks_run_before_offload(self):
+        self.song.is_available = False
+        self.song.save()
+
+        response = self.stream()
+
+        self.assertEqual(response.status_code, 416)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+
+class LikeCountTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        album = Album.objects.create(artist=artist, title='Album', cover='album/Album/cover.jpg')
+        self.songs = [
+            Song.objects.create(album=album, name=f'Song {i}', file=f'album/Album/songs/{i}.mp3')
+            for i in range(3)
+        ]
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def like_counts(self):
+        return [song.like_count for song in Song.objects.order_by('id')]
+
+    def test_like_toggle_updates_count(self):
+        song = self.songs[0]
+
+        self.client.post(f'/api/songs/{song.pk}/like/')
+        self.assertEqual(Song.objects.get(pk=song.pk).like_count, 1)
+
+        self.client.post(f'/api/songs/{song.pk}/like/')
+        self.assertEqual(Song.objects.get(pk=song.pk).like_count, 0)
+
+    def test_bulk_m2m_operations(self):
+        self.user.liked_songs.add(*self.songs)
+        self.other.liked_songs.add(self.songs[0])
+        self.assertEqual(self.like_counts(), [2, 1, 1])
+
+        self.user.liked_songs.remove(self.songs[1], self.songs[1])
+        self.assertEqual(self.like_counts(), [2, 0, 1])
+
+        self.user.liked_songs.set([self.songs[1]])
+        self.assertEqual(self.like_counts(), [1, 1, 0])
+
+        self.songs[1].liked_by.add(self.other)
+        self.assertEqual(self.like_counts(), [1, 2, 0])
+
+        self.songs[1].liked_by.clear()
+        self.assertEqual(self.like_counts(), [1, 0, 0])
+
+        self.other.liked_songs.clear()
+        self.assertEqual(self.like_counts(), [0, 0, 0])
+
+    def test_deleting_user_releases_likes(self):
+        self.other.liked_songs.add(*self.songs)
+        self.other.delete()
+
+        self.assertEqual(self.like_counts(), [0, 0, 0])
+
+    def test_rebuild_like_counts_command(self):
+        self.user.liked_songs.add(*self.songs)
+        Song.objects.update(like_count=42)
+
+        call_command('rebuild_like_counts', stdout=io.StringIO())
+
+        self.assertEqual(self.like_counts(), [1, 1, 1])
+
+
+class QueryCountTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.playlist = Playlist.objects.create(user=self.user, name='Playlist')
+        self.album = None
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_songs(self, count):
+        artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        album = Album.objects.create(artist=artist, title='Album', cover='album/Album/cover.jpg')
+        for i in range(count):
+            song = Song.objects.create(album=album, name=f'Song {i}', file=f'album/Album/songs/{i}.mp3')
+            song.artists.add(artist, Artist.objects.create(user=self.user, name=f'Feat {i}', bio=''))
+            self.user.liked_songs.add(song)
+            self.playlist.songs.add(song)
+        self.album = album
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, get_url):
+        self.add_songs(1)
+        small = self.count_queries(get_url())
+        self.add_songs(10)
+        large = self.count_queries(get_url())
+        self.assertEqual(small, large)
+
+    def test_song_list(self):
+        self.assertConstantQueries(lambda: '/api/songs/')
+
+    def test_song_retrieve(self):
+        self.assertConstantQueries(lambda: f'/api/songs/{Song.objects.last().pk}/')
+
+    def test_favorites(self):
+        self.assertConstantQueries(lambda: '/api/songs/favorites/')
+
+    def test_playlist_retrieve(self):
+        self.assertConstantQueries(lambda: f'/api/playlists/{self.playlist.pk}/')
+
+    def test_playlist_songs(self):
+        self.assertConstantQueries(lambda: f'/api/playlists/{self.playlist.pk}/songs/')
+
+    def test_album_retrieve(self):
+        self.assertConstantQueries(lambda: f'/api/albums/{self.album.pk}/')
+
+    def test_album_songs(self):
+        self.assertConstantQueries(lambda: f'/api/albums/{self.album.pk}/songs/')
+
+
+class PlayEventBufferTests(MediaTestCase):
+    def test_events_are_written_in_batches(self):
+        buffer = PlayEventBuffer(batch_size=3, flush_interval=0)
+
+        buffer.record(user_id=self.user.pk, song_id=self.song.pk)
+        buffer.record(user_id=self.user.pk, song_id=self.song.pk)
+        self.assertEqual(PlayEvent.objects.count(), 0)
+
+        with self.assertNumQueries(4):  # savepoint, INSERT, UPDATE, release
+            buffer.record(user_id=self.user.pk, song_id=self.song.pk)
+
+        self.assertEqual(PlayEvent.objects.count(), 3)
+        self.assertEqual(Song.objects.get(pk=self.song.pk).play_count, 3)
+
+    def test_flush_folds_counts_per_song(self):
+        other = Song.objects.create(album=self.album, name='Other', file='album/Album/songs/other.mp3')
+        buffer = PlayEventBuffer(batch_size=100, flush_interval=0)
+        for song in [self.song, other, self.song]:
+            buffer.record(user_id=self.user.pk, song_id=song.pk, duration=30)
+
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(Song.objects.get(pk=self.song.pk).play_count, 2)
+        self.assertEqual(Song.objects.get(pk=other.pk).play_count, 1)
+
+    def test_failed_flush_keeps_events(self):
+        buffer = PlayEventBuffer(batch_size=100, flush_interval=0)
+        buffer.record(user_id=self.user.pk, song_id=self.song.pk)
+
+        with mock.patch.object(PlayEvent.objects, 'bulk_create', side_effect=RuntimeError), \
+                self.assertLogs('music_lib.play_events', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(Song.objects.get(pk=self.song.pk).play_count, 1)
+
+    def test_shutdown_flushes_pending_events(self):
+        buffer = PlayEventBuffer(batch_size=100, flush_interval=0)
+        buffer.record(user_id=self.user.pk, song_id=self.song.pk)
+
+        buffer.shutdown()
+
+        self.assertEqual(PlayEvent.objects.count(), 1)
+
+    def test_stream_records_only_playback_start(self):
+        url = f'/api/songs/{self.song.pk}/stream/'
+        self.client.get(url, HTTP_RANGE='bytes=0-')
+        self.client.get(url, HTTP_RANGE='bytes=100-')
+        self.client.get(url)
+        play_event_buffer.flush()
+
+        self.assertEqual(PlayEvent.objects.filter(song=self.song, user=self.user).count(), 2)
+        self.assertEqual(Song.objects.get(pk=self.song.pk).play_count, 2)
+
+    def test_range_probe_is_not_a_play(self):
+        # Safari and AVPlayer probe with bytes=0-1 before requesting bytes=0-.
+        url = f'/api/songs/{self.song.pk}/stream/'
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-1').status_code, 206)
+        self.client.get(url, HTTP_RANGE='bytes=0-')
+        play_event_buffer.flush()
+
+        self.assertEqual(PlayEvent.objects.filter(song=self.song, user=self.user).count(), 1)
+        self.assertEqual(Song.objects.get(pk=self.song.pk).play_count, 1)
+
+
+class SongSearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.beatles = Artist.objects.create(user=self.user, name='The Beatles', bio='')
+        self.stones = Artist.objects.create(user=self.user, name='Rolling Stones', bio='')
+        self.album = Album.objects.create(artist=self.beatles, title='Revolver', cover='album/Revolver/cover.jpg')
+        self.submarine = Song.objects.create(album=self.album, name='Yellow Submarine', file='a.mp3')
+        self.submarine.artists.add(self.beatles, self.stones)
+        self.taxman = Song.objects.create(album=self.album, name='Taxman', file='b.mp3')
+        self.taxman.artists.add(self.beatles)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, query):
+        response = self.client.get('/api/songs/', {'search': query})
+        return [song['id'] for song in response.data['results']]
+
+    def test_search_document_is_maintained(self):
+        self.submarine.refresh_from_db()
+        self.assertEqual(self.submarine.search_document, 'Yellow Submarine The Beatles Rolling Stones Revolver')
+
+        self.stones.name = 'Stones'
+        self.stones.save()
+        self.album.title = 'Rubber Soul'
+        self.album.save()
+        self.submarine.artists.remove(self.beatles)
+
+        self.submarine.refresh_from_db()
+        self.assertEqual(self.submarine.search_document, 'Yellow Submarine Stones Rubber Soul')
+
+    def test_matches_name_artist_and_album(self):
+        self.assertEqual(self.search('submarine'), [self.submarine.pk])
+        self.assertEqual(sorted(self.search('revolver')), [self.submarine.pk, self.taxman.pk])
+        self.assertEqual(self.search('rolling'), [self.submarine.pk])
+
+    def test_prefix_match(self):
+        self.assertEqual(self.search('yell sub'), [self.submarine.pk])
+
+    def test_rows_are_not_duplicated_when_several_artists_match(self):
+        self.assertEqual(sorted(self.search('beatles')), [self.submarine.pk, self.taxman.pk])
+        self.assertEqual(self.search('beatles stones'), [self.submarine.pk])
+
+    def test_results_are_ranked(self):
+        Song.objects.create(album=self.album, name='Yellow', file='c.mp3')
+        results = self.search('yellow')
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(Song.objects.get(pk=results[0]).name, 'Yellow')
+
+    def test_rebuild_command_refreshes_stale_documents(self):
+        # Bulk updates bypass the signals that maintain the search document.
+        Song.objects.filter(pk=self.taxman.pk).update(name='Eleanor Rigby')
+        self.assertEqual(self.search('eleanor'), [])
+
+        call_command('rebuild_search_index', stdout=io.StringIO())
+
+        self.assertEqual(self.search('eleanor'), [self.taxman.pk])
+
+
+class SongPaginationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        self.album = Album.objects.create(artist=artist, title='Album', cover='album/Album/cover.jpg')
+        self.songs = [
+            Song.objects.create(album=self.album, name=f'Song {i}', file=f'album/Album/songs/{i}.mp3')
+            for i in range(45)
+        ]
+        self.user.liked_songs.add(*self.songs)
+        self.playlist = Playlist.objects.create(user=self.user, name='Playlist')
+        self.playlist.songs.add(*self.songs)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def collect(self, url, **params):
+        ids, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [song['id'] for song in response.data['results']]
+            pages += 1
+            if not response.data['next']:
+                return ids, pages
+            response = self.client.get(response.data['next'])
+
+    def test_endpoints_are_cursor_paginated(self):
+        expected = [song.pk for song in self.songs]
+        for url in [
+            '/api/songs/',
+            '/api/songs/favorites/',
+            f'/api/albums/{self.album.pk}/songs/',
+            f'/api/playlists/{self.playlist.pk}/songs/',
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(self.collect(url), (expected, 3))
+
+    def test_deep_pages_do_not_cost_more(self):
+        first = self.client.get('/api/songs/')
+        second = self.client.get(first.data['next'])
+        self.client.get(second.data['next'])
+
+        with CaptureQueriesContext(connection) as first_queries:
+            self.client.get('/api/songs/')
+        with CaptureQueriesContext(connection) as deep_queries:
+            self.client.get(second.data['next'])
+
+        self.assertEqual(len(first_queries), len(deep_queries))
+        self.assertFalse(any('COUNT(' in query['sql'] for query in deep_queries.captured_queries))
+        self.assertFalse(any('OFFSET' in query['sql'] for query in deep_queries.captured_queries))
+
+    def test_count_on_request(self):
+        response = self.client.get('/api/songs/', {'count': 'true'})
+
+        self.assertEqual(response.data['count'], 45)
+
+    def test_search_results_are_paginated_by_rank(self):
+        ids, pages = self.collect('/api/songs/', search='song')
+
+        self.assertEqual(sorted(ids), [song.pk for song in self.songs])
+        self.assertEqual(pages, 3)
+
+
+class CatalogCacheTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        self.artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        self.album = Album.objects.create(artist=self.artist, title='Album', cover='album/Album/cover.jpg')
+        self.songs = [
+            Song.objects.create(album=self.album, name=f'Song {i}', file=f'album/Album/songs/{i}.mp3')
+            for i in range(5)
+        ]
+        for song in self.songs:
+            song.artists.add(self.artist)
+        self.user.liked_songs.add(self.songs[0])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_warm_song_list_only_reads_counters(self):
+        self.client.get('/api/songs/')
+        hits = song_payloads.hits
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/songs/')
+
+        self.assertEqual(song_payloads.hits - hits, 5)
+        self.assertEqual(response.data['results'][0]['album']['artist']['name'], 'Artist')
+
+    def test_is_liked_is_applied_per_user(self):
+        liked = self.client.get('/api/songs/').data['results']
+
+        other_client = APIClient()
+        other_client.force_authenticate(self.other)
+        not_liked = other_client.get('/api/songs/').data['results']
+
+        self.assertEqual([song['is_liked'] for song in liked], [True, False, False, False, False])
+        self.assertEqual([song['is_liked'] for song in not_liked], [False] * 5)
+
+    def test_counters_are_not_served_stale(self):
+        url = f'/api/songs/{self.songs[1].pk}/'
+        self.assertEqual(self.client.get(url).data['like_count'], 0)
+
+        self.client.post(f'/api/songs/{self.songs[1].pk}/like/')
+        response = self.client.get(url)
+
+        self.assertEqual(response.data['like_count'], 1)
+        self.assertTrue(response.data['is_liked'])
+
+    def test_catalog_changes_invalidate_payloads(self):
+        self.client.get('/api/songs/')
+        self.client.get(f'/api/albums/{self.album.pk}/')
+
+        self.artist.name = 'Renamed'
+        self.artist.save()
+        self.songs[0].name = 'Retitled'
+        self.songs[0].save()
+
+        songs = self.client.get('/api/songs/').data['results']
+        album = self.client.get(f'/api/albums/{self.album.pk}/').data
+        self.assertEqual(songs[0]['name'], 'Retitled')
+        self.assertEqual(songs[1]['artists'][0]['name'], 'Renamed')
+        self.assertEqual(album['artist']['name'], 'Renamed')
+        self.assertEqual(album['song_set'][0]['name'], 'Retitled')
+
+        self.songs[4].delete()
+        self.assertEqual(len(self.client.get(f'/api/albums/{self.album.pk}/').data['song_set']), 4)
+
+    def test_song_saves_keep_the_other_songs_of_the_album_cached(self):
+        self.client.get('/api/songs/')
+        misses = song_payloads.misses
+
+        self.songs[0].name = 'Retitled'
+        self.songs[0].save()
+        self.client.get('/api/songs/')
+        self.assertEqual(song_payloads.misses, misses + 1)
+
+        self.album.title = 'Retitled'
+        self.album.save()
+        songs = self.client.get('/api/songs/').data['results']
+        self.assertEqual({song['album']['title'] for song in songs}, {'Retitled'})
+
+    @override_settings(ALLOWED_HOSTS=['*'], PUBLIC_ORIGIN='https://music.example.com')
+    def test_payloads_do_not_depend_on_the_host(self):
+        self.client.get('/api/songs/', HTTP_HOST='first.example.com')
+        misses = song_payloads.misses
+
+        songs = self.client.get('/api/songs/', HTTP_HOST='second.example.com').data['results']
+
+        self.assertEqual(song_payloads.misses, misses)
+        self.assertEqual(songs[0]['album']['cover'], 'https://music.example.com/media/album/Album/cover.jpg')
+
+    def test_etag_not_modified(self):
+        for url in ['/api/songs/', f'/api/albums/{self.album.pk}/songs/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                etag = response['ETag']
+
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+                self.client.post(f'/api/songs/{self.songs[2].pk}/like/')
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_artist_last_modified(self):
+        response = self.client.get(f'/api/artists/{self.artist.pk}/')
+
+        not_modified = self.client.get(
+            f'/api/artists/{self.artist.pk}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+
+@override_settings(PUBLIC_ORIGIN='http://testserver')
+class SongPayloadTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.artists = [
+            Artist.objects.create(user=self.user, name='First', bio='Long bio', avatar='artists/First/avatar/a.jpg'),
+            Artist.objects.create(user=self.user, name='Second', bio=''),
+        ]
+        self.albums = [
+            Album.objects.create(artist=self.artists[0], title=f'Album {i}', cover=f'album/{i}/cover.jpg')
+            for i in range(2)
+        ]
+        self.songs = []
+        for i in range(4):
+            song = Song.objects.create(album=self.albums[i % 2], name=f'Song {i}', file=f'songs/{i}.mp3',
+                                       duration='12.5', tags={'title': f'Song {i}'})
+            song.artists.add(*self.artists[:i % 2 + 1])
+            self.songs.append(song)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_payloads_match_the_serializer(self):
+        request = Request(APIRequestFactory().get('/api/songs/'))
+        songs = Song.objects.select_related('album__artist').prefetch_related('artists').order_by('pk')
+
+        with self.assertNumQueries(4):
+            payloads = build_song_payloads(PublicOrigin('http://testserver'), [song.pk for song in self.songs])
+
+        expected = SongSerializer(songs, many=True, context={'request': request}).data
+        self.assertEqual(sorted(payloads, key=lambda song: song['id']), [dict(song) for song in expected])
+
+    def test_sparse_fields(self):
+        results = self.client.get('/api/songs/', {'fields': 'name,duration'}).data['results']
+        song = self.client.get(f'/api/songs/{self.songs[0].pk}/', {'fields': 'name'}).data
+
+        self.assertEqual(results[0], {'id': self.songs[0].pk, 'name': 'Song 0', 'duration': '12.50'})
+        self.assertEqual(song, {'id': self.songs[0].pk, 'name': 'Song 0'})
+
+    def test_compact_lists_albums_and_artists_once(self):
+        data = self.client.get('/api/songs/', {'compact': 'true'}).data
+
+        self.assertEqual([song['album'] for song in data['results']], [album.pk for album in self.albums] * 2)
+        self.assertEqual(data['results'][1]['artists'], [artist.pk for artist in self.artists])
+        self.assertEqual([album['id'] for album in data['included']['albums']], [album.pk for album in self.albums])
+        self.assertEqual(data['included']['albums'][0]['artist'], self.artists[0].pk)
+        self.assertEqual(
+            data['included']['artists'],
+            [{'id': artist.pk, 'name': artist.name, 'avatar': avatar, 'thumbnail': None, 'is_verified': False}
+             for artist, avatar in zip(self.artists, ['http://testserver/media/artists/First/avatar/a.jpg', None])],
+        )
+
+    def test_compact_sparse_fields_only_include_what_is_referenced(self):
+        self.user.liked_songs.add(self.songs[0])
+        data = self.client.get('/api/songs/favorites/', {'compact': '1', 'fields': 'name,artists'}).data
+
+        self.assertEqual(data['results'], [{'id': self.songs[0].pk, 'name': 'Song 0', 'artists': [self.artists[0].pk]}])
+        self.assertEqual(data['included'], {'albums': [], 'artists': [
+            {'id': self.artists[0].pk, 'name': 'First', 'avatar': 'http://testserver/media/artists/First/avatar/a.jpg',
+             'thumbnail': None, 'is_verified': False},
+        ]})
+
+
+class LikedSongIdsTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        album = Album.objects.create(artist=artist, title='Album', cover='album/Album/cover.jpg')
+        self.songs = [
+            Song.objects.create(album=album, name=f'Song {i}', file=f'album/Album/songs/{i}.mp3')
+            for i in range(3)
+        ]
+        self.user.liked_songs.add(self.songs[0])
+        self.playlist = Playlist.objects.create(user=self.user, name='Playlist')
+        self.playlist.songs.add(*self.songs)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def liked_status(self):
+        ids = ','.join(str(song.pk) for song in self.songs)
+        return self.client.get('/api/songs/liked_status/', {'ids': ids}).data
+
+    def test_liked_status(self):
+        self.assertEqual(self.liked_status(), {
+            str(self.songs[0].pk): True, str(self.songs[1].pk): False, str(self.songs[2].pk): False,
+        })
+
+    def test_liked_status_validation(self):
+        self.assertEqual(self.client.get('/api/songs/liked_status/', {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/songs/liked_status/').status_code, 400)
+
+    def test_liked_set_is_cached_and_invalidated(self):
+        self.liked_status()
+        with self.assertNumQueries(0):
+            self.liked_status()
+
+        self.client.post(f'/api/songs/{self.songs[1].pk}/like/')
+        self.assertTrue(self.liked_status()[str(self.songs[1].pk)])
+
+        self.songs[2].liked_by.add(self.user)
+        self.assertTrue(self.liked_status()[str(self.songs[2].pk)])
+
+        self.songs[0].liked_by.clear()
+        self.assertFalse(self.liked_status()[str(self.songs[0].pk)])
+
+    def test_is_liked_does_not_use_correlated_subqueries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/playlists/{self.playlist.pk}/songs/')
+
+        self.assertEqual([song['is_liked'] for song in response.data['results']], [True, False, False])
+        self.assertFalse(any('EXISTS' in query['sql'] for query in context.captured_queries))
+
+
+class PlaylistOrderTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        album = Album.objects.create(artist=artist, title='Album', cover='album/Album/cover.jpg')
+        self.songs = Song.objects.bulk_create(
+            Song(album=album, name=f'Song {i}', file=f'album/Album/songs/{i}.mp3') for i in range(5)
+        )
+        self.playlist = Playlist.objects.create(user=self.user, name='Playlist')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def song_order(self):
+        url = f'/api/playlists/{self.playlist.pk}/songs/'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            ids += [song['id'] for song in response.data['results']]
+            url = response.data['next']
+        return [self.songs.index(next(song for song in self.songs if song.pk == pk)) for pk in ids]
+
+    def move(self, song, after):
+        return self.client.post(f'/api/playlists/{self.playlist.pk}/move_song/', {
+            'song': self.songs[song].pk, 'after': self.songs[after].pk if after is not None else None,
+        }, format='json')
+
+    def test_songs_are_listed_in_insertion_order(self):
+        for i in (3, 1, 4):
+            self.client.post(f'/api/playlists/{self.playlist.pk}/add_song/', {'song_id': self.songs[i].pk})
+        self.client.post('/api/playlists/bulk_update_songs/', {'operations': [
+            {'playlist': self.playlist.pk, 'song': self.songs[i].pk, 'add': True} for i in (0, 2)
+        ]}, format='json')
+
+        self.assertEqual(self.song_order(), [3, 1, 4, 0, 2])
+        self.assertEqual(self.client.get(f'/api/playlists/{self.playlist.pk}/').data['song_count'], 5)
+
+    def test_add_song_twice(self):
+        url = f'/api/playlists/{self.playlist.pk}/add_song/'
+        self.assertEqual(self.client.post(url, {'song_id': self.songs[0].pk}).status_code, 200)
+        self.assertEqual(self.client.post(url, {'song_id': self.songs[0].pk}).status_code, 404)
+        self.assertEqual(self.playlist.songs.count(), 1)
+
+    def test_move_song(self):
+        self.playlist.append_songs([song.pk for song in self.songs])
+
+        self.move(4, 0)
+        self.assertEqual(self.song_order(), [0, 4, 1, 2, 3])
+        self.move(0, None)
+        self.assertEqual(self.song_order(), [0, 4, 1, 2, 3])
+        self.move(1, None)
+        self.assertEqual(self.song_order(), [1, 0, 4, 2, 3])
+        self.move(1, 3)
+        self.assertEqual(self.song_order(), [0, 4, 2, 3, 1])
+
+    def test_move_writes_one_row(self):
+        self.playlist.append_songs([song.pk for song in self.songs])
+        before = dict(PlaylistSong.objects.values_list('song', 'position'))
+
+        self.move(4, 1)
+
+        after = dict(PlaylistSong.objects.values_list('song', 'position'))
+        self.assertEqual([pk for pk in before if before[pk] != after[pk]], [self.songs[4].pk])
+
+    def test_move_renumbers_when_gap_is_used_up(self):
+        self.playlist.append_songs([song.pk for song in self.songs])
+        # Moving a song between the same two neighbours halves the gap every time.
+        for i in range(20):
+            self.move(2 + i % 2, 0)
+        self.assertEqual(self.song_order(), [0, 3, 2, 1, 4])
+        self.assertEqual(len(set(PlaylistSong.objects.values_list('position', flat=True))), 5)
+
+    def test_move_validation(self):
+        self.playlist.append_songs([self.songs[0].pk, self.songs[1].pk])
+
+        self.assertEqual(self.move(2, 0).status_code, 404)
+        self.assertEqual(self.move(0, 2).status_code, 404)
+        self.assertEqual(self.move(0, 0).status_code, 400)
+
+    def test_paginated_slices_follow_position(self):
+        self.playlist.append_songs([song.pk for song in reversed(self.songs)])
+        self.move(0, 3)
+
+        with mock.patch.object(SongPaginationClass, 'page_size', 2):
+            self.assertEqual(self.song_order(), [4, 3, 0, 2, 1])
+
+
+class BulkMutationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        self.album = Album.objects.create(artist=artist, title='Album', cover='album/Album/cover.jpg')
+        self.songs = self.add_songs(3)
+        self.playlists = [Playlist.objects.create(user=self.user, name=f'Playlist {i}') for i in range(2)]
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_songs(self, count):
+        return Song.objects.bulk_create(
+            Song(album=self.album, name=f'Song {i}', file=f'album/Album/songs/{i}.mp3') for i in range(count)
+        )
+
+    def bulk_like(self, operations):
+        return self.client.post('/api/songs/bulk_like/', {'operations': operations}, format='json')
+
+    def bulk_update_songs(self, operations):
+        return self.client.post('/api/playlists/bulk_update_songs/', {'operations': operations}, format='json')
+
+    def test_bulk_like(self):
+        self.user.liked_songs.add(self.songs[0])
+        self.other.liked_songs.add(self.songs[0], self.songs[1])
+        self.client.get('/api/songs/liked_status/', {'ids': str(self.songs[1].pk)})
+
+        response = self.bulk_like([
+            {'song': self.songs[0].pk, 'like': False},
+            {'song': self.songs[1].pk, 'like': True},
+            {'song': self.songs[2].pk, 'like': False},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'liked': [self.songs[1].pk], 'unliked': [self.songs[0].pk]})
+        self.assertEqual(set(self.user.liked_songs.all()), {self.songs[1]})
+        self.assertEqual([song.like_count for song in Song.objects.order_by('id')], [1, 2, 0])
+        # The cached liked set was dropped even though no m2m_changed signal was sent.
+        status = self.client.get('/api/songs/liked_status/', {'ids': str(self.songs[1].pk)}).data
+        self.assertEqual(status, {str(self.songs[1].pk): True})
+
+    def test_bulk_like_validation(self):
+        self.assertEqual(self.bulk_like([{'song': 0, 'like': True}]).status_code, 400)
+        self.assertEqual(self.bulk_like([]).status_code, 400)
+        self.assertFalse(self.user.liked_songs.exists())
+
+    def test_bulk_update_songs(self):
+        first, second = self.playlists
+        first.songs.add(self.songs[0])
+
+        response = self.bulk_update_songs([
+            {'playlist': first.pk, 'song': self.songs[0].pk, 'add': False},
+            {'playlist': first.pk, 'song': self.songs[1].pk, 'add': True},
+            {'playlist': second.pk, 'song': self.songs[0].pk, 'add': True},
+            {'playlist': second.pk, 'song': self.songs[2].pk, 'add': False},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'added': [{'playlist': first.pk, 'song': self.songs[1].pk}, {'playlist': second.pk, 'song': self.songs[0].pk}],
+            'removed': [{'playlist': first.pk, 'song': self.songs[0].pk}],
+        })
+        self.assertEqual(list(first.songs.all()), [self.songs[1]])
+        self.assertEqual(list(second.songs.all()), [self.songs[0]])
+
+    def test_bulk_update_songs_of_other_users_playlist(self):
+        playlist = Playlist.objects.create(user=self.other, name='Other')
+
+        response = self.bulk_update_songs([{'playlist': playlist.pk, 'song': self.songs[0].pk, 'add': True}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(playlist.songs.exists())
+
+    def test_update_playlists_toggles_song(self):
+        first, second = self.playlists
+        first.songs.add(self.songs[0])
+        playlist = Playlist.objects.create(user=self.other, name='Other')
+
+        self.client.post('/api/playlists/update_playlists/', {
+            'ids': [first.pk, second.pk, playlist.pk], 'song': self.songs[0].pk,
+        }, format='json')
+
+        self.assertFalse(first.songs.exists())
+        self.assertEqual(list(second.songs.all()), [self.songs[0]])
+        self.assertFalse(playlist.songs.exists())
+
+    def count_queries(self, post):
+        with CaptureQueriesContext(connection) as context:
+            response = post()
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_constant_queries(self):
+        counts = []
+        for count in (2, 50):
+            songs = self.add_songs(count)
+            liked, playlist = songs[:count // 2], self.playlists[0]
+            self.user.liked_songs.add(*liked)
+            playlist.songs.add(*liked)
+            counts.append([
+                # Every batch removes the first half of the songs and adds the second one.
+                self.count_queries(lambda: self.bulk_like(
+                    [{'song': song.pk, 'like': song not in liked} for song in songs]
+                )),
+                self.count_queries(lambda: self.bulk_update_songs(
+                    [{'playlist': playlist.pk, 'song': song.pk, 'add': song not in liked} for song in songs]
+                )),
+                self.count_queries(lambda: self.client.post('/api/playlists/update_playlists/', {
+                    'ids': [playlist.pk for playlist in self.playlists], 'song': songs[-1].pk,
+                }, format='json')),
+            ])
+        self.assertEqual(counts[0], counts[1])
+
+
+class APIBenchmarkTests(TestCase):
+    def benchmark(self, *args):
+        stdout = io.StringIO()
+        call_command(
+            'benchmark_api', '--songs', '40', '--users', '2', '--likes-per-user', '5', '--songs-per-playlist', '5',
+            '--requests', '2', '--format', 'json', *args, stdout=stdout, stderr=io.StringIO(),
+        )
+        return json.loads(stdout.getvalue())
+
+    def test_every_route_stays_within_its_query_budget(self):
+        report = self.benchmark()
+
+        self.assertEqual(report['failures'], [])
+        routes = {resolve(urlsplit(result['path']).path).url_name for result in report['results']}
+        self.assertLessEqual({pattern.name for pattern in music_lib_urls.urlpatterns}, routes)
+        self.assertLessEqual({'token_obtain_pair', 'token_refresh', 'token_clear'}, routes)
+
+    def test_exceeded_budget_fails(self):
+        budgets = os.path.join(tempfile.mkdtemp(), 'budgets.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(budgets))
+        with open(budgets, 'w') as f:
+            json.dump({'songs-list': {'queries': 0}}, f)
+
+        with self.assertRaisesMessage(CommandError, '1 budgets exceeded'):
+            self.benchmark('--budgets', budgets, '--only', 'songs-list')
+
+
+
+INSTRUMENTED_MIDDLEWARE = [*settings.MIDDLEWARE, 'middlewares.instrumentation.InstrumentationMiddleware']
+
+
+@override_settings(MIDDLEWARE=INSTRUMENTED_MIDDLEWARE, INSTRUMENTATION_METRICS_TOKEN='scrape')
+class InstrumentationTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+        self.user = User.objects.create_user(username='listener', password='password')
+        artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        album = Album.objects.create(artist=artist, title='Album')
+        for i in range(3):
+            Song.objects.create(album=album, name=f'Song {i}', file=f'songs/{i}.mp3').artists.add(artist)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        # What INSTRUMENTATION_ENABLED makes the defaults, which views copy when they are defined.
+        for attribute, classes in (('authentication_classes', [TimedJWTAuthentication]),
+                                   ('renderer_classes', [TimedJSONRenderer])):
+            patcher = mock.patch.object(APIView, attribute, classes)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def server_timing(self, response) -> dict:
+        timings = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            timings[name] = dict(param.split('=', 1) for param in params)
+        return timings
+
+    def test_reports_phases_and_queries_in_server_timing_and_log(self):
+        with self.assertLogs('middlewares.instrumentation', 'INFO') as logs:
+            response = self.client.get('/api/albums/')
+
+        self.assertEqual(response.status_code, 200)
+        timings = self.server_timing(response)
+        self.assertEqual(list(timings), ['auth', 'db', 'serialize', 'render', 'app', 'total', 'queries'])
+        for name in ('auth', 'db', 'serialize', 'render', 'total'):
+            self.assertGreater(float(timings[name]['dur']), 0)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], 'album-list')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(timings['queries']['desc'], f'"{record["queries"]} ({record["duplicate_queries"]} duplicated)"')
+
+    def test_counts_duplicated_queries_and_samples_slow_ones(self):
+        with self.assertLogs('middlewares.instrumentation', 'INFO') as logs, \
+                override_settings(INSTRUMENTATION_SLOW_QUERY_MS=0):
+            # The playlist song ids are checked one query per song.
+            self.client.post('/api/playlists/', {'name': 'Mix', 'songs': list(Song.objects.values_list('pk', flat=True))})
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertGreaterEqual(record['duplicate_queries'], 2)
+        self.assertEqual(len(record['slow_queries']), 3)
+        self.assertEqual(set(record['slow_queries'][0]), {'sql', 'ms'})
+
+    def test_metrics_endpoint_exposes_histograms_per_route(self):
+        self.client.get('/api/songs/')
+        self.client.get('/api/songs/')
+
+        self.assertEqual(Client().get('/metrics/').status_code, 403)
+        response = Client().get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{route="song-list",method="GET",status="2xx"} 2', body)
+        self.assertIn('http_request_db_queries_bucket{route="song-list",method="GET",status="2xx",le="+Inf"} 2', body)
+
+    def test_profiles_requests_of_staff_only(self):
+        with override_settings(INSTRUMENTATION_PROFILE_DIR=self.profile_dir):
+            self.assertNotIn('X-Profile', Client().get('/api/songs/?profile=1'))
+            response = self.client.get('/api/songs/?profile=1')
+            self.assertNotIn('X-Profile', response)
+
+            self.user.is_staff = True
+            self.user.save()
+            response = self.client.get('/api/songs/?profile=1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(os.listdir(self.profile_dir), [response['X-Profile']])
+        stats = pstats.Stats(os.path.join(self.profile_dir, response['X-Profile']))
+        self.assertTrue(any(function == 'render_songs' for _, _, function in stats.stats))
+
+    async def test_async_views_are_instrumented(self):
+        song = await Song.objects.afirst()
+        token = RefreshToken.for_user(self.user).access_token
+
+        response = await AsyncClient().get(f'/api/songs/{song.pk}/stream/async/', headers={'Authorization': f'Bearer {token}'})
+
+        timings = self.server_timing(response)
+        self.assertGreater(float(timings['auth']['dur']), 0)
+        self.assertNotEqual(timings['queries']['desc'], '"0 (0 duplicated)"')
+
+
+class IndexBenchmarkTests(TestCase):
+    def test_compares_query_shapes_and_keeps_the_indexes(self):
+        stdout = io.StringIO()
+        call_command('benchmark_indexes', '--songs', '200', '--users', '5', '--events', '500', '--runs', '2', stdout=stdout)
+
+        output = stdout.getvalue()
+        for label in ('available songs page', 'recent plays of user', 'plays in the last hour', 'listeners of song'):
+            self.assertIn(label, output)
+        with connection.cursor() as cursor:
+            indexes = {
+                name for table in ('music_lib_song', 'music_lib_playevent', 'users_user_liked_songs')
+                for name in connection.introspection.get_constraints(cursor, table)
+            }
+        self.assertLessEqual({'music_lib_song_available', 'music_lib_playevent_time', 'users_liked_songs_song_user'}, indexes)
+
+
+@override_settings(RECOMMENDATIONS_MIN_COOCCURRENCE=1)
+class RelatedSongsTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = User.objects.create_user(username='owner')
+        artist = Artist.objects.create(user=owner, name='Artist', bio='')
+        album = Album.objects.create(artist=artist, title='Album')
+        self.a, self.b, self.c, self.d = Song.objects.bulk_create(
+            Song(album=album, name=name, file=f'songs/{name}.mp3') for name in 'abcd'
+        )
+        self.listeners = [User.objects.create_user(username=f'listener{i}') for i in range(3)]
+        # a and b share all their listeners, a and c one of three.
+        for listener in self.listeners:
+            listener.liked_songs.add(self.a, self.b)
+        PlayEvent.objects.create(user=self.listeners[0], song=self.c)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.listeners[0])
+
+    def related(self, song) -> list:
+        return [item['id'] for item in self.client.get(f'/api/songs/{song.pk}/related/').data['results']]
+
+    def test_related_songs_are_ordered_by_similarity(self):
+        build_neighbours()
+
+        self.assertEqual(self.related(self.a), [self.b.pk, self.c.pk])
+        self.assertEqual(self.related(self.d), [])
+        neighbour = SongNeighbour.objects.get(song=self.a, neighbour=self.b)
+        self.assertAlmostEqual(neighbour.score, 1.0)
+        self.assertAlmostEqual(SongNeighbour.objects.get(song=self.a, neighbour=self.c).score, 1 / math.sqrt(3))
+
+    def test_related_lookup_is_one_query_with_cached_payloads(self):
+        build_neighbours()
+        self.related(self.a)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.related(self.a), [self.b.pk, self.c.pk])
+
+    def test_unavailable_songs_are_not_related(self):
+        build_neighbours()
+        Song.objects.filter(pk=self.b.pk).update(is_available=False)
+
+        self.assertEqual(self.related(self.a), [self.c.pk])
+
+    @override_settings(RECOMMENDATIONS_MIN_COOCCURRENCE=2)
+    def test_rare_cooccurrences_are_dropped(self):
+        build_neighbours()
+
+        self.assertEqual(self.related(self.a), [self.b.pk])
+
+    def test_incremental_refresh_recomputes_the_songs_of_new_listeners(self):
+        build_neighbours()
+        listener = User.objects.create_user(username='new')
+        PlayEvent.objects.bulk_create([PlayEvent(user=listener, song=self.c), PlayEvent(user=listener, song=self.d)])
+
+        build = refresh_neighbours()
+
+        self.assertFalse(build.is_full)
+        self.assertEqual(build.songs, 2)
+        self.assertEqual(self.related(self.d), [self.c.pk])
+        self.assertEqual(refresh_neighbours().songs, 0)
+
+    def test_incremental_refresh_scores_match_a_full_build(self):
+        build_neighbours()
+        listener = User.objects.create_user(username='new')
+        listener.liked_songs.add(self.c, self.d)
+
+        refresh_neighbours()
+        refreshed = set(SongNeighbour.objects.filter(song__in=[self.c, self.d]).values_list('song', 'neighbour', 'score'))
+        build_neighbours()
+
+        self.assertEqual(refreshed, set(
+            SongNeighbour.objects.filter(song__in=[self.c, self.d]).values_list('song', 'neighbour', 'score')
+        ))
+        self.assertAlmostEqual(SongNeighbour.objects.get(song=self.c, neighbour=self.a).score, 1 / math.sqrt(2 * 3))
+
+    @override_settings(RECOMMENDATIONS_MAX_USER_SONGS=2)
+    def test_heavy_listeners_are_normalized_alike_in_refreshes_and_full_builds(self):
+        # The play of c is beyond the two songs counted for listener0, it still counts in the norm of c.
+        build_neighbours()
+        listener = User.objects.create_user(username='new')
+        listener.liked_songs.add(self.c, self.d)
+
+        refresh_neighbours()
+        refreshed = set(SongNeighbour.objects.values_list('song', 'neighbour', 'score'))
+        build_neighbours()
+
+        self.assertEqual(refreshed, set(SongNeighbour.objects.values_list('song', 'neighbour', 'score')))
+        self.assertAlmostEqual(SongNeighbour.objects.get(song=self.c, neighbour=self.d).score, 1 / math.sqrt(2))
+
+    def test_refresh_falls_back_to_a_full_build_past_max_gaps(self):
+        build_neighbours()
+        listener = User.objects.create_user(username='new')
+        events = PlayEvent.objects.bulk_create(PlayEvent(user=listener, song=self.c) for _ in range(4))
+        PlayEvent.objects.filter(pk__in=[events[0].pk, events[2].pk]).delete()
+
+        with mock.patch('music_lib.watermarks.MAX_GAPS', 1), self.assertLogs('music_lib.recommendations', 'WARNING'):
+            build = refresh_neighbours()
+
+        self.assertTrue(build.is_full)
+        self.assertEqual([gap[:2] for gap in build.play_event_gaps], [[events[2].pk, events[2].pk]])
+
+    def test_gaps_no_open_transaction_can_fill_are_dropped(self):
+        build_neighbours()
+        listener = User.objects.create_user(username='new')
+        rolled_back, _ = PlayEvent.objects.bulk_create(PlayEvent(user=listener, song=self.c) for _ in range(2))
+        PlayEvent.objects.filter(pk=rolled_back.pk).delete()
+
+        with mock.patch('music_lib.watermarks.oldest_transaction_start', return_value=math.inf):
+            self.assertEqual(refresh_neighbours().play_event_gaps, [])
+
+    def test_refresh_reads_plays_committed_below_the_last_one_read(self):
+        build_neighbours()
+        listener = User.objects.create_user(username='new')
+        late, _ = PlayEvent.objects.bulk_create([PlayEvent(user=listener, song=self.c), PlayEvent(user=listener, song=self.d)])
+        # The transaction of the first play commits after the refresh read the second.
+        PlayEvent.objects.filter(pk=late.pk).delete()
+        build = refresh_neighbours()
+        self.assertEqual(self.related(self.d), [])
+        self.assertEqual([gap[:2] for gap in build.play_event_gaps], [[late.pk, late.pk]])
+
+        PlayEvent.objects.create(pk=late.pk, user=listener, song=self.c)
+        build = refresh_neighbours()
+
+        self.assertEqual(self.related(self.d), [self.c.pk])
+        self.assertEqual(build.play_event_gaps, [])
+
+    def test_gaps_are_given_up_after_a_timeout(self):
+        build_neighbours()
+        listener = User.objects.create_user(username='new')
+        rolled_back, _ = PlayEvent.objects.bulk_create(PlayEvent(user=listener, song=self.c) for _ in range(2))
+        PlayEvent.objects.filter(pk=rolled_back.pk).delete()
+        self.assertEqual(len(refresh_neighbours().play_event_gaps), 1)
+
+        with mock.patch('music_lib.watermarks.time.time', return_value=time.time() + GAP_TIMEOUT):
+            self.assertEqual(refresh_neighbours().play_event_gaps, [])
+
+    def test_full_build_drops_songs_without_listeners(self):
+        build_neighbours()
+        PlayEvent.objects.all().delete()
+
+        call_command('rebuild_related_songs', stdout=io.StringIO())
+
+        self.assertEqual(self.related(self.a), [self.b.pk])
+        self.assertFalse(SongNeighbour.objects.filter(song=self.c).exists())
+
+
+class ChartTests(CatalogTestCase):
+    now = datetime(2026, 10, 18, 12, 20, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        self.listener = User.objects.create_user(username='listener')
+        owner = User.objects.create_user(username='owner')
+        self.artist, other = Artist.objects.bulk_create([
+            Artist(user=owner, name='Artist', bio=''), Artist(user=owner, name='Other', bio=''),
+        ])
+        album = Album.objects.create(artist=self.artist, title='Album')
+        self.a, self.b, self.c = Song.objects.bulk_create(
+            Song(album=album, name=name, file=f'songs/{name}.mp3') for name in 'abc'
+        )
+        self.a.artists.add(self.artist)
+        self.b.artists.add(self.artist)
+        self.c.artists.add(other)
+
+        self.play(self.a, 3, timedelta(minutes=30))
+        self.play(self.b, 1, timedelta(minutes=30))
+        self.play(self.b, 5, timedelta(hours=5))
+        self.play(self.c, 10, timedelta(days=3))
+        self.play(self.c, 7, timedelta(days=10))
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.listener)
+
+    def play(self, song, times: int, ago: timedelta) -> None:
+        PlayEvent.objects.bulk_create(
+            PlayEvent(user=self.listener, song=song, timestamp=self.now - ago) for _ in range(times)
+        )
+
+    def chart(self, window: str, artist=None) -> list:
+        return list(ChartEntry.objects.filter(window=window, artist=artist).order_by('rank').values_list('song', 'plays'))
+
+    def window_counts(self) -> set:
+        return set(WindowPlayCount.objects.values_list('window', 'song', 'plays'))
+
+    def test_rebuild_ranks_each_window(self):
+        rebuild_charts(self.now)
+
+        self.assertEqual(self.chart('hour'), [(self.a.pk, 3), (self.b.pk, 1)])
+        self.assertEqual(self.chart('day'), [(self.b.pk, 6), (self.a.pk, 3)])
+        self.assertEqual(self.chart('week'), [(self.c.pk, 10), (self.b.pk, 6), (self.a.pk, 3)])
+        self.assertEqual(self.chart('week', self.artist), [(self.b.pk, 6), (self.a.pk, 3)])
+
+    def test_refresh_adds_new_plays(self):
+        rebuild_charts(self.now)
+        self.play(self.c, 4, -timedelta(minutes=10))
+
+        refresh_charts(self.now + timedelta(minutes=15))
+
+        self.assertEqual(self.chart('hour'), [(self.c.pk, 4), (self.a.pk, 3), (self.b.pk, 1)])
+        self.assertEqual(self.chart('week'), [(self.c.pk, 14), (self.b.pk, 6), (self.a.pk, 3)])
+        self.assertEqual(SongPlayRollup.objects.get(song=self.c, bucket=self.now.replace(minute=0)).plays, 4)
+
+    def test_refresh_counts_plays_committed_below_the_last_one_read_once(self):
+        rebuild_charts(self.now)
+        late, _ = PlayEvent.objects.bulk_create(
+            PlayEvent(user=self.listener, song=self.c, timestamp=self.now + timedelta(minutes=10)) for _ in range(2)
+        )
+        # The transaction of the first play commits after the refresh read the second.
+        PlayEvent.objects.filter(pk=late.pk).delete()
+        refresh_charts(self.now + timedelta(minutes=15))
+        self.assertEqual(dict(self.chart('hour'))[self.c.pk], 1)
+
+        PlayEvent.objects.create(pk=late.pk, user=self.listener, song=self.c, timestamp=late.timestamp)
+        refresh_charts(self.now + timedelta(minutes=16))
+        refresh_charts(self.now + timedelta(minutes=17))
+
+        self.assertEqual(dict(self.chart('hour'))[self.c.pk], 2)
+        self.assertEqual(SongPlayRollup.objects.get(song=self.c, bucket=self.now.replace(minute=0)).plays, 2)
+
+    def test_refresh_rebuilds_past_max_gaps(self):
+        rebuild_charts(self.now)
+        events = PlayEvent.objects.bulk_create(
+            PlayEvent(user=self.listener, song=self.c, timestamp=self.now + timedelta(minutes=10)) for _ in range(4)
+        )
+        PlayEvent.objects.filter(pk__in=[events[0].pk, events[2].pk]).delete()
+
+        with mock.patch('music_lib.watermarks.MAX_GAPS', 1), self.assertLogs('music_lib.charts', 'WARNING'):
+            build = refresh_charts(self.now + timedelta(minutes=15))
+
+        self.assertEqual(len(build.play_event_gaps), 1)
+        self.assertEqual(dict(self.chart('hour'))[self.c.pk], 2)
+
+    def test_refresh_slides_the_windows(self):
+        rebuild_charts(self.now)
+        self.play(self.a, 2, -timedelta(minutes=10))
+        refresh_charts(self.now + timedelta(minutes=15))
+
+        later = self.now + timedelta(days=2)
+        refresh_charts(later)
+
+        self.assertEqual(self.chart('hour'), [])
+        self.assertEqual(self.chart('day'), [])
+        self.assertEqual(self.chart('week'), [(self.c.pk, 10), (self.b.pk, 6), (self.a.pk, 5)])
+        incremental = self.window_counts()
+        rebuild_charts(later)
+        self.assertEqual(incremental, self.window_counts())
+
+    def test_refresh_without_new_buckets_keeps_the_charts(self):
+        rebuild_charts(self.now)
+
+        with CaptureQueriesContext(connection) as queries:
+            refresh_charts(self.now + timedelta(minutes=5))
+
+        # Neither the charts nor the rollups of the window are read or written.
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('music_lib_chartentry', tables)
+        self.assertNotIn('music_lib_windowplaycount', tables)
+        self.assertEqual(self.chart('hour'), [(self.a.pk, 3), (self.b.pk, 1)])
+
+    def test_chart_endpoint(self):
+        call_command('refresh_charts', stdout=io.StringIO())
+        rebuild_charts(self.now)
+
+        response = self.client.get('/api/charts/week/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['rank'], item['song']['id'], item['plays']) for item in response.data],
+                         [(1, self.c.pk, 10), (2, self.b.pk, 6), (3, self.a.pk, 3)])
+
+        response = self.client.get(f'/api/charts/day/?artist={self.artist.pk}&fields=name')
+        self.assertEqual(response.data, [
+            {'rank': 1, 'plays': 6, 'song': {'id': self.b.pk, 'name': 'b'}},
+            {'rank': 2, 'plays': 3, 'song': {'id': self.a.pk, 'name': 'a'}},
+        ])
+        self.assertEqual(self.client.get('/api/charts/month/').status_code, 404)
+        self.assertEqual(self.client.get('/api/charts/week/?artist=x').status_code, 400)
+
+
+@override_settings(JWT_STATELESS_AUTH=True)
+class StatelessAuthTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        caches[settings.JWT_DENYLIST_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(username='listener')
+        artist = Artist.objects.create(user=self.user, name='Artist', bio='')
+        album = Album.objects.create(artist=artist, title='Album', cover='album/Album/cover.jpg')
+        self.song = Song.objects.create(album=album, name='Song', file='album/Album/songs/song.mp3')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = str(self.refresh.access_token)
+
+    def get(self, url, token=None):
+        return Client().get(url, headers={'Authorization': f'Bearer {token or self.access}'})
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(url).status_code, 200)
+        return [query['sql'] for query in queries if 'FROM "users_user" ' in query['sql']]
+
+    def test_user_is_not_loaded_for_its_id(self):
+        self.assertEqual(self.user_queries(f'/api/songs/{self.song.pk}/is_liked/'), [])
+        self.assertEqual(self.user_queries('/api/playlists/'), [])
+        with override_settings(JWT_STATELESS_AUTH=False):
+            self.assertEqual(len(self.user_queries(f'/api/songs/{self.song.pk}/is_liked/')), 1)
+
+    def test_like_toggle_without_user_row(self):
+        client = Client(headers={'Authorization': f'Bearer {self.access}'})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.post(f'/api/songs/{self.song.pk}/like/').status_code, 200)
+        self.assertNotIn('FROM "users_user" ', ' '.join(query['sql'] for query in queries))
+        self.assertTrue(self.user.liked_songs.filter(pk=self.song.pk).exists())
+
+        client.post(f'/api/songs/{self.song.pk}/like/')
+        self.assertFalse(self.user.liked_songs.exists())
+        self.assertEqual(Song.objects.get(pk=self.song.pk).like_count, 0)
+
+    def test_claims_user_loads_model_fields_once(self):
+        user = ClaimsUser(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual((user.pk, user.id, user.is_authenticated, bool(user)), (self.user.pk, self.user.pk, True, True))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, 'listener')
+            self.assertFalse(user.is_staff)
+
+        User.objects.filter(pk=self.user.pk).delete()
+        with self.assertRaises(AuthenticationFailed):
+            ClaimsUser(self.user.pk).username
+
+    def test_decoded_token_cache_is_sized_on_first_use(self):
+        decode_token.cache_clear()
+        with override_settings(JWT_DECODED_TOKEN_CACHE_SIZE=1):
+            self.assertEqual(self.get('/api/playlists/').status_code, 200)
+            self.assertEqual(decode_token.cache_info().maxsize, 1)
+        decode_token.cache_clear()
+
+    def test_per_process_denylist_fails_the_system_check(self):
+        self.assertEqual([error.id for error in check_stateless_auth_denylist(None)], ['users.E001'])
+        redis = {**settings.CACHES, settings.JWT_DENYLIST_CACHE_ALIAS: {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379',
+        }}
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_stateless_auth_denylist(None), [])
+        with override_settings(JWT_STATELESS_AUTH=False):
+            self.assertEqual(check_stateless_auth_denylist(None), [])
+
+    def test_decoded_tokens_are_cached_and_expire(self):
+        self.get('/api/playlists/')
+        hits = decode_token.cache_info().hits
+        self.assertEqual(self.get('/api/playlists/').status_code, 200)
+        self.assertEqual(decode_token.cache_info().hits, hits + 1)
+
+        later = datetime.now(dt_timezone.utc) + settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'] + timedelta(seconds=1)
+        with mock.patch('users.authentication.aware_utcnow', return_value=later):
+            self.assertEqual(self.get('/api/playlists/').status_code, 401)
+
+    def test_logout_revokes_the_tokens(self):
+        client = Client()
+        client.cookies['access_token'] = self.access
+        client.cookies['refresh_token'] = str(self.refresh)
+        self.assertEqual(client.post('/api/token/clear/').status_code, 200)
+
+        self.assertEqual(self.get('/api/playlists/').status_code, 401)
+        client = Client()
+        client.cookies['refresh_token'] = str(self.refresh)
+        self.assertEqual(client.post('/api/token/refresh/').status_code, 401)
+        # Other sessions of the user are not affected.
+        self.assertEqual(self.get('/api/playlists/', str(RefreshToken.for_user(self.user).access_token)).status_code, 200)
+
+    def test_deactivated_and_deleted_users_are_revoked(self):
+        self.assertEqual(self.get('/api/playlists/').status_code, 200)
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.get('/api/playlists/').status_code, 401)
+
+        other = User.objects.create_user(username='other')
+        access = str(RefreshToken.for_user(other).access_token)
+        other.delete()
+        self.assertEqual(self.get('/api/playlists/', access).status_code, 401)
+
+    def test_benchmark_reports_saved_queries(self):
+        stdout = io.StringIO()
+        call_command(
+            'benchmark_auth', '--songs', '20', '--users', '2', '--likes-per-user', '2', '--playlists-per-user', '2',
+            '--songs-per-playlist', '2', '--requests', '2', '--validations', '10', '--only', 'songs-is-liked',
+            stdout=stdout, stderr=io.StringIO(),
+        )
+
+        line = next(line for line in stdout.getvalue().splitlines() if line.startswith('songs-is-liked'))
+        self.assertEqual(line.split()[1:4], ['2', '1', '1'])
+        self.assertIn('decoded token cache', stdout.getvalue())
+
+
+def image_upload(name: str, size: tuple, image_format: str = 'JPEG') -> SimpleUploadedFile:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 40, 90)).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0, IMAGE_VARIANT_WIDTHS=[96, 320, 640], IMAGE_VARIANT_FORMATS=['webp', 'jpeg'],
+                   PUBLIC_ORIGIN='http://testserver')
+class ImageVariantTests(MediaTestCase):
+    def upload_cover(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.album.cover = upload
+            self.album.save()
+        self.album.refresh_from_db()
+        return self.album.cover_variants
+
+    def test_upload_is_resized_to_every_width_and_format(self):
+        variants = self.upload_cover(image_upload('cover.jpg', (1000, 800)))
+
+        self.assertEqual(variants['source'], self.album.cover.name)
+        self.assertEqual({name: sorted(files, key=int) for name, files in variants['files'].items()},
+                         {'webp': ['96', '320', '640'], 'jpeg': ['96', '320', '640']})
+        with Image.open(default_storage.path(variants['files']['webp']['320'])) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 256)))
+        with Image.open(default_storage.path(variants['files']['jpeg']['96'])) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (96, 77)))
+
+        srcset = self.client.get(f'/api/albums/{self.album.pk}/').data['cover_variants']
+        self.assertEqual(set(srcset), {'image/webp', 'image/jpeg'})
+        self.assertEqual(
+            srcset['image/webp'],
+            ', '.join(f'http://testserver/media/{variants["files"]["webp"][width]} {width}w' for width in ('96', '320', '640')),
+        )
+        song = self.client.get(f'/api/songs/{self.song.pk}/').data
+        self.assertEqual(song['album']['cover_variants'], srcset)
+
+    def test_small_images_are_not_upscaled(self):
+        variants = self.upload_cover(image_upload('cover.png', (200, 200), 'PNG'))
+
+        self.assertEqual(variants['files'], {'webp': {'96': mock.ANY}, 'jpeg': {'96': mock.ANY}})
+
+    def test_rotated_portraits_are_not_upscaled(self):
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (1000, 600), (200, 40, 90)).save(buffer, 'JPEG', exif=exif)
+        variants = self.upload_cover(SimpleUploadedFile('cover.jpg', buffer.getvalue()))
+
+        self.assertEqual(sorted(variants['files']['jpeg'], key=int), ['96', '320'])
+        with Image.open(default_storage.path(variants['files']['jpeg']['320'])) as image:
+            self.assertEqual(image.size, (320, 533))
+
+    def test_forced_backfill_rewrites_the_variants_with_new_settings(self):
+        old = self.upload_cover(image_upload('cover.jpg', (1000, 800)))
+        old_size = default_storage.size(old['files']['jpeg']['640'])
+
+        with override_settings(IMAGE_VARIANT_QUALITY=30):
+            call_command('build_image_variants', '--force', stdout=io.StringIO())
+        self.album.refresh_from_db()
+        new = self.album.cover_variants
+
+        self.assertNotEqual(old['files']['jpeg']['640'], new['files']['jpeg']['640'])
+        self.assertFalse(default_storage.exists(old['files']['jpeg']['640']))
+        self.assertLess(default_storage.size(new['files']['jpeg']['640']), old_size)
+
+    def test_replaced_image_gets_new_variants(self):
+        old = self.upload_cover(image_upload('cover.jpg', (1000, 800)))
+        new = self.upload_cover(image_upload('other.jpg', (800, 800)))
+
+        self.assertNotEqual(posixpath.dirname(old['files']['webp']['96']), posixpath.dirname(new['files']['webp']['96']))
+        self.assertFalse(default_storage.exists(old['files']['webp']['96']))
+        self.assertTrue(default_storage.exists(new['files']['webp']['96']))
+
+        # Saving other fields does not queue the image again.
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.album.title = 'Renamed'
+            self.album.save()
+        self.assertEqual(callbacks, [])
+
+    def test_artist_images_and_failures(self):
+        with self.assertLogs('music_lib.images', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.artist.avatar = image_upload('avatar.jpg', (400, 400))
+            self.artist.thumbnail = SimpleUploadedFile('thumbnail.jpg', b'not an image')
+            self.artist.save()
+        self.artist.refresh_from_db()
+
+        self.assertEqual(list(self.artist.avatar_variants['files']['webp']), ['320', '96'])
+        self.assertEqual(self.artist.thumbnail_variants, {'source': self.artist.thumbnail.name, 'failed': True})
+        data = self.client.get(f'/api/artists/{self.artist.pk}/').data
+        self.assertIn('320w', data['avatar_variants']['image/jpeg'])
+        self.assertEqual(data['thumbnail_variants'], {})
+
+    def test_backfill_resizes_missing_and_failed_images(self):
+        self.artist.thumbnail = SimpleUploadedFile('thumbnail.jpg', b'not an image')
+        self.artist.save()
+        Artist.objects.filter(pk=self.artist.pk).update(
+            thumbnail_variants={'source': self.artist.thumbnail.name, 'failed': True}
+        )
+        with open(self.artist.thumbnail.path, 'wb') as f:
+            f.write(image_upload('thumbnail.jpg', (500, 500)).read())
+        self.album.cover = image_upload('cover.jpg', (700, 700))
+        self.album.save()
+
+        stdout = io.StringIO()
+        call_command('build_image_variants', stdout=stdout)
+
+        self.assertIn('Resized 2 images', stdout.getvalue())
+        self.artist.refresh_from_db()
+        self.album.refresh_from_db()
+        self.assertIn('320', self.artist.thumbnail_variants['files']['jpeg'])
+        self.assertIn('640', self.album.cover_variants['files']['webp'])
+
+        stdout = io.StringIO()
+        call_command('build_image_variants', stdout=stdout)
+        self.assertIn('Resized 0 images', stdout.getvalue())
+
+    def test_variants_are_served_immutable(self):
+        variants = self.upload_cover(image_upload('cover.jpg', (400, 300)))
+
+        response = serve_immutable(RequestFactory().get('/'), variants['files']['webp']['96'], document_root=self.media_root)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+
+class ContentAddressedStorageTests(MediaTestCase):
+    def references(self, name):
+        return MediaBlob.objects.filter(name=name).values_list('references', flat=True).first()
+
+    def test_uploads_are_named_after_their_digest_and_shared(self):
+        name = blob_name(hashlib.sha256(AUDIO_BYTES).hexdigest(), '.mp3')
+        self.assertEqual(self.song.file.name, name)
+
+        album = Album.objects.create(artist=self.artist, title='Other', cover='album/Other/cover.jpg')
+        copy = Song.objects.create(album=album, name='Copy', file=SimpleUploadedFile('Copy.MP3', AUDIO_BYTES))
+
+        self.assertEqual(copy.file.name, name)
+        self.assertEqual(self.references(name), 2)
+        self.assertEqual(MediaBlob.objects.get(name=name).size, len(AUDIO_BYTES))
+        self.assertEqual(os.listdir(os.path.dirname(content_addressed_storage.path(name))), [os.path.basename(name)])
+
+    def test_references_follow_replaced_and_deleted_files(self):
+        old = self.song.file.name
+        song = Song.objects.get(pk=self.song.pk)
+        song.file = SimpleUploadedFile('song.mp3', b'other' + AUDIO_BYTES)
+        song.save()
+        self.assertEqual((self.references(old), self.references(song.file.name)), (0, 1))
+
+        # Saves not touching the file leave the counts alone.
+        song.name = 'Renamed'
+        song.save()
+        Song.objects.get(pk=song.pk).save(update_fields=['name'])
+        self.assertEqual(self.references(song.file.name), 1)
+
+        song.delete()
+        self.assertEqual(self.references(song.file.name), 0)
+
+    def test_collect_keeps_blobs_until_the_grace_period_is_over(self):
+        name = self.song.file.name
+        self.song.delete()
+        orphan = content_addressed_storage.save('orphan.mp3', io.BytesIO(b'orphan'))
+        temporary = content_addressed_storage.path(f'{TEMP_PREFIX}/upload')
+        os.makedirs(os.path.dirname(temporary), exist_ok=True)
+        with open(temporary, 'wb') as f:
+            f.write(b'partial')
+
+        self.assertEqual(collect_blobs(), (0, 0))
+        self.assertTrue(content_addressed_storage.exists(name))
+
+        removed = collect_blobs(datetime.now(dt_timezone.utc) + timedelta(seconds=settings.MEDIA_BLOB_GRACE_PERIOD + 60))
+        self.assertEqual(removed, (3, len(AUDIO_BYTES) + len(b'orphan') + len(b'partial')))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertFalse(content_addressed_storage.exists(name))
+        self.assertFalse(content_addressed_storage.exists(orphan))
+        self.assertFalse(os.path.exists(temporary))
+
+    def test_collect_repairs_counts_of_files_still_referenced(self):
+        name = self.song.file.name
+        # As if the song had been written without signals, e.g. by bulk_create.
+        MediaBlob.objects.filter(name=name).delete()
+
+        self.assertEqual(collect_blobs(datetime.now(dt_timezone.utc) + timedelta(days=1)), (0, 0))
+        self.assertEqual(self.references(name), 1)
+        self.assertTrue(content_addressed_storage.exists(name))
+
+    def test_upload_handlers_hash_the_request_body(self):
+        for max_memory_size in (settings.FILE_UPLOAD_MAX_MEMORY_SIZE, 0):
+            with self.subTest(max_memory_size=max_memory_size), \
+                    override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=max_memory_size):
+                request = RequestFactory().post('/', {'file': SimpleUploadedFile('song.mp3', AUDIO_BYTES)})
+                upload = request.FILES['file']
+                self.assertEqual(upload.content_digest, hashlib.sha256(AUDIO_BYTES).hexdigest())
+                self.assertEqual(content_addressed_storage.save('song.mp3', upload), self.song.file.name)
+
+    def test_streams_and_blob_files_carry_the_digest(self):
+        digest = content_digest(self.song.file.name)
+
+        response = self.client.get(f'/api/songs/{self.song.pk}/stream/', HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response['ETag'], f'"{digest}"')
+        response = serve_immutable(RequestFactory().get('/'), self.song.file.name, document_root=self.media_root)
+        self.assertEqual(response['ETag'], f'"{digest}"')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(
+        AUDIO_TRANSCODER='stub', AUDIO_TRANSCODE_WORKERS=0, AUDIO_RENDITION_BITRATES=[64], HLS_SEGMENT_DURATION=1,
+    )
+    def test_renditions_and_packages_are_shared_and_collected_with_the_blob(self):
+        digest = file_digest(self.song.file.path)
+        copy = Song.objects.create(album=self.album, name='Copy', file=SimpleUploadedFile('copy.mp3', AUDIO_BYTES))
+        # 10240 bytes over 1 second is about 82 kbps, in one segment.
+        Song.objects.filter(pk__in=[self.song.pk, copy.pk]).update(duration=1)
+        encoder = mock.Mock(wraps=stub_encode)
+        with mock.patch.dict(ENCODERS, {'stub': encoder}):
+            for song in Song.objects.filter(pk__in=[self.song.pk, copy.pk]):
+                with self.captureOnCommitCallbacks(execute=True):
+                    transcoder.enqueue(song)
+                    queue_package(song)
+
+        self.assertEqual(digest, content_digest(self.song.file.name))
+        self.assertEqual(encoder.call_count, 1)
+        renditions = set(SongRendition.objects.filter(status=SongRendition.READY).values_list('file', flat=True))
+        playlists = set(HLSPackage.objects.filter(status=HLSPackage.READY).values_list('playlist', flat=True))
+        self.assertEqual((len(renditions), len(playlists)), (1, 2))
+        # The rendition, and the playlists of the original and the rendition with their segment.
+        files = derived_files(digest)
+        self.assertEqual(len(files), 5)
+
+        self.song.delete()
+        later = datetime.now(dt_timezone.utc) + timedelta(seconds=settings.MEDIA_BLOB_GRACE_PERIOD + 60)
+        collect_blobs(later)
+        self.assertEqual(derived_files(digest), files)
+        copy.delete()
+        collect_blobs(later)
+        self.assertFalse(content_addressed_storage.exists(copy.file.name))
+        self.assertEqual(derived_files(digest), [])
+        self.assertFalse(DerivedFile.objects.exists())
+
+    @override_settings(AUDIO_TRANSCODER='stub', AUDIO_TRANSCODE_WORKERS=0, HLS_PACKAGING=False)
+    def test_songs_sharing_a_blob_wait_for_the_rendition_being_encoded(self):
+        copy = Song.objects.create(album=self.album, name='Copy', file=SimpleUploadedFile('copy.mp3', AUDIO_BYTES))
+        renditions = [SongRendition.objects.create(song=song, bitrate=64) for song in (self.song, copy)]
+
+        def encode(source, target, bitrate):
+            if encoder.call_count == 1:
+                # Another worker transcodes the copy while this one encodes.
+                transcode(renditions[1].pk)
+                self.assertEqual(SongRendition.objects.get(pk=renditions[1].pk).status, SongRendition.PENDING)
+            stub_encode(source, target, bitrate)
+
+        encoder = mock.Mock(side_effect=encode)
+        with mock.patch.dict(ENCODERS, {'stub': encoder}):
+            transcode(renditions[0].pk)
+
+        name = rendition_name(self.song.file.name, 64)
+        self.assertEqual(encoder.call_count, 1)
+        self.assertEqual(
+            set(SongRendition.objects.values_list('file', 'status')), {(name, SongRendition.READY)},
+        )
+        self.assertEqual(os.listdir(os.path.dirname(default_storage.path(name))), [os.path.basename(name)])
+
+        # Claims of a worker that died are taken over.
+        stale = DerivedFile.objects.create(
+            name='renditions/stale.64k.mp3', claimed_at=datetime.now(dt_timezone.utc) - CLAIM_TIMEOUT * 2,
+        )
+        self.assertTrue(claim(stale.name)[1])
+        self.assertFalse(claim(stale.name)[1])
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponseForbidden
+from django.http.response import HttpResponseBase
+from django.views.decorators.http import require_GET
+
+from music_lib.streaming import build_delivery_response
+
+TICKET_SALT = 'music_lib.stream-ticket'
+
+
+def get_ticket_ttl() -> int:
+    return getattr(settings, 'STREAM_TICKET_TTL', 6 * 60 * 60)
+
+
+def issue_ticket(user_id: int, song_id: int, file_name: str) -> tuple[str, int]:
+    """
+    Sign a stream ticket for ``file_name`` (storage-relative) of a song, returning the token
+    and its expiry timestamp. Everything needed to serve the file is inside the token.
+    """
+    expires = int(time.time()) + get_ticket_ttl()
+    token = signing.dumps({'u': user_id, 's': song_id, 'f': file_name, 'e': expires}, salt=TICKET_SALT)
+    return token, expires
+
+
+def read_ticket(token: str) -> dict | None:
+    """The payload of a valid, unexpired ticket, or ``None``."""
+    try:
+        payload = signing.loads(token, salt=TICKET_SALT)
+    except signing.BadSignature:
+        return None
+    if payload['e'] < time.time():
+        return None
+    return payload
+
+
+@require_GET
+def ticket_stream(request, token: str) -> HttpResponseBase:
+    """
+    Serve the file of a stream ticket issued by ``SongAPIViewSet.ticket``.
+
+    The signature replaces authentication, the song lookup and the availability check,
+    so a chunk request touches neither the database nor the user.
+    """
+    ticket = read_ticket(token)
+    if ticket is None:
+        return HttpResponseForbidden('Invalid or expired stream ticket.')
+
+    try:
+        return build_delivery_response(
+            default_storage.path(ticket['f']), ticket['f'], request.META.get('HTTP_RANGE')
+        )
+    except FileNotFoundError:
+        raise Http404("Audio file does not exist.")
@@ -0,0 +1,228 @@
+import atexit
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+
+from music_lib.models import DerivedFile, Song, SongRendition
+from music_lib.storage import content_digest, digest_directory
+from music_lib.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BITRATES = (64, 128, 256)
+
+ENCODER_FFMPEG = 'ffmpeg'
+ENCODER_STUB = 'stub'
+RENDITIONS_PREFIX = 'renditions'
+# Claims of derived files still pending after this long were left by a worker that died.
+CLAIM_TIMEOUT = timedelta(hours=1)
+
+
+def ffmpeg_encode(source: str, target: str, bitrate: int) -> None:
+    subprocess.run(
+        [
+            getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'), '-nostdin', '-loglevel', 'error', '-y',
+            '-i', source, '-vn', '-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k', '-f', 'mp3', target,
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+def stub_encode(source: str, target: str, bitrate: int) -> None:
+    """Encoder for tests and machines without ffmpeg: a tagged copy of the source."""
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        dst.write(f'stub {bitrate}k\n'.encode())
+        shutil.copyfileobj(src, dst)
+
+
+ENCODERS = {ENCODER_FFMPEG: ffmpeg_encode, ENCODER_STUB: stub_encode}
+
+
+def get_encoder_name() -> str:
+    name = getattr(settings, 'AUDIO_TRANSCODER', ENCODER_FFMPEG)
+    if name not in (ENCODER_FFMPEG, ENCODER_STUB):
+        raise ImproperlyConfigured(
+            f'Unknown AUDIO_TRANSCODER {name!r}; expected {ENCODER_FFMPEG!r} or {ENCODER_STUB!r}.'
+        )
+    return name
+
+
+def get_encoder():
+    return ENCODERS[get_encoder_name()]
+
+
+def rendition_name(song_file_name: str, bitrate: int) -> str:
+    # Named after the original's digest: blobs/ab/cd/abcd….mp3 -> renditions/ab/cd/abcd….128k.mp3
+    digest = content_digest(song_file_name)
+    if digest:
+        return f'{digest_directory(RENDITIONS_PREFIX, digest)}/{digest}.{bitrate}k.mp3'
+    # Files stored before, next to the original: album/A/songs/track.mp3 -> album/A/songs/track.128k.mp3
+    return f'{os.path.splitext(song_file_name)[0]}.{bitrate}k.mp3'
+
+
+def source_bitrate(song: Song) -> float | None:
+    """Average bitrate of the uploaded file in kbps, when it was probed or its duration is known."""
+    if song.bitrate:
+        return song.bitrate
+    if not song.duration:
+        return None
+    try:
+        return song.file.size * 8 / float(song.duration) / 1000
+    except OSError:
+        return None
+
+
+def claim(name: str) -> tuple[DerivedFile, bool]:
+    """
+    Claim the making of the derived file ``name``, returning its row and whether this worker
+    should make it: not when it is ready or another worker is making it.
+    """
+    derived, created = DerivedFile.objects.get_or_create(name=name)
+    if created or derived.status == DerivedFile.READY:
+        return derived, created
+    now = timezone.now()
+    taken = DerivedFile.objects.filter(
+        pk=derived.pk, status=DerivedFile.PENDING, claimed_at=derived.claimed_at, claimed_at__lt=now - CLAIM_TIMEOUT,
+    ).update(claimed_at=now)
+    return derived, bool(taken)
+
+
+def transcode(rendition_id: int) -> SongRendition:
+    rendition = SongRendition.objects.select_related('song').get(pk=rendition_id)
+    song = rendition.song
+    name = rendition_name(song.file.name, rendition.bitrate)
+    # Songs with the same content share the renditions of their blob, encoded once.
+    waiting = SongRendition.objects.filter(
+        song__file=song.file.name, bitrate=rendition.bitrate, status=SongRendition.PENDING,
+    ).exclude(pk=rendition.pk)
+
+    derived, owned = claim(name)
+    if not owned:
+        # Otherwise the worker encoding the file marks this rendition ready with it.
+        if derived.status == DerivedFile.READY:
+            rendition.file.name = name
+            rendition.status = SongRendition.READY
+            rendition.save(update_fields=['file', 'status'])
+        return rendition
+
+    # Renditions encoded before the claims were kept are reused as they are.
+    if not SongRendition.objects.filter(file=name, status=SongRendition.READY).exists():
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                target = os.path.join(directory, 'rendition.mp3')
+                get_encoder()(song.file.path, target, rendition.bitrate)
+                # A file left by a run that was cut short is replaced rather than saved under a suffix.
+                default_storage.delete(name)
+                with open(target, 'rb') as f:
+                    default_storage.save(name, File(f))
+        except Exception:
+            logger.exception('Failed to transcode %s to %d kbps', song.file.name, rendition.bitrate)
+            derived.delete()
+            for failed in [rendition, *waiting]:
+                failed.status = SongRendition.FAILED
+                failed.save(update_fields=['status'])
+            return rendition
+
+    derived.status = DerivedFile.READY
+    derived.save(update_fields=['status'])
+    for ready in [rendition, *waiting]:
+        ready.file.name = name
+        ready.status = SongRendition.READY
+        ready.save(update_fields=['file', 'status'])
+    return rendition
+
+
+class Transcoder(WorkerPool):
+    """
+    Local worker pool producing the ``AUDIO_RENDITION_BITRATES`` renditions of uploaded songs
+    (and their HLS packages, see ``music_lib.hls``).
+
+    Jobs are started once the transaction that queued them commits. With
+    ``AUDIO_TRANSCODE_WORKERS = 0`` they run synchronously in the committing thread.
+    """
+
+    def __init__(self) -> None:
+        super().__init__('AUDIO_TRANSCODE_WORKERS', 2, 'transcoder')
+
+    @property
+    def bitrates(self) -> tuple:
+        return tuple(getattr(settings, 'AUDIO_RENDITION_BITRATES', DEFAULT_BITRATES))
+
+    def enqueue(self, song: Song) -> list[SongRendition]:
+        """Queue the renditions ``song`` is missing; none are made at or above the source bitrate."""
+        limit = source_bitrate(song)
+        existing = set(song.renditions.exclude(status=SongRendition.FAILED).values_list('bitrate', flat=True))
+        bitrates = [
+            bitrate for bitrate in self.bitrates
+            if bitrate not in existing and (limit is None or bitrate < limit)
+        ]
+        if not bitrates:
+            return []
+
+        # Failed renditions are retried.
+        song.renditions.filter(bitrate__in=bitrates).delete()
+        renditions = SongRendition.objects.bulk_create(SongRendition(song=song, bitrate=bitrate) for bitrate in bitrates)
+        transaction.on_commit(lambda: [self.submit(transcode, rendition.pk) for rendition in renditions])
+        return renditions
+
+
+transcoder = Transcoder()
+atexit.register(transcoder.shutdown)
+
+
+def requested_bitrate(request) -> int | None:
+    """
+    Highest bitrate (kbps) the client asked for: ``?bitrate=`` first, then the
+    ``Save-Data`` and ``Downlink`` (Mbps) client hints. ``None`` means the original.
+    """
+    try:
+        return int(request.GET['bitrate'])
+    except (KeyError, ValueError):
+        pass
+
+    if request.headers.get('Save-Data', '').strip().lower() == 'on':
+        return 0
+    try:
+        # Leave half of the estimated bandwidth as headroom.
+        return int(float(request.headers['Downlink']) * 1000 / 2)
+    except (KeyError, ValueError):
+        return None
+
+
+def select_rendition(song: Song, bitrate: int | None) -> SongRendition | None:
+    """
+    The best ready rendition of ``song`` within ``bitrate``, the lowest one when none fits,
+    or ``None`` when the original should be served.
+    """
+    if bitrate is None:
+        return None
+
+    renditions = list(song.renditions.filter(status=SongRendition.READY).order_by('bitrate'))
+    if not renditions:
+        return None
+    original = source_bitrate(song)
+    if (original is not None and bitrate >= original) or (original is None and bitrate > renditions[-1].bitrate):
+        return None
+
+    fitting = [rendition for rendition in renditions if rendition.bitrate <= bitrate]
+    return fitting[-1] if fitting else renditions[0]
+
+
+def add_rendition_headers(response, rendition: SongRendition | None):
+    # Players should pin follow-up range requests with ?bitrate= so that they hit the same file.
+    response['X-Audio-Bitrate'] = str(rendition.bitrate) if rendition else 'original'
+    response['Accept-CH'] = 'Save-Data, Downlink'
+    patch_vary_headers(response, ['Save-Data', 'Downlink'])
+    return response
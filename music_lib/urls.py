@@ -1,13 +1,19 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
-from music_lib.api_views import SongAPIViewSet, ArtistAPIViewSet, AlbumAPIViewSet, PlaylistAPIViewSet
+from music_lib.api_views import SongAPIViewSet, ArtistAPIViewSet, AlbumAPIViewSet, PlaylistAPIViewSet, ChartAPIViewSet
+from music_lib.async_views import stream_song
+from music_lib.tickets import ticket_stream
 
 router = DefaultRouter()
 router.register('songs', SongAPIViewSet, basename='song')
 router.register('artists', ArtistAPIViewSet, basename='artist')
 router.register('albums', AlbumAPIViewSet, basename='album')
 router.register('playlists', PlaylistAPIViewSet, basename='playlist')
+router.register('charts', ChartAPIViewSet, basename='chart')
 
 urlpatterns = [
+    path('songs/<int:pk>/stream/async/', stream_song, name='song-stream-async'),
+    path('stream/<str:token>/', ticket_stream, name='stream-ticket'),
     *router.urls
 ]
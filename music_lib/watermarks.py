@@ -0,0 +1,99 @@
+import math
+import time
+from bisect import bisect_left, bisect_right
+
+from django.db import connection
+from django.db.models import Max, Q
+
+# Seconds the ids missing below the highest read are waited for, after which their
+# transaction is taken as rolled back (or the rows as deleted).
+GAP_TIMEOUT = 60 * 60
+# Ids below the highest that a full read checks for gaps: only concurrent transactions,
+# which insert the latest ids, can still commit below it.
+TAIL_SCAN_IDS = 10_000
+# Gaps read again by each run, beyond which an incremental run gives way to a full one:
+# they are mostly rows deleted since (unliked songs), and each one adds to the query.
+MAX_GAPS = 1000
+
+
+class TooManyGaps(Exception):
+    pass
+
+
+def oldest_transaction_start() -> float | None:
+    """
+    When the oldest transaction still open on the database started (infinity when none is),
+    on Postgres; None where it is not known. The transaction of a missing id started before
+    the gap was seen, so gaps seen before then are rows rolled back or deleted since.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        # As an age, the clocks of the database and of this host may differ.
+        cursor.execute(
+            'SELECT EXTRACT(EPOCH FROM clock_timestamp() - min(xact_start)) FROM pg_stat_activity '
+            'WHERE datname = current_database() AND pid <> pg_backend_pid()'
+        )
+        age = cursor.fetchone()[0]
+    return math.inf if age is None else time.time() - float(age)
+
+
+def id_ranges(gaps) -> Q:
+    condition = Q(pk__in=[])
+    for first, last, _ in gaps:
+        condition |= Q(pk__gte=first, pk__lte=last)
+    return condition
+
+
+def find_gaps(ids: list, first: int, last: int, since: float) -> list:
+    """``[first missing, last missing, since]`` ranges of the ids from ``first`` to ``last`` missing from the sorted ``ids``."""
+    gaps, expected = [], first
+    for pk in ids[bisect_left(ids, first):bisect_right(ids, last)]:
+        if pk > expected:
+            gaps.append([expected, pk - 1, since])
+        expected = pk + 1
+    if expected <= last:
+        gaps.append([expected, last, since])
+    return gaps
+
+
+def read_new(queryset, last_id: int, gaps: list, keep_highest_gaps: bool = False) -> tuple[Q, int, list]:
+    """
+    Select the rows of ``queryset`` added since ``last_id`` or filling one of ``gaps``.
+
+    Ids are taken when rows are inserted but only visible once their transaction commits,
+    so rows can show up below an id already read: the ids missing below the highest one
+    are kept as gaps, read again by the next runs. Returns a filter matching exactly the
+    rows visible now, whatever commits later, and the new last id and gaps.
+
+    Gaps are dropped after ``GAP_TIMEOUT``, or as soon as no transaction that could fill
+    them is open on Postgres. Beyond ``MAX_GAPS`` this raises ``TooManyGaps`` for the
+    caller to read everything again, or keeps only the highest with ``keep_highest_gaps``.
+    """
+    now = time.time()
+    gaps = [gap for gap in gaps if now - gap[2] < GAP_TIMEOUT]
+    ids = list(queryset.filter(Q(pk__gt=last_id) | id_ranges(gaps)).order_by('pk').values_list('pk', flat=True))
+    new_last_id = max(ids[-1] if ids else 0, last_id)
+
+    new_gaps = [remaining for first, last, since in gaps for remaining in find_gaps(ids, first, last, since)]
+    new_gaps += find_gaps(ids, last_id + 1, new_last_id, now)
+    settled = oldest_transaction_start() if new_gaps else None
+    if settled is not None:
+        new_gaps = [gap for gap in new_gaps if gap[2] >= settled]
+    if len(new_gaps) > MAX_GAPS:
+        if not keep_highest_gaps:
+            raise TooManyGaps(f'{len(new_gaps)} ranges of ids are missing below {new_last_id}.')
+        new_gaps = new_gaps[-MAX_GAPS:]
+
+    rows = (Q(pk__gt=last_id, pk__lte=new_last_id) | id_ranges(gaps)) & ~id_ranges(new_gaps)
+    return rows, new_last_id, new_gaps
+
+
+def read_all(queryset) -> tuple[Q, int, list]:
+    """
+    ``read_new`` from the first row, only the last ``TAIL_SCAN_IDS`` ids are checked for gaps
+    and the highest ``MAX_GAPS`` of them kept.
+    """
+    tail = max((queryset.aggregate(last=Max('pk'))['last'] or 0) - TAIL_SCAN_IDS, 0)
+    rows, last_id, gaps = read_new(queryset, tail, [], keep_highest_gaps=True)
+    return Q(pk__lte=tail) | rows, last_id, gaps
@@ -0,0 +1,55 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    Local thread pool for background jobs on model instances, sized by the ``setting``
+    (``default`` when unset). With 0 workers, jobs run synchronously in the submitting thread.
+    """
+
+    def __init__(self, setting: str, default: int, name: str, workers: int | None = None) -> None:
+        self.setting = setting
+        self.default = default
+        self.name = name
+        self.max_workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @property
+    def workers(self) -> int:
+        if self.max_workers is not None:
+            return self.max_workers
+        return getattr(settings, self.setting, self.default)
+
+    def submit(self, job, object_id: int) -> None:
+        """Run ``job(object_id)`` on the pool, or right away without workers."""
+        if self.workers <= 0:
+            job(object_id)
+            return
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        self.executor.submit(self.run, job, object_id)
+
+    def run(self, job, object_id: int) -> None:
+        try:
+            job(object_id)
+        except Exception:
+            logger.exception('%s job for %d failed', job.__name__, object_id)
+        finally:
+            connection.close()
+
+    def shutdown(self) -> None:
+        """Wait for the queued jobs; the pool is started again by the next ``submit``."""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -73,6 +73,24 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Request instrumentation (middlewares.instrumentation): phase timings and SQL query counts in
+# a Server-Timing header and a JSON log line, histograms per route at /metrics/ (Bearer
+# INSTRUMENTATION_METRICS_TOKEN, open in DEBUG when unset). Queries slower than
+# INSTRUMENTATION_SLOW_QUERY_MS are sampled in the log line. Staff requests with ?profile=1 or
+# an X-Profile: 1 header, and a INSTRUMENTATION_PROFILE_SAMPLE_RATE share of all requests, are
+# run under cProfile and dumped to INSTRUMENTATION_PROFILE_DIR (default the temp directory).
+INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', 'False').lower() in ('true', '1')
+INSTRUMENTATION_SLOW_QUERY_MS = float(os.environ.get('INSTRUMENTATION_SLOW_QUERY_MS', 100))
+INSTRUMENTATION_METRICS_TOKEN = os.environ.get('INSTRUMENTATION_METRICS_TOKEN', '')
+INSTRUMENTATION_PROFILE_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_PROFILE_SAMPLE_RATE', 0))
+INSTRUMENTATION_PROFILE_DIR = os.environ.get('INSTRUMENTATION_PROFILE_DIR', '')
+if INSTRUMENTATION_ENABLED:
+    # After JWTAuthCookieMiddleware so that staff can ask for a profile with the cookie token.
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('middlewares.jwt_middleware.JWTAuthCookieMiddleware') + 1,
+        'middlewares.instrumentation.InstrumentationMiddleware',
+    )
+
 ROOT_URLCONF = 'music_streamer.urls'
 
 TEMPLATES = [
@@ -134,6 +152,150 @@ MEDIA_ROOT = 'media'
 
 MEDIA_URL = '/media/'
 
+# Read size used when streaming audio files; bounds per-request memory regardless of file size.
+AUDIO_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Threads the async stream view (/api/songs/<id>/stream/async/, served under ASGI, e.g.
+# `uvicorn music_streamer.asgi:application`) reads files on. Streams only hold a thread
+# for the duration of a single chunk read.
+AUDIO_STREAM_IO_THREADS = int(os.environ.get('AUDIO_STREAM_IO_THREADS', 32))
+
+# Lifetime in seconds of the signed stream URLs issued by /api/songs/<id>/ticket/.
+STREAM_TICKET_TTL = int(os.environ.get('STREAM_TICKET_TTL', 6 * 60 * 60))
+
+# How song files are delivered once the request is authorized:
+#   'stream'           - served by the Django worker (default, works without a proxy)
+#   'x-accel-redirect' - handed off to nginx via an internal location at AUDIO_ACCEL_REDIRECT_PREFIX
+#   'x-sendfile'       - handed off to Apache mod_xsendfile / lighttpd via the file system path
+AUDIO_DELIVERY_BACKEND = os.environ.get('AUDIO_DELIVERY_BACKEND', 'stream')
+
+# nginx example:
+#   location /protected-media/ { internal; alias /path/to/media/; }
+AUDIO_ACCEL_REDIRECT_PREFIX = os.environ.get('AUDIO_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+# Uploaded songs stay pending (unavailable) until one of AUDIO_PROCESSING_WORKERS background
+# threads (0 probes inline) has read their duration, bitrate, sample rate, loudness and tags.
+# The queue is in memory: run the process_pending_songs command after restarts.
+AUDIO_PROCESSING_WORKERS = int(os.environ.get('AUDIO_PROCESSING_WORKERS', 4))
+
+# Lower-bitrate renditions (kbps) produced for every uploaded song by music_lib.transcoding,
+# on AUDIO_TRANSCODE_WORKERS background threads (0 runs the jobs inline). The encoder is
+# 'ffmpeg' (FFMPEG_BINARY must be installed) or 'stub', a tagged copy used in tests.
+# Clients pick one with ?bitrate= on the stream endpoints or the Save-Data/Downlink hints.
+AUDIO_RENDITION_BITRATES = [64, 128, 256]
+AUDIO_TRANSCODER = os.environ.get('AUDIO_TRANSCODER', 'ffmpeg')
+AUDIO_TRANSCODE_WORKERS = int(os.environ.get('AUDIO_TRANSCODE_WORKERS', 2))
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+# Songs and renditions are also cut into HLS segments of HLS_SEGMENT_DURATION seconds
+# (music_lib.hls). Segments never change, serve them straight from HLS_MEDIA_URL (defaults
+# to MEDIA_URL) with a long cache lifetime; Django only issues the playlists. With
+# HLS_SECURE_LINK_SECRET set, segment URLs carry signatures valid for HLS_SECURE_LINK_TTL
+# seconds. nginx example:
+#   location /media/hls/ {
+#       secure_link $arg_md5,$arg_expires;
+#       secure_link_md5 "$secure_link_expires$uri <HLS_SECURE_LINK_SECRET>";
+#       if ($secure_link = "") { return 403; }
+#       if ($secure_link = "0") { return 410; }
+#       add_header Cache-Control "public, max-age=31536000, immutable";
+#       alias /path/to/media/hls/;
+#   }
+HLS_PACKAGING = os.environ.get('HLS_PACKAGING', 'true').lower() == 'true'
+HLS_SEGMENT_DURATION = int(os.environ.get('HLS_SEGMENT_DURATION', 6))
+HLS_MEDIA_URL = os.environ.get('HLS_MEDIA_URL') or None
+HLS_SECURE_LINK_SECRET = os.environ.get('HLS_SECURE_LINK_SECRET', '')
+HLS_SECURE_LINK_TTL = int(os.environ.get('HLS_SECURE_LINK_TTL', 6 * 60 * 60))
+
+# Album covers, artist avatars and thumbnails and playlist covers are resized to each of the
+# IMAGE_VARIANT_WIDTHS (never upscaled) in each of the IMAGE_VARIANT_FORMATS by music_lib.images,
+# on IMAGE_VARIANT_WORKERS background threads (0 runs the jobs inline). The API lists them as a
+# srcset per content type next to the original. Variants live under MEDIA_URL/images/ in
+# directories named after the source content, so they never change. nginx example:
+#   location /media/images/ {
+#       add_header Cache-Control "public, max-age=31536000, immutable";
+#       alias /path/to/media/images/;
+#   }
+IMAGE_VARIANT_WIDTHS = [96, 320, 640]
+IMAGE_VARIANT_FORMATS = ['webp', 'jpeg']
+IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', 2))
+
+# Songs, covers, avatars and thumbnails are stored under MEDIA_URL/blobs/ named after the SHA-256
+# of their content (music_lib.storage), computed by the upload handlers below as the request body
+# is read. Identical uploads share one file; music_lib.blobs counts the references to each and the
+# collect_media command (e.g. daily from cron) removes the files unreferenced for longer than
+# MEDIA_BLOB_GRACE_PERIOD seconds. Blob URLs never serve other bytes and the digest is their
+# ETag. nginx example:
+#   location /media/blobs/ {
+#       add_header Cache-Control "public, max-age=31536000, immutable";
+#       alias /path/to/media/blobs/;
+#   }
+FILE_UPLOAD_HANDLERS = [
+    'music_lib.storage.HashingMemoryFileUploadHandler',
+    'music_lib.storage.HashingTemporaryFileUploadHandler',
+]
+MEDIA_BLOB_GRACE_PERIOD = int(os.environ.get('MEDIA_BLOB_GRACE_PERIOD', 60 * 60))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Serialized catalog payloads (music_lib.cache). The local-memory default is per process;
+    # point it at a shared backend (e.g. django.core.cache.backends.redis.RedisCache) when
+    # running several workers so that invalidations reach all of them.
+    'catalog': {
+        'BACKEND': os.environ.get('CATALOG_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CATALOG_CACHE_LOCATION', 'catalog'),
+        'TIMEOUT': int(os.environ.get('CATALOG_CACHE_TIMEOUT', 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 100_000)),
+        },
+    },
+    # Revoked JWTs (users.authentication), each kept until the token would have expired. Point it
+    # at a shared backend when running several workers, and size it so that entries are never
+    # culled: a revocation only holds where it is stored.
+    'jwt-denylist': {
+        'BACKEND': os.environ.get('JWT_DENYLIST_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('JWT_DENYLIST_CACHE_LOCATION', 'jwt-denylist'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('JWT_DENYLIST_CACHE_MAX_ENTRIES', 1_000_000)),
+        },
+    },
+}
+# Backends whose entries only live in the process that wrote them, if at all.
+PER_PROCESS_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+CATALOG_CACHE_ALIAS = 'catalog'
+# Origin (e.g. https://music.example.com) the file URLs of cached catalog payloads are made
+# absolute on. Cached payloads never depend on the Host header of the request that built them;
+# without it their URLs are relative to the site.
+PUBLIC_ORIGIN = os.environ.get('PUBLIC_ORIGIN') or None
+JWT_DENYLIST_CACHE_ALIAS = 'jwt-denylist'
+
+# Play events are buffered per process and written in batches (see music_lib.play_events).
+PLAY_EVENTS_BATCH_SIZE = int(os.environ.get('PLAY_EVENTS_BATCH_SIZE', 500))
+PLAY_EVENTS_FLUSH_INTERVAL = float(os.environ.get('PLAY_EVENTS_FLUSH_INTERVAL', 5))
+
+# Related songs (music_lib.recommendations): the RECOMMENDATIONS_NEIGHBOURS most similar songs
+# are kept per song. Plays older than RECOMMENDATIONS_PLAY_WINDOW_DAYS are ignored, and only the
+# RECOMMENDATIONS_MAX_USER_SONGS most recent songs of a listener count, so that a few heavy
+# listeners do not dominate (and slow down) the co-occurrence counts. Pairs shared by fewer than
+# RECOMMENDATIONS_MIN_COOCCURRENCE listeners are noise and dropped.
+RECOMMENDATIONS_NEIGHBOURS = int(os.environ.get('RECOMMENDATIONS_NEIGHBOURS', 50))
+RECOMMENDATIONS_PLAY_WINDOW_DAYS = int(os.environ.get('RECOMMENDATIONS_PLAY_WINDOW_DAYS', 180))
+RECOMMENDATIONS_MAX_USER_SONGS = int(os.environ.get('RECOMMENDATIONS_MAX_USER_SONGS', 500))
+RECOMMENDATIONS_MIN_COOCCURRENCE = int(os.environ.get('RECOMMENDATIONS_MIN_COOCCURRENCE', 2))
+
+# Trending charts (music_lib.charts) for the last hour, day and week: the CHARTS_SIZE most
+# played songs overall and the CHARTS_ARTIST_SIZE most played of each artist. They are as fresh
+# as the last run of the refresh_charts command (e.g. every five minutes from cron); hourly play
+# rollups are kept for CHARTS_ROLLUP_RETENTION_DAYS.
+CHARTS_SIZE = int(os.environ.get('CHARTS_SIZE', 100))
+CHARTS_ARTIST_SIZE = int(os.environ.get('CHARTS_ARTIST_SIZE', 10))
+CHARTS_ROLLUP_RETENTION_DAYS = int(os.environ.get('CHARTS_ROLLUP_RETENTION_DAYS', 30))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -143,7 +305,7 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -153,10 +315,29 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
+if INSTRUMENTATION_ENABLED:
+    # The same classes, reporting the auth and render phases.
+    REST_FRAMEWORK.update({
+        'DEFAULT_AUTHENTICATION_CLASSES': ('middlewares.instrumentation.TimedJWTAuthentication',),
+        'DEFAULT_RENDERER_CLASSES': (
+            'middlewares.instrumentation.TimedJSONRenderer',
+            'rest_framework.renderers.BrowsableAPIRenderer',
+        ),
+    })
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
     "REFRESH_TOKEN_LIFETIME": timedelta(hours=1)
 }
+# Stateless JWT authentication (users.authentication): the user of an access token is built
+# from its claims and only loaded from the database when a view reads more than its id.
+# Deactivating or deleting a user revokes their tokens, which only holds in every worker with a
+# shared jwt-denylist cache: on by default with one, the users.E001 check rejects it without.
+# The JWT_DECODED_TOKEN_CACHE_SIZE most recently used tokens are kept decoded per process,
+# skipping the signature check.
+JWT_STATELESS_AUTH = os.environ.get(
+    'JWT_STATELESS_AUTH', str(CACHES[JWT_DENYLIST_CACHE_ALIAS]['BACKEND'] not in PER_PROCESS_CACHE_BACKENDS),
+).lower() in ('true', '1')
+JWT_DECODED_TOKEN_CACHE_SIZE = int(os.environ.get('JWT_DECODED_TOKEN_CACHE_SIZE', 4096))
 CORS_ALLOW_HEADERS = list(default_headers) + [
     'withCredentials',
 ]
@@ -2,6 +2,16 @@
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 import os
 
+
+# Connections are kept open for DB_CONN_MAX_AGE seconds ('None' for unlimited, 0 to close
+# them after each request) and checked before reuse, so requests skip the connect cost.
+# DB_POOL=true uses a psycopg 3 connection pool instead (psycopg[pool] must be installed;
+# sized by DB_POOL_MIN_SIZE/DB_POOL_MAX_SIZE), which also suits ASGI, where persistent
+# connections are not reused. Behind PgBouncer in transaction mode set
+# DB_DISABLE_SERVER_SIDE_CURSORS=true.
+DB_POOL = os.environ.get('DB_POOL', 'False').lower() in ('true', '1')
+DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '60')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -10,5 +20,16 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD'),
         'HOST': os.environ.get('DB_HOST'),
         'PORT': os.environ.get('DB_PORT'),
+        # Pooled connections go back to the pool after each request instead.
+        'CONN_MAX_AGE': 0 if DB_POOL else (None if DB_CONN_MAX_AGE == 'None' else int(DB_CONN_MAX_AGE)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'True').lower() in ('true', '1'),
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_DISABLE_SERVER_SIDE_CURSORS', 'False').lower() in ('true', '1'),
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            },
+        } if DB_POOL else {},
     }
-}
\ No newline at end of file
+}
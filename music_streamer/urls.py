@@ -17,9 +17,12 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from rest_framework.permissions import AllowAny
 
+from middlewares.instrumentation import metrics_view
+from music_lib.images import VARIANTS_PREFIX
+from music_lib.storage import BLOBS_PREFIX, serve_immutable
 from users.views import CustomTokenRefreshView, CustomTokenObtainPairView, TokenClearView
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
@@ -38,9 +41,15 @@ urlpatterns = [
     ), name='token_clear'),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    path('metrics/', metrics_view, name='metrics'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
 ]
 
 if settings.DEBUG:
+    # Before the other media files, which are served without cache headers.
+    urlpatterns.append(re_path(
+        rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>(?:{VARIANTS_PREFIX}|{BLOBS_PREFIX})/.*)$', serve_immutable,
+        {'document_root': settings.MEDIA_ROOT},
+    ))
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
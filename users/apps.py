@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.core.checks import Tags, register
+
+        from users.checks import check_stateless_auth_denylist
+        from users.signals import connect_signals
+
+        connect_signals()
+        register(check_stateless_auth_denylist, Tags.security, Tags.caches)
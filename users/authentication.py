@@ -0,0 +1,163 @@
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import aware_utcnow
+
+DENYLIST_PREFIX = 'jwt-denylist'
+
+
+def load_user(user_id):
+    """The active user ``user_id`` of a token, as ``JWTAuthentication.get_user`` would return it."""
+    try:
+        user = get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user_id})
+    except get_user_model().DoesNotExist:
+        raise AuthenticationFailed(_("User not found"), code="user_not_found")
+    if not api_settings.USER_AUTHENTICATION_RULE(user):
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+    return user
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    The user of a verified access token. ``pk``, ``id`` and the authentication flags come
+    from the token claims; any other attribute loads the user row, once per request.
+
+    Assumes ``USER_ID_FIELD`` is the primary key, as it is by default. Filter the ORM on
+    ``user.pk`` rather than ``user``: model instance checks load the row.
+    """
+
+    def __init__(self, user_id) -> None:
+        super().__init__(lambda: load_user(user_id))
+        # Claims hold the id as a string. Set through __dict__, LazyObject forwards attribute
+        # assignments to the wrapped user.
+        self.__dict__['user_id'] = get_user_model()._meta.pk.to_python(user_id)
+
+    @property
+    def pk(self):
+        return self.__dict__['user_id']
+
+    id = pk
+
+    @property
+    def is_authenticated(self) -> bool:
+        return True
+
+    @property
+    def is_anonymous(self) -> bool:
+        return False
+
+    def __bool__(self) -> bool:
+        return True
+
+
+class TokenCache:
+    """
+    ``lru_cache`` of ``function`` holding ``JWT_DECODED_TOKEN_CACHE_SIZE`` entries, read when
+    it is first used rather than at import. ``cache_clear`` drops it and the next call sizes
+    it again.
+    """
+
+    def __init__(self, function) -> None:
+        self.function = function
+        self.cached = None
+
+    def get(self):
+        cached = self.cached
+        if cached is None:
+            cached = self.cached = lru_cache(maxsize=settings.JWT_DECODED_TOKEN_CACHE_SIZE)(self.function)
+        return cached
+
+    def __call__(self, raw_token: bytes):
+        return self.get()(raw_token)
+
+    def cache_info(self):
+        return self.get().cache_info()
+
+    def cache_clear(self) -> None:
+        self.cached = None
+
+
+@TokenCache
+def decode_token(raw_token: bytes):
+    """
+    The validated token of ``raw_token``. Signature checks dominate authentication once the
+    user is not loaded, and clients send the same token until it expires, so the tokens
+    are kept per process. Only valid tokens are cached; expiry is checked on every use.
+    """
+    return JWTAuthentication().get_validated_token(raw_token)
+
+
+def get_denylist():
+    return caches[settings.JWT_DENYLIST_CACHE_ALIAS]
+
+
+def revoke_token(token) -> None:
+    """Deny ``token`` until it expires, after which it would be rejected anyway."""
+    ttl = int(token['exp'] - time.time())
+    if ttl > 0:
+        get_denylist().set(f'{DENYLIST_PREFIX}:jti:{token[api_settings.JTI_CLAIM]}', True, ttl)
+
+
+def revoke_user_tokens(user_id) -> None:
+    """
+    Deny every token issued to ``user_id`` so far, including those issued in the current
+    second, until the longest lived of them expires.
+    """
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    get_denylist().set(f'{DENYLIST_PREFIX}:user:{user_id}', int(time.time()), int(lifetime.total_seconds()))
+
+
+def is_revoked(token) -> bool:
+    """One cache round trip for the token itself and the revocations of its user."""
+    token_key = f'{DENYLIST_PREFIX}:jti:{token.get(api_settings.JTI_CLAIM)}'
+    user_key = f'{DENYLIST_PREFIX}:user:{token.get(api_settings.USER_ID_CLAIM)}'
+    denied = get_denylist().get_many([token_key, user_key])
+    return token_key in denied or (user_key in denied and token.get('iat', 0) <= denied[user_key])
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` with decoded tokens cached per process and revocation through the
+    denylist. With ``JWT_STATELESS_AUTH`` the user is a ``ClaimsUser`` and requests that
+    only need its id don't query the database; deactivated and deleted users are kept out
+    by ``users.signals`` revoking their tokens.
+    """
+
+    def get_validated_token(self, raw_token: bytes):
+        token = decode_token(raw_token)
+        try:
+            # Against the current time, the token's own is that of its decoding.
+            token.check_exp(current_time=aware_utcnow())
+        except TokenError as e:
+            raise InvalidToken({
+                "detail": _("Given token not valid for any token type"),
+                "messages": [{"token_class": type(token).__name__, "token_type": token.token_type, "message": e.args[0]}],
+            })
+        if is_revoked(token):
+            raise InvalidToken(_("Token has been revoked"))
+        return token
+
+    def get_user(self, validated_token):
+        if not settings.JWT_STATELESS_AUTH:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        return ClaimsUser(user_id)
+
+
+class ClaimsJWTScheme(SimpleJWTScheme):
+    # Documented as the bearer scheme of JWTAuthentication, the timed subclass included.
+    target_class = 'users.authentication.ClaimsJWTAuthentication'
+    match_subclasses = True
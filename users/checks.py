@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Error
+
+
+def check_stateless_auth_denylist(app_configs, **kwargs):
+    """Stateless authentication relies on the denylist to keep deactivated and deleted users out."""
+    backend = settings.CACHES.get(settings.JWT_DENYLIST_CACHE_ALIAS, {}).get('BACKEND')
+    if settings.JWT_STATELESS_AUTH and backend in settings.PER_PROCESS_CACHE_BACKENDS:
+        return [Error(
+            f'JWT_STATELESS_AUTH is on with a per-process JWT denylist cache ({backend}).',
+            hint=(
+                'Revoked tokens would only be denied by the worker that revoked them. Point '
+                'JWT_DENYLIST_CACHE_BACKEND at a shared cache (e.g. Redis), or turn JWT_STATELESS_AUTH off.'
+            ),
+            id='users.E001',
+        )]
+    return []
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+INDEX_NAME = 'users_liked_songs_song_user'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_user_liked_songs'),
+    ]
+
+    operations = [
+        # The auto-created through table has no model state to add an index to. The unique
+        # (user_id, song_id) index answers the liked songs of a user; this one the listeners
+        # of a song, and the like counts, from the index alone.
+        migrations.RunSQL(
+            f'CREATE INDEX {INDEX_NAME} ON users_user_liked_songs (song_id, user_id)',
+            f'DROP INDEX {INDEX_NAME}',
+        ),
+    ]
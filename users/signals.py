@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+
+from users.authentication import revoke_user_tokens
+
+
+def revoke_tokens_of_deactivated_user(sender, instance, created, update_fields, **kwargs):
+    # Stateless authentication doesn't read is_active, so the tokens still out there are denied.
+    if not created and not instance.is_active and (update_fields is None or 'is_active' in update_fields):
+        revoke_user_tokens(instance.pk)
+
+
+def revoke_tokens_of_deleted_user(sender, instance, **kwargs):
+    revoke_user_tokens(instance.pk)
+
+
+def connect_signals() -> None:
+    User = get_user_model()
+
+    post_save.connect(
+        revoke_tokens_of_deactivated_user,
+        sender=User,
+        dispatch_uid='users.authentication.user_post_save',
+    )
+    post_delete.connect(
+        revoke_tokens_of_deleted_user,
+        sender=User,
+        dispatch_uid='users.authentication.user_post_delete',
+    )
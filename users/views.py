@@ -3,8 +3,12 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from users.authentication import is_revoked, revoke_token
+
 
 # Create your views here.
 class CustomTokenObtainPairView(TokenObtainPairView):
@@ -38,6 +42,13 @@ class CustomTokenRefreshView(TokenRefreshView):
 
         if not refresh_token:
             return Response({'error': 'Refresh token missing'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            revoked = is_revoked(RefreshToken(refresh_token))
+        except TokenError:
+            # Rejected with the details by the serializer.
+            revoked = False
+        if revoked:
+            return Response({'error': 'Refresh token revoked'}, status=status.HTTP_401_UNAUTHORIZED)
 
         request.data['refresh'] = refresh_token
         response = super().post(request, *args, **kwargs)
@@ -57,6 +68,15 @@ class CustomTokenRefreshView(TokenRefreshView):
 
 class TokenClearView(APIView):
     def post(self, request: Request) -> Response:
+        # Deleting the cookies does not invalidate copies of the tokens.
+        for name, token_class in (('access_token', AccessToken), ('refresh_token', RefreshToken)):
+            raw_token = request.COOKIES.get(name)
+            if raw_token:
+                try:
+                    revoke_token(token_class(raw_token))
+                except TokenError:
+                    pass
+
         res = Response()
         res.delete_cookie('access_token')
         res.delete_cookie('refresh_token')